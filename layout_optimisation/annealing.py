@@ -1,36 +1,59 @@
 from __future__ import annotations
 
-import copy
+import heapq
 import logging
 import math
 import random
+from collections import Counter
+from contextlib import contextmanager
 from functools import partial
 from multiprocessing import Pool
 from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from tqdm import tqdm, trange
 
-from layout_optimisation.layouts.base import Keyboard, KeyMap, Layout
+from layout_optimisation.budget import Budget
+from layout_optimisation.cache import ScoreCache, SharedScoreTable, score_fingerprint
+from layout_optimisation.checkpoint import Checkpoint, checkpoint_fingerprint
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.gains import SwapGains
+from layout_optimisation.layouts.base import CompactLayout, Keyboard, KeyMap, Layout
 from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
-from layout_optimisation.penalty import evaluate
+from layout_optimisation.moves import SearchSpace, SwapGenerator
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+from layout_optimisation.racing import race
+from layout_optimisation.schedule import make_schedule
+from layout_optimisation.scorer import SwapScorer
+from layout_optimisation.tables import PositionTables
+from layout_optimisation.utils import write_atomic
 
 from .layouts.layouts import LAYOUTS
 
 logger = logging.getLogger(__name__)
 
+# State of a pool worker, set once by init_worker so that only layouts and scores are sent to workers afterwards
+_worker_state = {}
+# Smaller gains of polishing are left to rounding errors of incrementally updated gains
+POLISH_MIN_GAIN = 1e-9
+
 
 # http://mkweb.bcgsc.ca/carpalx/?simulated_annealing
-def generate_initial_layouts(cfg: dict) -> List[List[str]]:
+def generate_initial_layouts(
+    cfg: dict, corpus: Corpus = None, dir_weights: Dict[str, float] = None, rng: random.Random = random
+) -> List[List[str]]:
+    """If corpus is given, layouts are sorted by their score, best first"""
     template = generate_key_map_template(cfg)
     keyboard = generate_keyboard(template, cfg)
 
     total_keys = len(template) * cfg["annealing"]["max_layers"]
+    space = SearchSpace(total_keys, cfg)
     layouts = []
     for l_name, layout in LAYOUTS.items():
-        flat_keys = layout.flatten(total_keys)
         try:
+            flat_keys = space.repair(layout.flatten(total_keys))
             Layout.from_flat(flat_keys, template, keyboard)
         except ValueError:
             logger.warning(f"Couldn't flatten {l_name}")
@@ -38,76 +61,448 @@ def generate_initial_layouts(cfg: dict) -> List[List[str]]:
         layouts.append(flat_keys)
 
     while len(layouts) < cfg["annealing"]["num_layouts"]:
-        new_keys = copy.copy(layouts[-1])
-        random.shuffle(new_keys)
-        layouts.append(new_keys)
+        layouts.append(space.shuffle(layouts[-1], rng))
+
+    if corpus is not None:
+        layouts, energies = sort_layouts(layouts, keyboard, corpus, cfg, dir_weights)
+        logger.info(f"Best initial score={energies[0]:.3f}")
     return layouts
 
 
-def combine_and_evaluate(
+def evaluate_layouts(
+    layouts: List[List[str]], keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None
+) -> np.ndarray:
+    """Total penalty of each of flat layouts, evaluated in a single batch"""
+    perms = np.stack([CompactLayout.from_flat(flat_keys, len(keyboard)).keys for flat_keys in layouts])
+    return evaluate_batch(perms, keyboard, corpus, cfg, dir_weights)[:, get_penalty_terms().index("total")]
+
+
+def sort_layouts(
+    layouts: List[List[str]], keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None
+) -> Tuple[List[List[str]], np.ndarray]:
+    """Flat layouts sorted by their total penalty, best first, with their sorted scores"""
+    energies = evaluate_layouts(layouts, keyboard, corpus, cfg, dir_weights)
+    order = np.argsort(energies, kind="stable")
+    return [layouts[idx] for idx in order], energies[order]
+
+
+def polish(
+    flat_keys: List[str], keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None
+) -> Tuple[List[str], float]:
+    """Steepest descent over swaps of free positions, until no swap improves the score"""
+    space = SearchSpace(len(flat_keys), cfg)
+    flat_keys = space.repair(flat_keys)
+    keys = CompactLayout.from_flat(flat_keys, len(keyboard)).keys
+    free = np.array(space.free)
+    first, second = np.triu_indices(len(free), k=1)
+    first, second = free[first], free[second]
+    gains = SwapGains(keys, keyboard, corpus, cfg, dir_weights)
+
+    while True:
+        pair_gains = gains.matrix[first, second]
+        best = int(np.argmin(pair_gains))
+        if pair_gains[best] > -POLISH_MIN_GAIN:
+            break
+        first_idx, second_idx = first[best], second[best]
+        flat_keys[first_idx], flat_keys[second_idx] = flat_keys[second_idx], flat_keys[first_idx]
+        gains.apply(first_idx, second_idx)
+    energy = evaluate_layouts([flat_keys], keyboard, corpus, cfg, dir_weights)[0]
+    return flat_keys, energy
+
+
+def anneal(
     flat_keys: List[str],
-    template: KeyMap,
+    temperature: float,
+    num_iters: int,
     keyboard: Keyboard,
-    text_dir: Path,
+    corpus: Corpus,
     cfg: dict,
     dir_weights: Dict[str, float] = None,
-) -> float:
-    layout = Layout.from_flat(flat_keys, template, keyboard)
-    return evaluate(layout, text_dir, cfg, dir_weights)
-
-
-def anneal(flat_keys: List[str], temperature: float, num_iters: int, **kwargs) -> List[Tuple[List[str], float]]:
-    prev_energy = combine_and_evaluate(flat_keys, **kwargs)["total"]
-    best_layouts = [(flat_keys, prev_energy)]
+    score_cache: ScoreCache = None,
+    acceptance: Counter = None,
+    rng: random.Random = random,
+    keep_top: int = None,
+) -> Tuple[List[Tuple[List[str], float]], Tuple[List[str], float]]:
+    """Returns best distinct visited layouts sorted by score and the last state, counts uphill swaps in acceptance"""
+    # Only free positions are permuted, so frozen keys and blocked indexes never need to be checked
+    space = SearchSpace(len(flat_keys), cfg)
+    flat_keys = space.repair(flat_keys)
+    # Swaps are scored incrementally, rejected swaps are simply not committed
+    scorer = SwapScorer(flat_keys, keyboard, corpus, cfg, dir_weights, constrained=True)
+    if score_cache is None:
+        score_cache = ScoreCache(score_fingerprint(cfg, corpus, dir_weights), cfg["annealing"]["score_cache_size"])
+    # Hash of the current layout is updated with each swap, instead of hashing every proposed layout
+    hasher = score_cache.hasher(len(flat_keys))
+    current_keys = list(flat_keys)
+    layout_hash = hasher.hash_flat(current_keys)
+    prev_energy = scorer.penalties["total"]
+    if keep_top is None:
+        keep_top = cfg["annealing"]["keep_top"]
+    # Heap of best layouts with negated scores, so that the worst of them is replaced first,
+    # layouts are only copied when they get in, so memory doesn't grow with number of accepted swaps
+    best_heap = [(-prev_energy, layout_hash, flat_keys)]
+    best_hashes = {layout_hash}
+    swaps = SwapGenerator(space, rng)
+    uphill = accepted = 0
     for _ in trange(num_iters, desc="Annealing", disable=True):
-        new_keys = copy.copy(flat_keys)
-        first_idx = random.randint(0, len(new_keys) - 1)
-        second_idx = random.randint(0, len(new_keys) - 1)
-        new_keys[first_idx], new_keys[second_idx] = new_keys[second_idx], new_keys[first_idx]
-        new_energy = combine_and_evaluate(new_keys, **kwargs)["total"]
+        first_idx, second_idx = swaps.propose(current_keys)
+        new_hash = hasher.swap_flat(layout_hash, current_keys, first_idx, second_idx)
+        new_energy = score_cache.get(new_hash)
+        proposed = new_energy is None
+        if proposed:
+            new_energy = scorer.propose_swap(first_idx, second_idx)["total"]
+            score_cache.put(new_hash, new_energy)
         d_e = new_energy - prev_energy
-        if d_e < 0 or math.exp(-d_e / temperature) > random.uniform(0, 1):
+        uphill += d_e > 0
+        if d_e < 0 or math.exp(-d_e / temperature) > rng.uniform(0, 1):
+            accepted += d_e > 0
+            if not proposed:
+                scorer.propose_swap(first_idx, second_idx)
+            scorer.commit()
+            current_keys[first_idx], current_keys[second_idx] = current_keys[second_idx], current_keys[first_idx]
+            layout_hash = new_hash
             prev_energy = new_energy
-            flat_keys = new_keys
-            best_layouts.append((flat_keys, prev_energy))
-    return best_layouts
+            if layout_hash in best_hashes:
+                continue
+            if len(best_heap) < keep_top:
+                heapq.heappush(best_heap, (-prev_energy, layout_hash, list(current_keys)))
+            elif prev_energy < -best_heap[0][0]:
+                _, worst_hash, _ = heapq.heapreplace(best_heap, (-prev_energy, layout_hash, list(current_keys)))
+                best_hashes.discard(worst_hash)
+            else:
+                continue
+            best_hashes.add(layout_hash)
+    if acceptance is not None:
+        acceptance.update(uphill=uphill, uphill_accepted=accepted)
+    best_layouts = [(keys, -neg_energy) for neg_energy, _, keys in sorted(best_heap, reverse=True)]
+    return best_layouts, (current_keys, prev_energy)
+
+
+def init_worker(
+    keyboard: Keyboard,
+    corpus: Corpus,
+    cfg: dict,
+    dir_weights: Dict[str, float] = None,
+    shared_scores: SharedScoreTable = None,
+    fidelity_corpora: Dict[float, Corpus] = None,
+):
+    """Subsampled corpora of the fidelity schedule get score caches of their own, since their scores differ"""
+    cache_size = cfg["annealing"]["score_cache_size"]
+    score_cache = ScoreCache(score_fingerprint(cfg, corpus, dir_weights), cache_size, shared_scores)
+    fidelities = {
+        fraction: (fidelity_corpus, ScoreCache(score_fingerprint(cfg, fidelity_corpus, dir_weights), cache_size))
+        for fraction, fidelity_corpus in (fidelity_corpora or {}).items()
+    }
+    _worker_state.update(
+        keyboard=keyboard,
+        corpus=corpus,
+        cfg=cfg,
+        dir_weights=dir_weights,
+        score_cache=score_cache,
+        fidelities=fidelities,
+    )
+
+
+def worker_state() -> dict:
+    """State of this pool worker, which was set by init_worker"""
+    return dict(_worker_state)
+
+
+def anneal_in_worker(
+    flat_keys: List[str], temperature: float, num_iters: int, seed: int = None, fidelity: float = 1.0
+) -> Tuple[List[Tuple[List[str], float]], Dict[str, int]]:
+    """Anneal with state of the worker, returns best layouts with cache and acceptance stats of this call"""
+    state = worker_state()
+    corpus, score_cache = state["corpus"], state["score_cache"]
+    if fidelity < 1:
+        corpus, score_cache = state["fidelities"][fidelity]
+    rng = random
+    if seed is not None:
+        # Cached scores of other layouts can differ in last bits, so seeded chains don't depend on the worker
+        score_cache = score_cache.local()
+        rng = random.Random(seed)
+    prev_stats = score_cache.stats
+    acceptance = Counter()
+    best_layouts, _ = anneal(
+        flat_keys,
+        temperature,
+        num_iters,
+        state["keyboard"],
+        corpus,
+        state["cfg"],
+        state["dir_weights"],
+        score_cache,
+        acceptance,
+        rng,
+    )
+    stats = {key: value - prev_stats[key] for key, value in score_cache.stats.items()}
+    return best_layouts, {**stats, **acceptance}
+
+
+def anneal_chain_in_worker(
+    chain: Tuple[List[str], float, Optional[int]], num_iters: int, fidelity: float = 1.0
+) -> Tuple[List[Tuple[List[str], float]], Dict[str, int]]:
+    """anneal_in_worker for flat keys of a chain with its own temperature and seed"""
+    flat_keys, temperature, seed = chain
+    return anneal_in_worker(flat_keys, temperature, num_iters, seed, fidelity)
+
+
+def evaluate_in_worker(layouts: List[List[str]], fidelity: float = 1.0) -> np.ndarray:
+    """evaluate_layouts with state of the worker, with n-gram counts of given fidelity"""
+    corpus = _worker_state["fidelities"][fidelity][0] if fidelity < 1 else _worker_state["corpus"]
+    return evaluate_layouts(
+        layouts, _worker_state["keyboard"], corpus, _worker_state["cfg"], _worker_state["dir_weights"]
+    )
+
+
+def rescore_in_pool(p: Pool, layouts: List[List[str]], fidelity: float) -> List[float]:
+    """Scores of layouts with n-gram counts of given fidelity, each layout is a task of its own"""
+    func = partial(evaluate_in_worker, fidelity=fidelity)
+    return np.concatenate(p.map(func, [[flat_keys] for flat_keys in layouts])).tolist()
+
+
+def fidelity_fractions(annealing: dict) -> List[float]:
+    """Fractions of n-gram counts of the fidelity schedule, other than the full corpus"""
+    return sorted({fraction for _, fraction in annealing["fidelity_schedule"] if fraction < 1})
+
+
+def fidelity_at(annealing: dict, progress: float) -> float:
+    """Fraction of n-gram counts to score swaps with at given progress through the budget"""
+    fidelity = 1.0
+    for start, fraction in annealing["fidelity_schedule"]:
+        if progress >= start:
+            fidelity = fraction
+    return fidelity
+
+
+@contextmanager
+def worker_args(keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None) -> tuple:
+    """Arguments of init_worker for other processes, shared memory is released on exit"""
+    annealing = cfg["annealing"]
+    # Compile tables once here, so that workers receive them instead of building their own
+    PositionTables.for_keyboard(keyboard, cfg, annealing["max_layers"])
+    # Workers attach to the same n-gram arrays, so memory doesn't grow with number of processes
+    shared_corpus = corpus.share()
+    shared_size = annealing["shared_score_cache_size"]
+    shared_scores = SharedScoreTable.create(shared_size) if shared_size > 0 else None
+    fidelity_corpora = {fraction: corpus.subsample(fraction).share() for fraction in fidelity_fractions(annealing)}
+    try:
+        yield keyboard, shared_corpus, cfg, dir_weights, shared_scores, fidelity_corpora
+    finally:
+        shared_corpus.close()
+        if shared_scores is not None:
+            shared_scores.close()
+        for fidelity_corpus in fidelity_corpora.values():
+            fidelity_corpus.close()
+
+
+@contextmanager
+def worker_pool(keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None) -> Pool:
+    with worker_args(keyboard, corpus, cfg, dir_weights) as init_args:
+        with Pool(cfg["annealing"]["num_processes"], initializer=init_worker, initargs=init_args) as p:
+            yield p
+
+
+def cache_hit_rate(cache_stats: Dict[str, int]) -> float:
+    return cache_stats["hits"] / max(cache_stats["hits"] + cache_stats["misses"], 1)
+
+
+def log_cache_stats(cache_stats: Dict[str, int]):
+    logger.info(
+        f"Score cache: {cache_stats['hits']} hits ({cache_stats['shared_hits']} from shared table), "
+        f"{cache_stats['misses']} misses"
+    )
 
 
 def run_annealing(cfg: dict, **kwargs) -> Layout:
-    layouts = generate_initial_layouts(cfg)
+    """Optional time_limit in seconds and eval_budget in proposed swaps of all chains replace num_iters as the budget"""
     annealing = cfg["annealing"]
-    temperature = annealing["init_temperature"]
+    checkpoint_path = kwargs.get("checkpoint_path")
+    fingerprint = checkpoint_fingerprint(cfg, kwargs["corpus"], kwargs.get("dir_weights"))
+    seed = kwargs.get("seed")
+    rng = random.Random(seed)
     num_iters = annealing["num_iters"]
     iters_per_cycle = annealing["iters_per_cycle"]
     num_cycles = num_iters // iters_per_cycle
-    cooling_rate = (annealing["final_temperature"] / temperature) ** (1 / num_cycles)
+    if kwargs.get("eval_budget") is not None:
+        num_cycles = max(kwargs["eval_budget"] // (iters_per_cycle * annealing["num_layouts"]), 1)
+    elif kwargs.get("time_limit") is not None:
+        num_cycles = None
+    schedule = make_schedule(annealing)
 
     template = generate_key_map_template(cfg)
     keyboard = generate_keyboard(template, cfg)
     kwargs.update({"cfg": cfg, "template": template, "keyboard": keyboard})
+    cache_stats = Counter()
+    best_saver = BestSaver(kwargs.get("best_path"), template, keyboard, cfg)
+
+    checkpoint = None
+    if kwargs.get("resume"):
+        checkpoint = Checkpoint.load(checkpoint_path, fingerprint)
+        layouts, energies = checkpoint.layouts, checkpoint.energies
+        temperatures, stalls, frozen = checkpoint.temperatures, checkpoint.stalls, checkpoint.frozen
+        fidelity = checkpoint.fidelity
+        rng.setstate(checkpoint.rng_state)
+        best_saver.score = checkpoint.best_score
+        budget = Budget(num_cycles, kwargs.get("time_limit"), checkpoint.cycle, checkpoint.elapsed)
+        logger.info(f"Resuming from cycle {checkpoint.cycle} of {checkpoint_path}")
+    else:
+        budget = Budget(num_cycles, kwargs.get("time_limit"))
+        layouts = generate_initial_layouts(cfg, rng=rng)
+        layouts, energies = sort_layouts(layouts, keyboard, kwargs["corpus"], cfg, kwargs.get("dir_weights"))
+        logger.info(f"Best initial score={energies[0]:.3f}")
+        # Initial layouts are already scored, so that a job killed during the first cycle still leaves a result
+        best_saver.update(layouts[0], energies[0])
+        # Each chain keeps its temperature, score, number of cycles without improvement and whether it is frozen,
+        # kept layouts inherit them
+        temperatures = [annealing["init_temperature"]] * len(layouts)
+        energies = energies.tolist()
+        stalls = [0] * len(layouts)
+        frozen = [False] * len(layouts)
+        # Fraction of n-gram counts, which energies of chains were scored with
+        fidelity = 1.0
 
-    outer_loop_iterator = trange(num_cycles, desc="Annealing")
+    initial = checkpoint.cycle if checkpoint is not None else 0
+    interrupted = False
+    outer_loop_iterator = tqdm(budget.cycles(), initial=initial, total=num_cycles, desc="Annealing")
     try:
-        for _ in outer_loop_iterator:
-            new_layouts = []
-            with Pool(annealing["num_processes"]) as p:
-                func = partial(anneal, temperature=temperature, num_iters=iters_per_cycle, **kwargs)
-                tqdm_kwargs = dict(desc="Evaluating layouts in a pool", leave=False, total=len(layouts))
-                for proc_layouts in tqdm(p.imap(func, layouts), **tqdm_kwargs):
-                    proc_layouts = sorted(proc_layouts, key=itemgetter(1))
-                    new_layouts.extend(proc_layouts[: annealing["keep_top"]])
-            new_layouts = sorted(new_layouts, key=itemgetter(1))
-            layouts = [l for l, _ in new_layouts[: annealing["num_layouts"]]]
-            temperature *= cooling_rate
-            outer_loop_iterator.set_description(
-                f"Annealing outer loop, best score={new_layouts[0][1]:.3f}, {temperature=:.2f}"
-            )
+        with worker_pool(keyboard, kwargs["corpus"], cfg, kwargs.get("dir_weights")) as p:
+            for cycle in outer_loop_iterator:
+                cycle_stats = Counter()
+                progress = budget.progress(cycle + 1)
+                cycle_fidelity = fidelity_at(annealing, budget.progress(cycle))
+                if cycle_fidelity != fidelity:
+                    # Energies of chains, including frozen ones, are compared with energies of this cycle,
+                    # so they are scored with the same n-gram counts
+                    energies = rescore_in_pool(p, layouts, cycle_fidelity)
+                    fidelity = cycle_fidelity
+                func = partial(anneal_chain_in_worker, num_iters=iters_per_cycle, fidelity=fidelity)
+                seeds = [rng.getrandbits(64) if seed is not None else None for _ in layouts]
+                # Frozen chains are no longer annealed, their layouts are kept as they are
+                active = [idx for idx in range(len(layouts)) if not frozen[idx]]
+                new_layouts = [
+                    (layouts[idx], energies[idx], temperatures[idx], stalls[idx], True)
+                    for idx in range(len(layouts))
+                    if frozen[idx]
+                ]
+                tasks = [(layouts[idx], temperatures[idx], seeds[idx]) for idx in active]
+                tqdm_kwargs = dict(desc="Evaluating layouts in a pool", leave=False, total=len(tasks))
+                for idx, (proc_layouts, proc_stats) in zip(active, tqdm(p.imap(func, tasks), **tqdm_kwargs)):
+                    improved = min(energy for _, energy in proc_layouts) < energies[idx]
+                    uphill, accepted = proc_stats["uphill"], proc_stats["uphill_accepted"]
+                    temperature, stall = schedule.step(
+                        temperatures[idx], stalls[idx], improved, uphill, accepted, progress
+                    )
+                    chain_frozen = schedule.is_frozen(uphill, accepted)
+                    new_layouts.extend(
+                        (flat_keys, energy, temperature, stall, chain_frozen) for flat_keys, energy in proc_layouts
+                    )
+                    cycle_stats.update(proc_stats)
+                cache_stats.update(cycle_stats)
+                new_layouts = sorted(new_layouts, key=itemgetter(1))[: annealing["num_layouts"]]
+                layouts, energies, temperatures, stalls, frozen = map(list, zip(*new_layouts))
+                best_score = energies[0]
+                if fidelity < 1 and best_saver.path is not None:
+                    # Scores of subsampled counts can't be compared with scores of the full corpus
+                    best_score = evaluate_layouts(
+                        layouts[:1], keyboard, kwargs["corpus"], cfg, kwargs.get("dir_weights")
+                    )[0]
+                best_saver.update(layouts[0], best_score)
+                checkpoint = Checkpoint(
+                    cycle + 1,
+                    layouts,
+                    energies,
+                    temperatures,
+                    stalls,
+                    frozen,
+                    fidelity,
+                    rng.getstate(),
+                    budget.elapsed,
+                    best_saver.score,
+                )
+                if checkpoint_path is not None and (cycle + 1) % annealing["checkpoint_interval"] == 0:
+                    checkpoint.save(checkpoint_path, fingerprint)
+                acceptance_rate = cycle_stats["uphill_accepted"] / max(cycle_stats["uphill"], 1)
+                outer_loop_iterator.set_description(
+                    f"Annealing outer loop, best score={energies[0]:.3f}, temperature={temperatures[0]:.2g}, "
+                    f"acceptance={acceptance_rate:.1%}, cache hits={cache_hit_rate(cache_stats):.0%}, "
+                    f"fidelity={fidelity:.0%}, frozen={sum(frozen)}"
+                )
+                if all(frozen):
+                    logger.info(f"Stopping after {cycle + 1} cycles, since acceptance of every chain collapsed")
+                    break
     except KeyboardInterrupt:
         logger.warning(f"Stopping optimisation due to KeyboardInterrupt")
-        if outer_loop_iterator.n == 0:
-            t_iter = tqdm(layouts, desc="Evaluating initial layouts due to fast exit")
-            layout_energies = [(l, combine_and_evaluate(l, **kwargs)["total"]) for l in t_iter]
-            layouts = [l for l, _ in sorted(layout_energies, key=itemgetter(1))]
+        interrupted = True
+        if checkpoint_path is not None and checkpoint is not None:
+            checkpoint.save(checkpoint_path, fingerprint)
+    log_cache_stats(cache_stats)
+    if fidelity < 1:
+        logger.info(
+            f"Re-ranking {len(layouts)} layouts, which were scored on {fidelity:.0%} of n-grams, on full corpus"
+        )
+        layouts, energies = race_layouts(layouts, keyboard, kwargs["corpus"], cfg, kwargs.get("dir_weights"))
+        best_saver.update(layouts[0], energies[0])
 
+    # Polishing runs until no swap improves, so it isn't done if the run is limited by time or evaluations,
+    # or if it was stopped, since it could then take much longer than asked for
+    limited = kwargs.get("time_limit") is not None or kwargs.get("eval_budget") is not None
+    if annealing["polish_top"] > 0 and (interrupted or limited):
+        reason = "optimisation was interrupted" if interrupted else "it is limited by time or evaluation budget"
+        logger.info(f"Skipping polishing, since {reason}")
+    elif annealing["polish_top"] > 0:
+        try:
+            polished = polish_layouts(
+                layouts[: annealing["polish_top"]], keyboard, kwargs["corpus"], cfg, kwargs.get("dir_weights")
+            )
+            layouts = [flat_keys for flat_keys, _ in polished]
+            best_saver.update(*polished[0])
+        except KeyboardInterrupt:
+            logger.warning("Stopping polishing due to KeyboardInterrupt, annealed layouts are returned")
     best_layout = Layout.from_flat(layouts[0], template, keyboard)
     return best_layout
+
+
+class BestSaver:
+    """Writes best layout so far with its score, whenever it improves, so that a usable result is on disk at any time"""
+
+    def __init__(self, path: Optional[Path], template: KeyMap, keyboard: Keyboard, cfg: dict):
+        self.path = path
+        self.template = template
+        self.keyboard = keyboard
+        self.cfg = cfg
+        self.score = math.inf
+
+    def update(self, flat_keys: List[str], score: float):
+        if self.path is None or score >= self.score:
+            return
+        layout = Layout.from_flat(flat_keys, self.template, self.keyboard)
+        self.score = score
+        write_atomic(self.path, f"# score={score:.6f}\n{layout.for_layout(self.cfg)}\n\n{layout.format(self.cfg)}")
+
+
+def race_layouts(
+    layouts: List[List[str]], keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None
+) -> Tuple[List[List[str]], np.ndarray]:
+    """Layouts sorted by score on the full corpus, only layouts which survive racing are fully evaluated"""
+    if not cfg["racing"]["enabled"] or not corpus.file_ngrams:
+        return sort_layouts(layouts, keyboard, corpus, cfg, dir_weights)
+    perms = np.stack([CompactLayout.from_flat(flat_keys, len(keyboard)).keys for flat_keys in layouts])
+    survivors, shard_means = race(perms, keyboard, corpus, cfg, dir_weights)
+    energies = evaluate_layouts([layouts[idx] for idx in survivors], keyboard, corpus, cfg, dir_weights)
+    order = list(survivors[np.argsort(energies, kind="stable")])
+    # Dropped layouts follow in order of their mean scores on shards
+    dropped = np.setdiff1d(np.arange(len(layouts)), survivors)
+    order += list(dropped[np.argsort(shard_means[dropped], kind="stable")])
+    return [layouts[idx] for idx in order], np.sort(energies, kind="stable")
+
+
+def polish_layouts(
+    layouts: List[List[str]], keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None
+) -> List[Tuple[List[str], float]]:
+    """Polish each layout, returns them with their scores sorted by score and logs how much the best score improved"""
+    prev_best = evaluate_layouts(layouts, keyboard, corpus, cfg, dir_weights).min()
+    polished = [polish(flat_keys, keyboard, corpus, cfg, dir_weights) for flat_keys in tqdm(layouts, desc="Polishing")]
+    polished = sorted(polished, key=itemgetter(1))
+    logger.info(f"Polishing improved best score from {prev_best:.4f} to {polished[0][1]:.4f}")
+    return polished
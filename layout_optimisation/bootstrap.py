@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from layout_optimisation.corpus import MAX_NGRAM, Corpus, NGramCounts, grams_to_keys
+from layout_optimisation.layouts.base import Keyboard
+from layout_optimisation.penalty import evaluate_batch
+
+
+class FileBootstrap:
+    """Resamples files of each directory with replacement, as weights of their n-gram counts, without reading texts"""
+
+    def __init__(self, corpus: Corpus):
+        if not corpus.file_ngrams:
+            raise ValueError("Corpus doesn't have counts of files, read it with Corpus.from_dir")
+        self._corpus = corpus
+        # For each directory and n: rows of n-grams of the directory, index of the file and count, and the residual
+        self._file_counts: Dict[str, List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = {}
+        self._residuals: Dict[str, List[np.ndarray]] = {}
+        for dir_name, ngrams in corpus.ngrams.items():
+            files = list(corpus.file_ngrams.get(dir_name, {}).values())
+            # Directories with a single file are the same in every resample
+            if len(files) < 2:
+                continue
+            self._file_counts[dir_name] = []
+            self._residuals[dir_name] = []
+            for n in range(1, MAX_NGRAM + 1):
+                # Counts of directories and files come from np.unique, so keys of their n-grams are sorted
+                dir_keys = grams_to_keys(ngrams.grams(n))
+                rows = np.concatenate([np.searchsorted(dir_keys, grams_to_keys(file.grams(n))) for file in files])
+                file_idx = np.repeat(np.arange(len(files)), [len(file.counts(n)) for file in files])
+                counts = np.concatenate([file.counts(n) for file in files])
+                file_sums = np.bincount(rows, weights=counts, minlength=len(dir_keys)).astype(np.int64)
+                self._file_counts[dir_name].append((rows, file_idx, counts))
+                # N-grams which span two files are kept as they are in every resample
+                self._residuals[dir_name].append(ngrams.counts(n) - file_sums)
+
+    def resample(self, rng: np.random.Generator) -> Corpus:
+        ngrams = {}
+        for dir_name, dir_ngrams in self._corpus.ngrams.items():
+            if dir_name not in self._file_counts:
+                ngrams[dir_name] = dir_ngrams
+                continue
+            num_files = len(self._corpus.file_ngrams[dir_name])
+            weights = rng.multinomial(num_files, np.full(num_files, 1 / num_files))
+            counts = []
+            for (rows, file_idx, file_counts), residual in zip(self._file_counts[dir_name], self._residuals[dir_name]):
+                weighted = np.bincount(rows, weights=file_counts * weights[file_idx], minlength=len(residual))
+                counts.append(residual + weighted.astype(np.int64))
+            grams = [dir_ngrams.grams(n) for n in range(1, MAX_NGRAM + 1)]
+            ngrams[dir_name] = NGramCounts(grams, counts)
+        return Corpus(ngrams)
+
+
+def bootstrap_penalties(
+    perms: np.ndarray,
+    keyboard: Keyboard,
+    corpus: Corpus,
+    cfg: dict,
+    dir_weights: Dict[str, float] = None,
+    no_forced=False,
+    num_resamples: int = 200,
+    seed: int = 0,
+) -> np.ndarray:
+    """Penalties of each row of keys of compact layouts on each resample, shape is (resamples, layouts, terms)"""
+    bootstrap = FileBootstrap(corpus)
+    rng = np.random.default_rng(seed)
+    return np.stack(
+        [
+            evaluate_batch(perms, keyboard, bootstrap.resample(rng), cfg, dir_weights, no_forced)
+            for _ in range(num_resamples)
+        ]
+    )
+
+
+def percentile_interval(samples: np.ndarray, confidence: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Lower and upper bounds of the interval, which has confidence share of samples along the first axis"""
+    tail = (1 - confidence) / 2 * 100
+    return np.percentile(samples, tail, axis=0), np.percentile(samples, 100 - tail, axis=0)
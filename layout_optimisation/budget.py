@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import time
+from typing import Iterator
+
+
+class Budget:
+    """Cycles of optimisation limited by their number, wall-clock time or both, whichever runs out first"""
+
+    def __init__(self, num_cycles: int = None, time_limit: float = None, num_done: int = 0, elapsed: float = 0.0):
+        if num_cycles is None and time_limit is None:
+            raise ValueError("Either number of cycles or time limit is required")
+        self.num_cycles = num_cycles
+        self.time_limit = time_limit
+        # Resumed runs pass cycles and time already spent, so that the budget covers the whole run
+        self._start = time.monotonic() - elapsed
+        self._longest_cycle = 0.0
+        self._num_done = num_done
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def progress(self, cycle: int) -> float:
+        """Fraction of the budget, which will be used once given number of cycles is done"""
+        fractions = []
+        if self.num_cycles is not None:
+            fractions.append(cycle / self.num_cycles)
+        if self.time_limit is not None:
+            expected = self.elapsed + (cycle - self._num_done) * self._longest_cycle
+            fractions.append(expected / self.time_limit)
+        return min(max(fractions), 1.0)
+
+    def cycles(self) -> Iterator[int]:
+        while self._can_start_cycle():
+            cycle_start = time.monotonic()
+            yield self._num_done
+            self._longest_cycle = max(self._longest_cycle, time.monotonic() - cycle_start)
+            self._num_done += 1
+
+    def _can_start_cycle(self) -> bool:
+        if self.num_cycles is not None and self._num_done >= self.num_cycles:
+            return False
+        # Only started if it is expected to finish in time, judging by the longest cycle so far
+        return self.time_limit is None or self.elapsed + self._longest_cycle <= self.time_limit
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.hashing import ZobristHash
+from layout_optimisation.shared import SharedArrays
+
+
+def score_fingerprint(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None) -> bytes:
+    """Digest of everything besides the layout, which affects its score"""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps(cfg, sort_keys=True, default=str).encode())
+    fingerprint.update(json.dumps(dir_weights or {}, sort_keys=True).encode())
+    fingerprint.update(corpus.fingerprint.encode())
+    return fingerprint.digest()
+
+
+# Mixed into check values of shared slots, so that empty slots are never valid
+CHECK_SALT = 0x9E3779B97F4A7C15
+
+
+class SharedScoreTable:
+    """Score slots in shared memory without locks, slots torn by concurrent writes fail their check and miss"""
+
+    def __init__(self, shared: SharedArrays):
+        self._shared = shared
+        self._slots = shared.arrays["slots"]
+
+    @property
+    def size(self) -> int:
+        return len(self._slots)
+
+    def get(self, key: int) -> Optional[float]:
+        slot_key, score_bits, check = (int(value) for value in self._slots[key % len(self._slots)])
+        if slot_key != key or check != key ^ score_bits ^ CHECK_SALT:
+            return None
+        return float(np.uint64(score_bits).view(np.float64))
+
+    def put(self, key: int, score: float):
+        score_bits = int(np.float64(score).view(np.uint64))
+        self._slots[key % len(self._slots)] = (key, score_bits, key ^ score_bits ^ CHECK_SALT)
+
+    def close(self):
+        self._slots = None
+        self._shared.close()
+
+    def __reduce__(self):
+        # Slots are a view of shared memory, so only the block is sent and other processes attach to it
+        return SharedScoreTable, (self._shared,)
+
+    @staticmethod
+    def create(size: int) -> SharedScoreTable:
+        shared = SharedArrays.publish({"slots": np.zeros((size, 3), dtype=np.uint64)}, writeable=True)
+        return SharedScoreTable(shared)
+
+
+class ScoreCache:
+    """LRU cache of scores by hash seeded with the setup, misses are also looked up in the shared table"""
+
+    def __init__(self, fingerprint: bytes, max_size: int, shared: SharedScoreTable = None):
+        self._fingerprint = fingerprint
+        self._max_size = max_size
+        self._shared = shared
+        self._scores = OrderedDict()
+        self._hashers = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def local(self) -> ScoreCache:
+        """Empty cache of the same size and fingerprint, which isn't shared with other processes"""
+        return ScoreCache(self._fingerprint, self._max_size)
+
+    def hasher(self, num_positions: int) -> ZobristHash:
+        """Hash for layouts with number of positions, seeded by fingerprint, so all processes hash layouts the same"""
+        if num_positions not in self._hashers:
+            self._hashers[num_positions] = ZobristHash(num_positions, self._fingerprint)
+        return self._hashers[num_positions]
+
+    def get(self, key: int) -> Optional[float]:
+        score = self._scores.get(key)
+        if score is not None:
+            self._scores.move_to_end(key)
+        elif self._shared is not None:
+            score = self._shared.get(key)
+            if score is not None:
+                self.shared_hits += 1
+                self._store(key, score)
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return score
+
+    def put(self, key: int, score: float):
+        self._store(key, score)
+        if self._shared is not None:
+            self._shared.put(key, score)
+
+    def _store(self, key: int, score: float):
+        if self._max_size <= 0:
+            return
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        if len(self._scores) > self._max_size:
+            self._scores.popitem(last=False)
+
+    def __len__(self):
+        return len(self._scores)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses}
@@ -0,0 +1,13 @@
+from __future__ import annotations
+
+DIGITS = set("1234567890")
+LETTERS = set("qwertyuiopasdfghjklzxcvbnm")
+SPECIAL = set("`!\"$%^&*()-=_+[]{};'#:@~\|,./<>?")
+SPACING = {"\t", "\n", " ", "\b"}
+ARROWS = {"↓", "↑", "←", "→"}
+EXTRA = {"\x1b"}
+CHARS_TO_TRACK = DIGITS.union(LETTERS).union(SPECIAL).union(SPACING).union(ARROWS).union(EXTRA)
+
+# Fixed order of tracked chars, index in it is used as char id in all arrays
+ALPHABET = sorted(CHARS_TO_TRACK)
+CHAR_IDS = {char: idx for idx, char in enumerate(ALPHABET)}
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import io
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from layout_optimisation.cache import score_fingerprint
+from layout_optimisation.chars import ALPHABET
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import UNTRACKED_KEY, CompactLayout
+from layout_optimisation.utils import write_atomic
+
+CHECKPOINT_VERSION = 3
+# Config of other optimisers and of the run itself, which doesn't affect scores of layouts
+NON_SCORE_KEYS = ("annealing", "tabu", "islands", "genetic", "racing", "disable_eval_tqdm")
+# Annealing config, which affects layouts of chains, their schedule and the budget
+ANNEALING_STATE_KEYS = (
+    "max_layers",
+    "num_layouts",
+    "init_temperature",
+    "final_temperature",
+    "num_iters",
+    "iters_per_cycle",
+    "keep_top",
+    "adaptive_schedule",
+    "fidelity_schedule",
+)
+
+
+def checkpoint_fingerprint(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None) -> bytes:
+    """Digest of config, which affects scores, schedule or budget, with the corpus and dir weights"""
+    # Other config, such as number of processes, can change when a job is resumed on another machine
+    state_cfg = {key: value for key, value in cfg.items() if key not in NON_SCORE_KEYS}
+    state_cfg["annealing"] = {key: cfg["annealing"][key] for key in ANNEALING_STATE_KEYS}
+    return score_fingerprint(state_cfg, corpus, dir_weights)
+
+
+class Checkpoint:
+    """State of annealing after a number of cycles, so that a run continues exactly where it stopped"""
+
+    def __init__(
+        self,
+        cycle: int,
+        layouts: List[List[str]],
+        energies: List[float],
+        temperatures: List[float],
+        stalls: List[int],
+        frozen: List[bool],
+        fidelity: float,
+        rng_state: tuple,
+        elapsed: float,
+        best_score: float,
+    ):
+        self.cycle = cycle
+        self.layouts = layouts
+        self.energies = energies
+        self.temperatures = temperatures
+        self.stalls = stalls
+        self.frozen = frozen
+        self.fidelity = fidelity
+        self.rng_state = rng_state
+        self.elapsed = elapsed
+        self.best_score = best_score
+
+    def save(self, path: Path, fingerprint: bytes):
+        keys = np.stack([CompactLayout.from_flat(flat_keys, 1).keys for flat_keys in self.layouts])
+        # Values of untracked keys are stored separately, since they are rare
+        rows, cols = np.nonzero(keys == UNTRACKED_KEY)
+        version, internal_state, gauss_next = self.rng_state
+        arrays = dict(
+            version=np.array(CHECKPOINT_VERSION),
+            fingerprint=np.frombuffer(fingerprint, dtype=np.uint8),
+            cycle=np.array(self.cycle),
+            keys=keys,
+            untracked_rows=rows,
+            untracked_cols=cols,
+            untracked_values=np.array([self.layouts[row][col] for row, col in zip(rows, cols)], dtype=str),
+            energies=np.array(self.energies),
+            temperatures=np.array(self.temperatures),
+            stalls=np.array(self.stalls),
+            frozen=np.array(self.frozen, dtype=bool),
+            fidelity=np.array(self.fidelity),
+            rng_version=np.array(version),
+            rng_internal_state=np.array(internal_state, dtype=np.uint64),
+            rng_gauss_next=np.array(np.nan if gauss_next is None else gauss_next),
+            elapsed=np.array(self.elapsed),
+            best_score=np.array(self.best_score),
+        )
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        write_atomic(path, buffer.getvalue())
+
+    @staticmethod
+    def load(path: Path, fingerprint: bytes) -> Checkpoint:
+        with np.load(path) as arrays:
+            if int(arrays["version"]) != CHECKPOINT_VERSION:
+                raise ValueError(f"Checkpoint {path} has version {int(arrays['version'])}, not {CHECKPOINT_VERSION}")
+            if arrays["fingerprint"].tobytes() != fingerprint:
+                raise ValueError(f"Checkpoint {path} was made with a different config, corpus or dir weights")
+            layouts = [[ALPHABET[key] if key >= 0 else None for key in row] for row in arrays["keys"]]
+            for row, col, value in zip(arrays["untracked_rows"], arrays["untracked_cols"], arrays["untracked_values"]):
+                layouts[row][col] = str(value)
+            gauss_next = float(arrays["rng_gauss_next"])
+            rng_state = (
+                int(arrays["rng_version"]),
+                tuple(int(value) for value in arrays["rng_internal_state"]),
+                None if np.isnan(gauss_next) else gauss_next,
+            )
+            return Checkpoint(
+                cycle=int(arrays["cycle"]),
+                layouts=layouts,
+                energies=arrays["energies"].tolist(),
+                temperatures=arrays["temperatures"].tolist(),
+                stalls=arrays["stalls"].tolist(),
+                frozen=arrays["frozen"].tolist(),
+                fidelity=float(arrays["fidelity"]),
+                rng_state=rng_state,
+                elapsed=float(arrays["elapsed"]),
+                best_score=float(arrays["best_score"]),
+            )
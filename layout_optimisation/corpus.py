@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+import hashlib
+import inspect
+import io
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET, CHAR_IDS
+from layout_optimisation.shared import SharedArrays
+from layout_optimisation.utils import process_text, write_atomic
+
+logger = logging.getLogger(__name__)
+
+MAX_NGRAM = 4
+# Bump when format of the cached arrays changes
+CACHE_VERSION = 2
+
+
+def list_dir_files(dir_path: Path) -> List[Path]:
+    """Files of the directory in a fixed order, bytecode, which Python writes next to code in texts, is skipped"""
+    return [
+        file_path
+        for file_path in sorted(dir_path.rglob("*"))
+        if not file_path.is_dir() and "__pycache__" not in file_path.relative_to(dir_path).parts
+    ]
+
+
+def read_file_text(file_path: Path, cfg: dict) -> str:
+    with file_path.open() as f:
+        lines = f.readlines()[:: cfg["text_downsampling"]]
+    return process_text("".join(lines) + "\n")
+
+
+def read_dir_text(dir_path: Path, cfg: dict) -> str:
+    # Text of each file ends with a new line, so processing files one by one is the same as processing all at once
+    return "".join(read_file_text(file_path, cfg) for file_path in list_dir_files(dir_path))
+
+
+def encode_text(text: str) -> np.ndarray:
+    """Convert text into array of char ids, dropping chars which are not tracked"""
+    ids = text_to_ids(text)
+    return ids[ids >= 0].astype(np.uint8)
+
+
+def text_to_ids(text: str) -> np.ndarray:
+    """Array of char ids with -1 for chars which are not tracked, one entry per char of the text"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    lookup = np.empty(len(unique_codes), dtype=np.int16)
+    for idx, code in enumerate(unique_codes):
+        char = chr(code)
+        if char not in CHAR_IDS:
+            logger.warning(f"Found char {char!r}, which is not tracked, skipping")
+        lookup[idx] = CHAR_IDS.get(char, -1)
+    return lookup[inverse]
+
+
+def grams_to_keys(grams: np.ndarray) -> np.ndarray:
+    """Single integer for each n-gram, so that n-grams can be sorted and matched"""
+    keys = np.zeros(len(grams), dtype=np.int64)
+    for offset in range(grams.shape[1]):
+        keys = keys * len(ALPHABET) + grams[:, offset]
+    return keys
+
+
+def keys_to_grams(keys: np.ndarray, n: int) -> np.ndarray:
+    grams = np.empty((len(keys), n), dtype=np.uint8)
+    for offset in reversed(range(n)):
+        grams[:, offset] = keys % len(ALPHABET)
+        keys = keys // len(ALPHABET)
+    return grams
+
+
+def count_ngrams(ids: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    num_ngrams = max(len(ids) - n + 1, 0)
+    windows = np.stack([ids[offset : offset + num_ngrams] for offset in range(n)], axis=1)
+    keys, counts = np.unique(grams_to_keys(windows), return_counts=True)
+    return keys_to_grams(keys, n), counts.astype(np.int64)
+
+
+class NGramCounts:
+    """Counts of all distinct 1- to MAX_NGRAM-grams of tracked chars, chars are stored as ids from ALPHABET"""
+
+    def __init__(self, grams: List[np.ndarray], counts: List[np.ndarray]):
+        assert len(grams) == len(counts) == MAX_NGRAM
+        self._grams = grams
+        self._counts = counts
+
+    def grams(self, n: int) -> np.ndarray:
+        return self._grams[n - 1]
+
+    def counts(self, n: int) -> np.ndarray:
+        return self._counts[n - 1]
+
+    @property
+    def text_len(self) -> int:
+        return int(self._counts[0].sum())
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {}
+        for n in range(1, MAX_NGRAM + 1):
+            arrays[f"grams_{n}"] = self.grams(n)
+            arrays[f"counts_{n}"] = self.counts(n)
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: Dict[str, np.ndarray]) -> NGramCounts:
+        grams = [arrays[f"grams_{n}"] for n in range(1, MAX_NGRAM + 1)]
+        counts = [arrays[f"counts_{n}"] for n in range(1, MAX_NGRAM + 1)]
+        return NGramCounts(grams, counts)
+
+    def subsample(self, fraction: float, rng: np.random.Generator) -> NGramCounts:
+        """Each occurrence of each n-gram is kept with probability of fraction, n-grams which aren't left are dropped"""
+        grams = []
+        counts = []
+        for n in range(1, MAX_NGRAM + 1):
+            n_counts = rng.binomial(self.counts(n), fraction)
+            kept = n_counts > 0
+            grams.append(self.grams(n)[kept])
+            counts.append(n_counts[kept])
+        return NGramCounts(grams, counts)
+
+    @staticmethod
+    def from_text(text: str) -> NGramCounts:
+        return NGramCounts.from_ids(encode_text(text))
+
+    @staticmethod
+    def from_ids(ids: np.ndarray) -> NGramCounts:
+        grams, counts = zip(*[count_ngrams(ids, n) for n in range(1, MAX_NGRAM + 1)])
+        return NGramCounts(list(grams), list(counts))
+
+    @staticmethod
+    def combine(ngrams: List[NGramCounts]) -> NGramCounts:
+        """Counts of several texts added together, n-grams which span from one text to the next aren't counted"""
+        if not ngrams:
+            return NGramCounts.from_ids(np.zeros(0, dtype=np.uint8))
+        grams = []
+        counts = []
+        for n in range(1, MAX_NGRAM + 1):
+            keys, inverse = np.unique(
+                np.concatenate([grams_to_keys(ng.grams(n)) for ng in ngrams]), return_inverse=True
+            )
+            n_counts = np.zeros(len(keys), dtype=np.int64)
+            np.add.at(n_counts, inverse, np.concatenate([ng.counts(n) for ng in ngrams]))
+            grams.append(keys_to_grams(keys, n))
+            counts.append(n_counts)
+        return NGramCounts(grams, counts)
+
+    @staticmethod
+    def from_files(file_texts: List[str]) -> Tuple[NGramCounts, List[NGramCounts]]:
+        """Counts of the concatenated texts and of each text on its own, chars of all texts are looked up at once"""
+        ids = text_to_ids("".join(file_texts))
+        bounds = np.cumsum([0] + [len(text) for text in file_texts])
+        file_ngrams = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            file_ids = ids[start:end]
+            file_ngrams.append(NGramCounts.from_ids(file_ids[file_ids >= 0].astype(np.uint8)))
+        # Counts of the concatenated texts also have n-grams, which span from one text to the next
+        return NGramCounts.from_ids(ids[ids >= 0].astype(np.uint8)), file_ngrams
+
+
+class MergedNGrams:
+    """N-gram counts with a column per directory, so that each distinct n-gram is only scored once"""
+
+    def __init__(
+        self,
+        dir_names: List[str],
+        grams: List[np.ndarray],
+        counts: List[np.ndarray],
+        char_rows: List[List[np.ndarray]] = None,
+    ):
+        assert len(grams) == len(counts) == MAX_NGRAM
+        self._dir_names = dir_names
+        self._grams = grams
+        self._counts = counts
+        self._char_rows = char_rows
+        self._dense_counts = {}
+
+    @property
+    def dir_names(self) -> List[str]:
+        return self._dir_names
+
+    def grams(self, n: int) -> np.ndarray:
+        return self._grams[n - 1]
+
+    def counts(self, n: int) -> np.ndarray:
+        return self._counts[n - 1]
+
+    @property
+    def text_len(self) -> np.ndarray:
+        return self._counts[0].sum(axis=0)
+
+    @property
+    def char_rows(self) -> List[List[np.ndarray]]:
+        """char_rows[n - 1][char_id] are indexes of n-grams which contain that char, computed on first use"""
+        if self._char_rows is None:
+            self._char_rows = [
+                [np.flatnonzero((grams == char_id).any(axis=1)) for char_id in range(len(ALPHABET))]
+                for grams in self._grams
+            ]
+        return self._char_rows
+
+    def dense_counts(self, n: int, columns: Tuple[int, ...]) -> np.ndarray:
+        """Counts indexed by flat index of char ids in selected columns, with an extra id for keys without a char"""
+        if (n, columns) not in self._dense_counts:
+            num_ids = len(ALPHABET) + 1
+            grams = self.grams(n)
+            index = np.zeros(len(grams), dtype=np.int64)
+            for column in columns:
+                index = index * num_ids + grams[:, column]
+            dense = np.zeros((num_ids ** len(columns), len(self._dir_names)), dtype=np.int64)
+            np.add.at(dense, index, self.counts(n))
+            self._dense_counts[n, columns] = dense
+        return self._dense_counts[n, columns]
+
+    def take(self, rows: List[np.ndarray]) -> MergedNGrams:
+        """Subset of n-grams, rows[n - 1] are indexes of n-grams to keep"""
+        grams = [np.take(grams, n_rows, axis=0) for grams, n_rows in zip(self._grams, rows)]
+        counts = [np.take(counts, n_rows, axis=0) for counts, n_rows in zip(self._counts, rows)]
+        return MergedNGrams(self._dir_names, grams, counts)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Rows of each char are stored one after another, with offsets of where rows of each char start"""
+        arrays = {}
+        for n in range(1, MAX_NGRAM + 1):
+            arrays[f"grams_{n}"] = self.grams(n)
+            arrays[f"counts_{n}"] = self.counts(n)
+            n_char_rows = self.char_rows[n - 1]
+            arrays[f"char_rows_{n}"] = np.concatenate(n_char_rows)
+            arrays[f"char_row_offsets_{n}"] = np.cumsum([0] + [len(rows) for rows in n_char_rows])
+        return arrays
+
+    @staticmethod
+    def from_arrays(dir_names: List[str], arrays: Dict[str, np.ndarray]) -> MergedNGrams:
+        grams = [arrays[f"grams_{n}"] for n in range(1, MAX_NGRAM + 1)]
+        counts = [arrays[f"counts_{n}"] for n in range(1, MAX_NGRAM + 1)]
+        char_rows = []
+        for n in range(1, MAX_NGRAM + 1):
+            rows, offsets = arrays[f"char_rows_{n}"], arrays[f"char_row_offsets_{n}"]
+            char_rows.append([rows[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        return MergedNGrams(dir_names, grams, counts, char_rows)
+
+    @staticmethod
+    def from_ngrams(ngrams: Dict[str, NGramCounts]) -> MergedNGrams:
+        dir_names = list(ngrams)
+        grams = []
+        counts = []
+        for n in range(1, MAX_NGRAM + 1):
+            dir_keys = [grams_to_keys(ngrams[dir_name].grams(n)) for dir_name in dir_names]
+            keys, inverse = np.unique(np.concatenate(dir_keys), return_inverse=True)
+            n_counts = np.zeros((len(keys), len(dir_names)), dtype=np.int64)
+            dir_idx = np.repeat(np.arange(len(dir_names)), [len(keys) for keys in dir_keys])
+            np.add.at(n_counts, (inverse, dir_idx), np.concatenate([ngrams[name].counts(n) for name in dir_names]))
+            grams.append(keys_to_grams(keys, n))
+            counts.append(n_counts)
+        return MergedNGrams(dir_names, grams, counts)
+
+
+class CorpusCache:
+    """Stores n-gram counts of each directory and each of its files on disk, rebuilt only when inputs change"""
+
+    def __init__(self, cache_dir: Path):
+        self._cache_dir = cache_dir
+
+    @staticmethod
+    def calc_key(dir_path: Path, cfg: dict) -> str:
+        key = hashlib.sha256()
+        key.update(f"version={CACHE_VERSION}\n".encode())
+        key.update(f"text_downsampling={cfg['text_downsampling']}\n".encode())
+        key.update(inspect.getsource(process_text).encode())
+        key.update("".join(ALPHABET).encode())
+        for file_path in list_dir_files(dir_path):
+            stat = file_path.stat()
+            key.update(f"{file_path.relative_to(dir_path)}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+        return key.hexdigest()
+
+    def get_path(self, dir_path: Path, key: str) -> Path:
+        """Entries with different keys, such as counts of different text_downsampling, don't overwrite each other"""
+        path_hash = hashlib.sha256(str(dir_path.resolve()).encode()).hexdigest()[:8]
+        return self._cache_dir / f"{dir_path.name}-{path_hash}-{key[:16]}.npz"
+
+    def load(self, dir_path: Path, key: str) -> Optional[Tuple[NGramCounts, Dict[str, NGramCounts]]]:
+        path = self.get_path(dir_path, key)
+        if not path.exists():
+            return None
+        with np.load(path) as npz:
+            if str(npz["key"]) != key:
+                return None
+            # Each access of an npz array reads it again, so all arrays are read once
+            arrays = dict(npz)
+            file_ngrams = {}
+            for idx, file_name in enumerate(arrays["file_names"]):
+                file_arrays = {}
+                for n in range(1, MAX_NGRAM + 1):
+                    start, end = arrays[f"file_offsets_{n}"][idx : idx + 2]
+                    file_arrays[f"grams_{n}"] = arrays[f"file_grams_{n}"][start:end]
+                    file_arrays[f"counts_{n}"] = arrays[f"file_counts_{n}"][start:end]
+                file_ngrams[str(file_name)] = NGramCounts.from_arrays(file_arrays)
+            return NGramCounts.from_arrays(dict(arrays)), file_ngrams
+
+    def save(self, dir_path: Path, key: str, ngrams: NGramCounts, file_ngrams: Dict[str, NGramCounts]):
+        path = self.get_path(dir_path, key)
+        arrays = ngrams.to_arrays()
+        arrays["file_names"] = np.array(list(file_ngrams), dtype=str)
+        # Empty counts go first, so that directories without files can be stored as well
+        all_ngrams = [NGramCounts.from_ids(np.zeros(0, dtype=np.uint8))] + list(file_ngrams.values())
+        # Counts of files are stored one after another, with offsets of where counts of each file end
+        for n in range(1, MAX_NGRAM + 1):
+            arrays[f"file_grams_{n}"] = np.concatenate([ngrams.grams(n) for ngrams in all_ngrams])
+            arrays[f"file_counts_{n}"] = np.concatenate([ngrams.counts(n) for ngrams in all_ngrams])
+            arrays[f"file_offsets_{n}"] = np.cumsum([len(ngrams.counts(n)) for ngrams in all_ngrams])
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, key=np.array(key), **arrays)
+        write_atomic(path, buffer.getvalue())
+
+
+class Corpus:
+    """N-gram counts of texts, one entry per directory, so that texts are only processed once per run"""
+
+    def __init__(
+        self,
+        ngrams: Dict[str, NGramCounts],
+        dir_paths: Dict[str, Path] = None,
+        cfg: dict = None,
+        texts: Dict[str, str] = None,
+        file_ngrams: Dict[str, Dict[str, NGramCounts]] = None,
+    ):
+        self._ngrams = ngrams
+        self._file_ngrams = file_ngrams or {}
+        self._dir_paths = dir_paths or {}
+        self._cfg = cfg
+        self._texts = texts or {}
+        self._merged = None
+        self._shared = None
+        self._fingerprint = None
+
+    @property
+    def ngrams(self) -> Dict[str, NGramCounts]:
+        return self._ngrams
+
+    @property
+    def file_ngrams(self) -> Dict[str, Dict[str, NGramCounts]]:
+        """Counts of each file of each directory, keyed by path of the file relative to the directory"""
+        return self._file_ngrams
+
+    @property
+    def texts(self) -> Dict[str, str]:
+        """Full processed texts, only read when needed since n-gram counts are enough for most uses"""
+        for dir_name in self._ngrams:
+            if dir_name not in self._texts:
+                self._texts[dir_name] = read_dir_text(self._dir_paths[dir_name], self._cfg)
+        return self._texts
+
+    @property
+    def merged(self) -> MergedNGrams:
+        """All directories with some text in one table, built on first use"""
+        if self._merged is None:
+            non_empty = {dir_name: ngrams for dir_name, ngrams in self._ngrams.items() if ngrams.text_len > 0}
+            self._merged = MergedNGrams.from_ngrams(non_empty)
+        return self._merged
+
+    @property
+    def fingerprint(self) -> str:
+        """Digest of n-gram counts, computed on first use"""
+        if self._fingerprint is None:
+            fingerprint = hashlib.sha256()
+            for dir_name, ngrams in self._ngrams.items():
+                fingerprint.update(f"{dir_name}\n".encode())
+                for key, array in ngrams.to_arrays().items():
+                    fingerprint.update(f"{key}:{array.dtype.str}:{array.shape}\n".encode())
+                    fingerprint.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprint = fingerprint.hexdigest()
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self._ngrams)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ngrams)
+
+    def __getstate__(self) -> dict:
+        # Texts can be read again when needed, so they are not sent to other processes, neither are counts of files
+        state = dict(self.__dict__)
+        state["_texts"] = {}
+        state["_file_ngrams"] = {}
+        if self._shared is not None:
+            # Only names of directories are sent, arrays are attached again from shared memory
+            state["_ngrams"] = list(self._ngrams)
+            state["_merged"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if self._shared is not None:
+            self._ngrams, self._merged = self._arrays_to_ngrams(self._ngrams, self._shared.arrays)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {}
+        for dir_name, ngrams in self._ngrams.items():
+            arrays.update({f"ngrams/{dir_name}/{key}": array for key, array in ngrams.to_arrays().items()})
+        arrays.update({f"merged/{key}": array for key, array in self.merged.to_arrays().items()})
+        return arrays
+
+    @staticmethod
+    def _arrays_to_ngrams(
+        dir_names: List[str], arrays: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, NGramCounts], MergedNGrams]:
+        def select(prefix: str) -> Dict[str, np.ndarray]:
+            return {key[len(prefix) :]: array for key, array in arrays.items() if key.startswith(prefix)}
+
+        ngrams = {dir_name: NGramCounts.from_arrays(select(f"ngrams/{dir_name}/")) for dir_name in dir_names}
+        merged_names = [dir_name for dir_name in dir_names if ngrams[dir_name].text_len > 0]
+        return ngrams, MergedNGrams.from_arrays(merged_names, select("merged/"))
+
+    def subsample(self, fraction: float, seed: int = 0) -> Corpus:
+        """Corpus with a random fraction of n-gram occurrences, its scores approximate scores of the full corpus"""
+        rng = np.random.default_rng(seed)
+        ngrams = {dir_name: ngrams.subsample(fraction, rng) for dir_name, ngrams in self._ngrams.items()}
+        return Corpus(ngrams, self._dir_paths, self._cfg)
+
+    def share(self) -> Corpus:
+        """Copy with n-gram arrays in shared memory, call close on it once all processes are done with it"""
+        shared = SharedArrays.publish(self.to_arrays())
+        corpus = Corpus({}, self._dir_paths, self._cfg)
+        corpus._shared = shared
+        corpus._fingerprint = self.fingerprint
+        corpus._ngrams, corpus._merged = self._arrays_to_ngrams(list(self._ngrams), shared.arrays)
+        return corpus
+
+    def close(self):
+        """Release shared memory of a corpus created by share"""
+        if self._shared is not None:
+            self._ngrams, self._merged = {}, None
+            self._shared.close()
+            self._shared = None
+
+    @staticmethod
+    def from_dir(text_dir: Path, cfg: dict, cache_dir: Path = None) -> Corpus:
+        cache = CorpusCache(cache_dir) if cache_dir is not None else None
+        ngrams = {}
+        file_ngrams = {}
+        dir_paths = {}
+        texts = {}
+        for dir_path in sorted(text_dir.glob("*")):
+            if not dir_path.is_dir():
+                continue
+            dir_paths[dir_path.name] = dir_path
+            if cache is not None:
+                key = cache.calc_key(dir_path, cfg)
+                cached = cache.load(dir_path, key)
+                if cached is not None:
+                    logger.info(f"Loaded cached n-grams for {dir_path}")
+                    ngrams[dir_path.name], file_ngrams[dir_path.name] = cached
+                    continue
+            logger.info(f"Counting n-grams for {dir_path}")
+            file_paths = list_dir_files(dir_path)
+            file_texts = [read_file_text(file_path, cfg) for file_path in file_paths]
+            texts[dir_path.name] = "".join(file_texts)
+            dir_ngrams, dir_file_ngrams = NGramCounts.from_files(file_texts)
+            ngrams[dir_path.name] = dir_ngrams
+            file_names = [str(file_path.relative_to(dir_path)) for file_path in file_paths]
+            file_ngrams[dir_path.name] = dict(zip(file_names, dir_file_ngrams))
+            if cache is not None:
+                cache.save(dir_path, key, ngrams[dir_path.name], file_ngrams[dir_path.name])
+        return Corpus(ngrams, dir_paths, cfg, texts, file_ngrams)
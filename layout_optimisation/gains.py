@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import itertools
+from typing import Tuple
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET, CHAR_IDS
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import Keyboard
+from layout_optimisation.penalty import (
+    evaluate_batch,
+    get_extra_key_mults,
+    get_groups,
+    get_merged_dir_weights,
+    get_penalty_terms,
+)
+from layout_optimisation.tables import NGramTable, PositionTables
+
+
+class SwapGains:
+    """Change of score for swapping keys of every pair of positions, kept in matrix and updated after each swap"""
+
+    def __init__(self, keys: np.ndarray, keyboard: Keyboard, corpus: Corpus, cfg: dict, dir_weights=None):
+        num_ids = len(ALPHABET) + 1
+        penalties = cfg["penalties"]
+        tables = PositionTables.for_keyboard(keyboard, cfg, len(keys) // len(keyboard))
+        ngrams = corpus.merged
+        merged_weights, total_weight = get_merged_dir_weights(corpus, dir_weights)
+        # Penalties are hits / text_len weighted by directories, so each count is scaled by its directory
+        dir_scale = merged_weights / ngrams.text_len / total_weight
+
+        unigram_counts = np.zeros(num_ids)
+        np.add.at(unigram_counts, ngrams.grams(1)[:, 0], ngrams.counts(1) @ dir_scale)
+        location_counts = unigram_counts * penalties["location"]
+        location_counts[:-1] *= ~tables.ignore_location
+        self.linear = np.outer(tables.locations, location_counts) + np.outer(tables.layer_costs, unigram_counts)
+        # Extra keys are counted once per char of the text, same as in count_unigram_hits
+        extra_weight = penalties["location"] * np.sum(merged_weights) / total_weight
+        self.linear[:, :-1] += np.outer(tables.locations, get_extra_key_mults(cfg)) * extra_weight
+
+        self.components = [self._quadratic(table, ngrams, penalties, dir_scale) for table in tables.ngram_tables[:2]]
+
+        groups = get_groups(cfg)
+        self.group_members = np.zeros((num_ids, len(groups)), dtype=int)
+        for group_idx, group in enumerate(groups.values()):
+            self.group_members[[CHAR_IDS[char] for char in group], group_idx] = 1
+        self.split_group_cost = penalties["split_group"]
+        self.layers = np.arange(len(keys)) // len(keyboard)
+
+        self.hand_codes = tables.hand_codes
+        self._init_fourgrams(tables.fourgrams, ngrams, penalties, dir_scale)
+
+        # Triples of positions with any trigram term and their costs, n-grams are only looked up for these
+        trigram_costs = tables.trigrams.support_values @ np.array([penalties[term] for term in tables.trigrams.terms])
+        self.triples = tables.trigrams.support_positions[trigram_costs != 0]
+        self.triple_costs = trigram_costs[trigram_costs != 0]
+        self.trigram_flow = ngrams.dense_counts(3, tables.trigrams.columns) @ dir_scale
+
+        # Finger loads are counts of chars in each directory, divided by ratios of fingers
+        self.finger_usage = (tables.finger_usage / tables.finger_ratios[:, None]).T
+        self.dir_counts = np.zeros((num_ids, len(dir_scale)))
+        np.add.at(self.dir_counts, ngrams.grams(1)[:, 0], ngrams.counts(1))
+        self.finger_disbalance_cost = penalties["finger_disbalance"]
+        self.dir_scale = dir_scale
+
+        self.ids = np.where(keys >= 0, keys, num_ids - 1)
+        # Flows between keys at each pair of positions
+        self.flows = [flow[np.ix_(self.ids, self.ids)] for _, flow in self.components]
+        all_rows = np.arange(len(keys))
+        self.quadratic = sum(self._rows(distance, flows, all_rows) for (distance, _), flows in self._pairs())
+        self.group_counts = self._group_counts()
+        self.loads = self.finger_usage.T @ self.dir_counts[self.ids]
+        self.flips, self.pair_flips = self._hand_flips(np.arange(len(self.fourgrams)))
+        self.triple_replacements, self.triple_corrections = self._triple_contributions(np.arange(len(self.triples)))
+        # Gains of each term, which isn't quadratic, as (function of rows, matrix of gains)
+        self.terms = {
+            name: (func, func(all_rows))
+            for name, func in [
+                ("linear", self._linear_rows),
+                ("split_group", self._split_group_rows),
+                ("fourgram", self._fourgram_rows),
+                ("finger_disbalance", self._finger_disbalance_rows),
+                ("trigram", self._trigram_rows),
+            ]
+        }
+        # Gains of swapping each pair of positions, negative gains lower the score
+        self.matrix = self.quadratic + sum(gains for _, gains in self.terms.values())
+        # Total penalty of the current layout, which changes by the gain of each applied swap
+        totals = evaluate_batch(keys[np.newaxis], keyboard, corpus, cfg, dir_weights)
+        self.score = float(totals[0, get_penalty_terms().index("total")])
+
+    def _pairs(self):
+        return zip(self.components, self.flows)
+
+    @property
+    def splits_groups(self) -> np.ndarray:
+        return self.terms["split_group"][1] > 0
+
+    def _init_fourgrams(self, table: NGramTable, ngrams, penalties: dict, dir_scale: np.ndarray):
+        """Parts of fourgrams, which don't depend on the layout: which columns flip with each char"""
+        self.fourgrams = ngrams.grams(4).astype(np.int64)
+        self.fourgram_char_rows = ngrams.char_rows[3]
+        self.fourgram_weights = ngrams.counts(4) @ dir_scale
+        self.fourgram_costs = table.values @ np.array([penalties[term] for term in table.terms])
+        # Bits of flat index of hand codes, first column is the highest, same as NGramTable.flat_index
+        bits = 2 ** np.arange(table.n)[::-1]
+        same_char = self.fourgrams[:, :, None] == self.fourgrams[:, None, :]
+        # Bits, which flip if the char in each column changes hand, each char is counted in its first column
+        self.fourgram_masks = same_char @ bits
+        self.fourgram_first = ~np.any(np.tril(same_char, k=-1), axis=2)
+
+    def _hand_flips(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Change of cost of fourgrams at rows, if a char changes hand, and of each pair of chars changing hands"""
+        # A swap between hands changes cost by flips[a] + flips[b] + pair_flips[a, b]
+        num_ids = len(ALPHABET) + 1
+        grams, masks, first = self.fourgrams[rows], self.fourgram_masks[rows], self.fourgram_first[rows]
+        char_hands = np.zeros(num_ids, dtype=int)
+        char_hands[self.ids] = self.hand_codes
+        code = char_hands[grams] @ (2 ** np.arange(grams.shape[1])[::-1])
+        base = self.fourgram_costs[code]
+        single = [self.fourgram_costs[code ^ mask] - base for mask in masks.T]
+        flips = np.zeros(num_ids)
+        pair_flips = np.zeros(num_ids * num_ids)
+        for column in range(grams.shape[1]):
+            weights = self.fourgram_weights[rows] * single[column] * first[:, column]
+            flips += np.bincount(grams[:, column], weights=weights, minlength=num_ids)
+            for other in range(column + 1, grams.shape[1]):
+                interaction = self.fourgram_costs[code ^ masks[:, column] ^ masks[:, other]] - base
+                interaction -= single[column] + single[other]
+                weights = self.fourgram_weights[rows] * interaction * first[:, column] * first[:, other]
+                pair_flips += np.bincount(grams[:, column] * num_ids + grams[:, other], weights, num_ids**2)
+        pair_flips = pair_flips.reshape(num_ids, num_ids)
+        return flips, pair_flips + pair_flips.T
+
+    def _fourgram_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Swaps within a hand don't change any fourgram"""
+        ids = self.ids
+        gains = self.flips[ids[rows]][:, None] + self.flips[ids][None, :] + self.pair_flips[np.ix_(ids[rows], ids)]
+        return gains * (self.hand_codes[rows, None] != self.hand_codes[None, :])
+
+    def _finger_disbalance_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Swap of r and s moves counts of the char at r from finger of r to finger of s and the opposite"""
+        counts = self.dir_counts[self.ids]
+        count_change = counts[rows, None, :] - counts[None, :, :]
+        max_loads = min_loads = None
+        for finger_loads, usage in zip(self.loads, self.finger_usage.T):
+            usage_change = usage[None, :] - usage[rows, None]
+            new_loads = finger_loads + usage_change[..., None] * count_change
+            max_loads = new_loads if max_loads is None else np.maximum(max_loads, new_loads)
+            min_loads = new_loads if min_loads is None else np.minimum(min_loads, new_loads)
+        disbalance = (max_loads - min_loads) @ self.dir_scale
+        current = (np.max(self.loads, axis=0) - np.min(self.loads, axis=0)) @ self.dir_scale
+        return self.finger_disbalance_cost * (disbalance - current)
+
+    @staticmethod
+    def _quadratic(table: NGramTable, ngrams, penalties: dict, dir_scale: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        num_positions = table.base
+        costs = np.array([penalties[term] for term in table.terms])
+        distance = (table.values @ costs).reshape(num_positions, num_positions)
+        flow = (ngrams.dense_counts(table.n, table.columns) @ dir_scale).reshape(len(ALPHABET) + 1, -1)
+        return distance, flow
+
+    def _linear_rows(self, rows: np.ndarray) -> np.ndarray:
+        current = self.linear[np.arange(len(self.ids)), self.ids]
+        swapped = self.linear[rows][:, self.ids] + self.linear[:, self.ids[rows]].T
+        return swapped - current[rows, None] - current[None, :]
+
+    def _group_counts(self) -> np.ndarray:
+        """Number of chars of each group on each layer"""
+        group_counts = np.zeros((self.layers.max() + 1, self.group_members.shape[1]), dtype=int)
+        np.add.at(group_counts, self.layers, self.group_members[self.ids])
+        return group_counts
+
+    def _split_group_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Groups are split if their chars are on more than one layer, only swaps between layers change that"""
+        members = self.group_members[self.ids]
+        group_counts = self.group_counts
+        # Change of count of each group on layer of the first position, layer of the second changes by the opposite
+        moved = members[None, :, :] - members[rows, None, :]
+        first_counts, second_counts = group_counts[self.layers[rows]][:, None, :], group_counts[self.layers][None]
+        occupied = np.sum(group_counts > 0, axis=0)
+        occupied_change = (first_counts + moved > 0).astype(int) - (first_counts > 0)
+        occupied_change += (second_counts - moved > 0).astype(int) - (second_counts > 0)
+        split_change = (occupied + occupied_change > 1).astype(int) - (occupied > 1)
+        different_layers = self.layers[rows, None] != self.layers[None, :]
+        return self.split_group_cost * np.sum(split_change, axis=-1) * different_layers
+
+    def _trigram_flows(self, triple_ids: np.ndarray) -> np.ndarray:
+        num_ids = len(ALPHABET) + 1
+        triple_ids = triple_ids.astype(np.int64)
+        return self.trigram_flow[(triple_ids[..., 0] * num_ids + triple_ids[..., 1]) * num_ids + triple_ids[..., 2]]
+
+    def _triple_contributions(self, triple_idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Contributions of selected triples to trigram gains, positions of a triple are distinct"""
+        num_ids = len(ALPHABET) + 1
+        triples, costs = self.triples[triple_idx], self.triple_costs[triple_idx]
+        triple_ids = self.ids[triples]
+        current = self._trigram_flows(triple_ids)
+        replacements = np.zeros((len(self.ids), num_ids))
+        replaced_gains = []
+        for column, positions in enumerate(triples.T):
+            replaced = np.repeat(triple_ids[:, None, :], num_ids, axis=1)
+            replaced[:, :, column] = np.arange(num_ids)
+            replaced_gains.append(costs[:, None] * (self._trigram_flows(replaced) - current[:, None]))
+            np.add.at(replacements, positions, replaced_gains[-1])
+        # Gains are replacements[r, id of s] + replacements[s, id of r], corrections fix triples with both r and s
+        corrections = np.zeros((len(self.ids), len(self.ids)))
+        rows = np.arange(len(triples))
+        for column, other in itertools.permutations(range(triples.shape[1]), 2):
+            swapped = triple_ids.copy()
+            swapped[:, [column, other]] = triple_ids[:, [other, column]]
+            # Each ordered pair of columns has the swap once, so the swap is halved in each of them
+            correction = costs * (self._trigram_flows(swapped) - current) / 2
+            correction -= replaced_gains[column][rows, triple_ids[:, other]]
+            np.add.at(corrections, (triples[:, column], triples[:, other]), correction)
+        return replacements, corrections
+
+    def _trigram_rows(self, rows: np.ndarray) -> np.ndarray:
+        ids, replacements = self.ids, self.triple_replacements
+        gains = replacements[rows][:, ids] + replacements[:, ids[rows]].T
+        return gains + self.triple_corrections[rows] + self.triple_corrections[:, rows].T
+
+    @staticmethod
+    def _rows(a: np.ndarray, b: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Gains of swapping positions r in rows with every position s, with distances a and flows b at positions"""
+        # (a_rr - a_ss)(b_ss - b_rr) + (a_rs - a_sr)(b_sr - b_rs)
+        # + sum over k != r, s of (a_kr - a_ks)(b_ks - b_kr) + (a_rk - a_sk)(b_sk - b_rk),
+        # sums are taken over all k, then terms of k = r and k = s are subtracted
+        r = rows[:, None]
+        a_diag, b_diag = np.diag(a), np.diag(b)
+        a_rs, a_sr, b_rs, b_sr = a[rows], a[:, rows].T, b[rows], b[:, rows].T
+        m_diag, n_diag = np.sum(a * b, axis=0), np.sum(a * b, axis=1)
+        gains = (a_diag[r] - a_diag) * (b_diag - b_diag[r]) + (a_rs - a_sr) * (b_sr - b_rs)
+        gains += a[:, rows].T @ b + (a.T @ b[:, rows]).T - m_diag[r] - m_diag
+        gains -= (a_diag[r] - a_rs) * (b_rs - b_diag[r]) + (a_sr - a_diag) * (b_diag - b_sr)
+        gains += (b @ a[rows].T).T + (a @ b[rows].T).T - n_diag[r] - n_diag
+        gains -= (a_diag[r] - a_sr) * (b_sr - b_diag[r]) + (a_rs - a_diag) * (b_diag - b_rs)
+        gains[np.arange(len(rows)), rows] = 0
+        return gains
+
+    def _set_rows(self, gains: np.ndarray, rows: np.ndarray, row_gains: np.ndarray):
+        """Set rows and columns of gains of a term and change matrix by the same"""
+        self.matrix[rows] += row_gains - gains[rows]
+        self.matrix[:, rows] = self.matrix[rows].T
+        gains[rows] = row_gains
+        gains[:, rows] = row_gains.T
+
+    def apply(self, r: int, s: int):
+        self.score += self.matrix[r, s]
+        all_rows = np.arange(len(self.ids))
+        rows = np.array([r, s])
+        # Only fourgrams with swapped chars change, if the chars change hands
+        changes_hands = self.hand_codes[r] != self.hand_codes[s]
+        if changes_hands:
+            chars = [char_id for char_id in self.ids[rows] if char_id < len(ALPHABET)]
+            fourgram_rows = np.unique(np.concatenate([self.fourgram_char_rows[char_id] for char_id in chars]))
+            prev_flips, prev_pair_flips = self._hand_flips(fourgram_rows)
+        # Only triples with swapped positions change
+        changed_triples = np.flatnonzero(np.any((self.triples == r) | (self.triples == s), axis=1))
+        prev_replacements, prev_corrections = self._triple_contributions(changed_triples)
+        prev_group_counts = self.group_counts
+        # Loads only change, if chars with different counts move between fingers
+        moves_load = not np.array_equal(self.finger_usage[r], self.finger_usage[s])
+        moves_load = moves_load and not np.array_equal(*self.dir_counts[self.ids[rows]])
+        self.ids[rows] = self.ids[[s, r]]
+
+        changed_rows = 0
+        quadratic_change = 0
+        for (distance, _), flows in self._pairs():
+            flows[rows] = flows[[s, r]]
+            flows[:, rows] = flows[:, [s, r]]
+            # Gain of u, v without r and s changes by (alpha_u - alpha_v)(beta_u - beta_v) + same for gamma, delta
+            alpha, beta = distance[r] - distance[s], flows[s] - flows[r]
+            gamma, delta = distance[:, r] - distance[:, s], flows[:, s] - flows[:, r]
+            quadratic_change = quadratic_change + np.subtract.outer(alpha, alpha) * np.subtract.outer(beta, beta)
+            quadratic_change = quadratic_change + np.subtract.outer(gamma, gamma) * np.subtract.outer(delta, delta)
+            changed_rows = changed_rows + self._rows(distance, flows, rows)
+        self.quadratic += quadratic_change
+        self.matrix += quadratic_change
+        self._set_rows(self.quadratic, rows, changed_rows)
+
+        # Rows of each term, which the swap changes
+        term_rows = {"linear": rows, "split_group": rows, "fourgram": rows, "finger_disbalance": rows}
+        self.group_counts = self._group_counts()
+        if np.any(self.group_counts != prev_group_counts):
+            # Gains of swaps, which don't include either layer, only change if number of layers of a group changed
+            occupied_changed = np.any(np.sum(self.group_counts > 0, axis=0) != np.sum(prev_group_counts > 0, axis=0))
+            on_layers = np.isin(self.layers, self.layers[rows])
+            term_rows["split_group"] = all_rows if occupied_changed else np.flatnonzero(on_layers)
+        if moves_load:
+            # Disbalance depends on loads of all fingers
+            self.loads = self.finger_usage.T @ self.dir_counts[self.ids]
+            term_rows["finger_disbalance"] = all_rows
+        if changes_hands:
+            flips, pair_flips = self._hand_flips(fourgram_rows)
+            flips_change, pair_flips_change = flips - prev_flips, pair_flips - prev_pair_flips
+            self.flips += flips_change
+            self.pair_flips += pair_flips_change
+            changed_ids = np.flatnonzero((flips_change != 0) | np.any(pair_flips_change != 0, axis=1))
+            term_rows["fourgram"] = np.union1d(rows, np.flatnonzero(np.isin(self.ids, changed_ids)))
+        replacements, corrections = self._triple_contributions(changed_triples)
+        self.triple_replacements += replacements - prev_replacements
+        self.triple_corrections += corrections - prev_corrections
+        term_rows["trigram"] = np.union1d(rows, self.triples[changed_triples])
+
+        for name, (func, gains) in self.terms.items():
+            self._set_rows(gains, term_rows[name], func(term_rows[name]))
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import random
+from collections import Counter
+from typing import Callable, Dict, List
+
+import numpy as np
+from tqdm import trange
+
+from layout_optimisation.annealing import generate_initial_layouts, worker_pool, worker_state
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import CompactLayout, Layout
+from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
+from layout_optimisation.moves import SearchSpace, SwapGenerator
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+
+logger = logging.getLogger(__name__)
+
+
+def pmx(first: np.ndarray, second: np.ndarray, rng: random.Random = random) -> np.ndarray:
+    """Partially mapped crossover, slice of the first parent, other values at positions of the second if possible"""
+    start, end = sorted(rng.sample(range(len(first) + 1), 2))
+    child = np.full(len(first), -1)
+    child[start:end] = first[start:end]
+    in_slice = np.zeros(len(first), dtype=bool)
+    in_slice[first[start:end]] = True
+    second_positions = np.argsort(second)
+    for idx in range(start, end):
+        value = second[idx]
+        if in_slice[value]:
+            continue
+        # Follow the mapping of the slice, until a position outside of it is found
+        position = idx
+        while start <= position < end:
+            position = second_positions[first[position]]
+        child[position] = value
+    empty = child < 0
+    child[empty] = second[empty]
+    return child
+
+
+def order_crossover(first: np.ndarray, second: np.ndarray, rng: random.Random = random) -> np.ndarray:
+    """Slice of the first parent, other values in order of the second, starting after the slice"""
+    start, end = sorted(rng.sample(range(len(first) + 1), 2))
+    child = np.full(len(first), -1)
+    child[start:end] = first[start:end]
+    in_slice = np.zeros(len(first), dtype=bool)
+    in_slice[first[start:end]] = True
+    order = np.roll(second, -end)
+    remaining = order[~in_slice[order]]
+    positions = np.roll(np.arange(len(first)), -end)
+    child[positions[: len(remaining)]] = remaining
+    return child
+
+
+def cycle_crossover(first: np.ndarray, second: np.ndarray, rng: random.Random = random) -> np.ndarray:
+    """Every value keeps position of one of the parents, cycles of positions alternate between parents"""
+    child = np.full(len(first), -1)
+    first_positions = np.argsort(first)
+    take_first = True
+    for start in range(len(first)):
+        if child[start] >= 0:
+            continue
+        position = start
+        while child[position] < 0:
+            child[position] = first[position] if take_first else second[position]
+            position = first_positions[second[position]]
+        take_first = not take_first
+    return child
+
+
+CROSSOVERS: Dict[str, Callable[[np.ndarray, np.ndarray, random.Random], np.ndarray]] = {
+    "pmx": pmx,
+    "ox": order_crossover,
+    "cx": cycle_crossover,
+}
+
+
+def tokens(values: List[str]) -> List[tuple]:
+    """Values made unique by their occurrence, so that repeated empty keys are still a permutation"""
+    seen = Counter()
+    result = []
+    for value in values:
+        result.append((value, seen[value]))
+        seen[value] += 1
+    return result
+
+
+def crossover(
+    first: List[str], second: List[str], space: SearchSpace, operator: str, rng: random.Random = random
+) -> List[str]:
+    """Child of two valid flat layouts, only keys at free positions are recombined"""
+    first_tokens = tokens([first[idx] for idx in space.free])
+    second_tokens = tokens([second[idx] for idx in space.free])
+    token_ids = {token: idx for idx, token in enumerate(first_tokens)}
+    # Parents without the same keys at free positions can't be recombined
+    if set(second_tokens) != set(first_tokens):
+        return list(first)
+    child_ids = CROSSOVERS[operator](
+        np.arange(len(first_tokens)), np.array([token_ids[token] for token in second_tokens]), rng
+    )
+    child = list(first)
+    for idx, token_id in zip(space.free, child_ids):
+        child[idx] = first_tokens[token_id][0]
+    return child
+
+
+def mutate(flat_keys: List[str], swaps: SwapGenerator, max_swaps: int, rng: random.Random = random) -> List[str]:
+    flat_keys = list(flat_keys)
+    for _ in range(rng.randint(0, max_swaps)):
+        first_idx, second_idx = swaps.propose(flat_keys)
+        flat_keys[first_idx], flat_keys[second_idx] = flat_keys[second_idx], flat_keys[first_idx]
+    return flat_keys
+
+
+def evaluate_in_worker(perms: np.ndarray) -> np.ndarray:
+    """Total penalty of each row of keys of compact layouts with state of the worker"""
+    state = worker_state()
+    totals = evaluate_batch(perms, state["keyboard"], state["corpus"], state["cfg"], state["dir_weights"])
+    return totals[:, get_penalty_terms().index("total")]
+
+
+def run_genetic(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None) -> Layout:
+    """Generational genetic algorithm over free positions with tournament selection, crossover and swap mutations"""
+    genetic = cfg["genetic"]
+    template = generate_key_map_template(cfg)
+    keyboard = generate_keyboard(template, cfg)
+    space = SearchSpace(len(template) * cfg["annealing"]["max_layers"], cfg)
+    swaps = SwapGenerator(space)
+    layouts = generate_initial_layouts(cfg, corpus, dir_weights)
+    population = [
+        layouts[idx] if idx < len(layouts) else space.shuffle(layouts[0]) for idx in range(genetic["population_size"])
+    ]
+    num_processes = cfg["annealing"]["num_processes"]
+
+    def score(flat_layouts: List[List[str]]) -> np.ndarray:
+        perms = np.stack([CompactLayout.from_flat(flat_keys, len(keyboard)).keys for flat_keys in flat_layouts])
+        return np.concatenate(p.map(evaluate_in_worker, np.array_split(perms, num_processes)))
+
+    def tournament() -> List[str]:
+        contestants = random.sample(range(len(population)), genetic["tournament_size"])
+        return population[min(contestants, key=lambda idx: scores[idx])]
+
+    # Initial layouts are already sorted by score, so without any scores the first is returned
+    scores = np.full(len(population), np.inf)
+    outer_loop_iterator = trange(genetic["num_generations"], desc="Genetic algorithm")
+    try:
+        with worker_pool(keyboard, corpus, cfg, dir_weights) as p:
+            scores = score(population)
+            for _ in outer_loop_iterator:
+                children = []
+                while len(children) < len(population) - genetic["num_elites"]:
+                    child = tournament()
+                    if random.uniform(0, 1) < genetic["crossover_rate"]:
+                        child = crossover(child, tournament(), space, random.choice(genetic["operators"]))
+                    children.append(mutate(child, swaps, genetic["mutation_swaps"]))
+                elites = np.argsort(scores, kind="stable")[: genetic["num_elites"]]
+                children_scores = score(children)
+                population = [population[idx] for idx in elites] + children
+                scores = np.concatenate([scores[elites], children_scores])
+                outer_loop_iterator.set_description(f"Genetic algorithm, best score={scores.min():.3f}")
+    except KeyboardInterrupt:
+        logger.warning("Stopping optimisation due to KeyboardInterrupt")
+
+    return Layout.from_flat(population[int(np.argmin(scores))], template, keyboard)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Sequence
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET, CHAR_IDS
+from layout_optimisation.layouts.base import EMPTY_KEY
+
+
+class ZobristHash:
+    """Hash of a layout as XOR of random values of each (position, key), so that a swap updates it in O(1)"""
+
+    def __init__(self, num_positions: int, seed: bytes):
+        self._seed = seed
+        rng = np.random.default_rng(int.from_bytes(seed, "little"))
+        # EMPTY_KEY and UNTRACKED_KEY index the last two values, so keys of compact layouts are used directly
+        self.values = rng.integers(0, 2**64, size=(num_positions, len(ALPHABET) + 2), dtype=np.uint64)
+        # Python ints are much faster to index and XOR one at a time than numpy scalars
+        self._table = self.values.tolist()
+        self._untracked = {}
+
+    @property
+    def num_positions(self) -> int:
+        return len(self._table)
+
+    def hash(self, keys: np.ndarray) -> int:
+        return int(np.bitwise_xor.reduce(self.values[np.arange(len(keys)), keys]))
+
+    def swap(self, layout_hash: int, keys: Sequence[int], first_idx: int, second_idx: int) -> int:
+        """Hash after swapping two positions of compact keys, keys are before the swap"""
+        first, second = self._table[first_idx], self._table[second_idx]
+        first_key, second_key = keys[first_idx], keys[second_idx]
+        return layout_hash ^ first[first_key] ^ second[second_key] ^ first[second_key] ^ second[first_key]
+
+    def hash_flat(self, flat_keys: Sequence[str]) -> int:
+        layout_hash = 0
+        for position, key in enumerate(flat_keys):
+            layout_hash ^= self._flat_value(position, key)
+        return layout_hash
+
+    def swap_flat(self, layout_hash: int, flat_keys: Sequence[str], first_idx: int, second_idx: int) -> int:
+        """Hash after swapping two positions of flat keys, flat keys are before the swap"""
+        first_key, second_key = flat_keys[first_idx], flat_keys[second_idx]
+        return (
+            layout_hash
+            ^ self._flat_value(first_idx, first_key)
+            ^ self._flat_value(second_idx, second_key)
+            ^ self._flat_value(first_idx, second_key)
+            ^ self._flat_value(second_idx, first_key)
+        )
+
+    def _flat_value(self, position: int, key: str) -> int:
+        if key is None:
+            return self._table[position][EMPTY_KEY]
+        char_id = CHAR_IDS.get(key)
+        if char_id is not None:
+            return self._table[position][char_id]
+        return self._untracked_value(position, key)
+
+    def _untracked_value(self, position: int, key: str) -> int:
+        """Value of each untracked value at each position, so that swapping two untracked values changes the hash"""
+        if (position, key) not in self._untracked:
+            data = position.to_bytes(4, "little") + key.encode()
+            digest = hashlib.blake2b(data, digest_size=8, key=self._seed[:64]).digest()
+            self._untracked[position, key] = int.from_bytes(digest, "little")
+        return self._untracked[position, key]
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import logging
+import math
+import queue
+import random
+from multiprocessing import Process, Queue
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from layout_optimisation.annealing import (
+    anneal_in_worker,
+    generate_initial_layouts,
+    init_worker,
+    worker_args,
+    worker_state,
+)
+from layout_optimisation.chars import ALPHABET
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import UNTRACKED_KEY, CompactLayout, Layout
+from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
+
+logger = logging.getLogger(__name__)
+
+# Keys of a compact layout with values of untracked keys by position, which are rare, and score of the layout
+Migrant = Tuple[np.ndarray, Dict[int, str], float]
+
+
+def pack(flat_keys: List[str], score: float) -> Migrant:
+    """Layout as a small array, so that little is sent between islands"""
+    keys = CompactLayout.from_flat(flat_keys, 1).keys
+    untracked = {int(idx): flat_keys[idx] for idx in np.flatnonzero(keys == UNTRACKED_KEY)}
+    return keys, untracked, score
+
+
+def unpack(migrant: Migrant) -> Tuple[List[str], float]:
+    keys, untracked, score = migrant
+    flat_keys = [ALPHABET[key] if key >= 0 else None for key in keys]
+    for idx, value in untracked.items():
+        flat_keys[idx] = value
+    return flat_keys, score
+
+
+def migration_targets(island: int, num_islands: int, topology: str, rng: random.Random) -> List[int]:
+    if num_islands == 1:
+        return []
+    if topology == "ring":
+        return [(island + 1) % num_islands]
+    if topology == "random":
+        return [rng.choice([idx for idx in range(num_islands) if idx != island])]
+    raise ValueError(f"Unknown migration topology: {topology}")
+
+
+def merge_migrants(
+    population: List[Tuple[List[str], float]], received: List[Tuple[List[str], float]], num_received: int
+) -> List[Tuple[List[str], float]]:
+    """At most num_received best migrants replace worst layouts of the population, if they are better"""
+    received = sorted(received, key=itemgetter(1))[:num_received]
+    return sorted(population + received, key=itemgetter(1))[: len(population)]
+
+
+def run_island(
+    island: int, layouts: List[List[str]], inboxes: List[Queue], results: Queue, init_args: tuple, seed: int
+):
+    """Anneal a subpopulation of layouts in its own process, exchanging best layouts with other islands"""
+    try:
+        init_worker(*init_args)
+        cfg = worker_state()["cfg"]
+        annealing, islands = cfg["annealing"], cfg["islands"]
+        rng = random.Random(seed)
+        random.seed(seed)
+        temperature = annealing["init_temperature"]
+        num_cycles = annealing["num_iters"] // annealing["iters_per_cycle"]
+        cooling_rate = (annealing["final_temperature"] / temperature) ** (1 / num_cycles)
+        num_received = min(islands["num_migrants"], max(len(layouts) - 1, 1))
+
+        population = [(flat_keys, math.inf) for flat_keys in layouts]
+        for cycle in range(num_cycles):
+            new_layouts = []
+            for flat_keys, _ in population:
+                new_layouts.extend(anneal_in_worker(flat_keys, temperature, annealing["iters_per_cycle"])[0])
+            population = sorted(new_layouts, key=itemgetter(1))[: len(layouts)]
+            temperature *= cooling_rate
+
+            if (cycle + 1) % islands["migration_interval"] == 0:
+                migrants = [pack(*layout) for layout in population[: islands["num_migrants"]]]
+                for target in migration_targets(island, len(inboxes), islands["topology"], rng):
+                    inboxes[target].put(migrants)
+                received = []
+                while True:
+                    try:
+                        received.extend(unpack(migrant) for migrant in inboxes[island].get_nowait())
+                    except queue.Empty:
+                        break
+                population = merge_migrants(population, received, num_received)
+            results.put((island, pack(*population[0])))
+    finally:
+        # Migrants, which nobody will read, are dropped, so that the process can exit
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        # Also on failure, so that the parent doesn't wait for this island
+        results.put((island, None))
+
+
+def run_islands(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None) -> Layout:
+    """Island model, initial layouts are split between islands, each of which is annealed in its own process"""
+    islands = cfg["islands"]
+    num_cycles = cfg["annealing"]["num_iters"] // cfg["annealing"]["iters_per_cycle"]
+    layouts = generate_initial_layouts(cfg, corpus, dir_weights)
+    num_islands = min(islands["num_islands"], len(layouts))
+    template = generate_key_map_template(cfg)
+    keyboard = generate_keyboard(template, cfg)
+    best_state = (layouts[0], math.inf)
+
+    with worker_args(keyboard, corpus, cfg, dir_weights) as init_args:
+        inboxes = [Queue() for _ in range(num_islands)]
+        results = Queue()
+        processes = [
+            Process(
+                target=run_island,
+                args=(island, layouts[island::num_islands], inboxes, results, init_args, random.getrandbits(32)),
+                daemon=True,
+            )
+            for island in range(num_islands)
+        ]
+        for process in processes:
+            process.start()
+        progress = tqdm(total=num_islands * num_cycles, desc="Islands")
+        try:
+            finished, stopped = set(), set()
+            while len(finished) < num_islands:
+                try:
+                    island, migrant = results.get(timeout=1)
+                except queue.Empty:
+                    # Islands flush results before they exit, so islands, which stopped at least a timeout ago
+                    # without their last result, were killed
+                    lost = sorted(stopped - finished)
+                    if lost:
+                        raise RuntimeError(f"Islands {lost} stopped without finishing")
+                    stopped = {idx for idx, process in enumerate(processes) if process.exitcode is not None}
+                    continue
+                if migrant is None:
+                    processes[island].join()
+                    if processes[island].exitcode != 0:
+                        raise RuntimeError(f"Island {island} failed with exit code {processes[island].exitcode}")
+                    finished.add(island)
+                    continue
+                best_state = min(best_state, unpack(migrant), key=itemgetter(1))
+                progress.update()
+                progress.set_description(f"Islands, best score={best_state[1]:.3f}")
+        except KeyboardInterrupt:
+            logger.warning("Stopping optimisation due to KeyboardInterrupt")
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            progress.close()
+
+    return Layout.from_flat(best_state[0], template, keyboard)
@@ -2,8 +2,12 @@ from __future__ import annotations
 
 import copy
 from enum import Enum, auto
-from functools import lru_cache, partial
-from typing import List
+from functools import partial
+from typing import List, Union
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET, CHAR_IDS
 
 
 class Finger(Enum):
@@ -158,27 +162,119 @@ class Keyboard:
         self._rows = rows
         self._penalties = penalties
 
+        # Same maps as arrays of enum values, indexed by position within a layer
+        self.hand_array = np.array([hand.value for hand in hands.values])
+        self.finger_array = np.array([finger.value for finger in fingers.values])
+        self.row_array = np.array([row.value for row in rows.values])
+        self.penalty_array = np.array(penalties.values, dtype=float)
+        # Compiled penalty tables, filled by PositionTables.for_keyboard
+        self.tables = {}
+
+    def __len__(self):
+        return len(self._hands)
+
+
+# Keys of CompactLayout, which are not chars from ALPHABET
+EMPTY_KEY = -1
+UNTRACKED_KEY = -2
+
+
+class CompactLayout:
+    """Char ids by flat position and flat positions by char id, so that lookups are gathers instead of searches"""
+
+    __slots__ = ("keys", "positions", "num_keys", "keyboard")
+
+    def __init__(self, keys: np.ndarray, num_keys: int, keyboard: Keyboard = None):
+        self.keys = keys
+        self.num_keys = num_keys
+        self.keyboard = keyboard
+        present = np.flatnonzero(keys >= 0)
+        if len(np.unique(keys[present])) != len(present):
+            duplicates = [ALPHABET[char_id] for char_id in np.flatnonzero(np.bincount(keys[present]) > 1)]
+            raise ValueError(f"Multiple instances of same key are not currently supported: {duplicates}")
+        self.positions = np.full(len(ALPHABET), -1, dtype=np.int16)
+        self.positions[keys[present]] = present
+
+    def char_positions(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        positions = self.positions[char_ids]
+        if np.any(positions < 0):
+            missing = [ALPHABET[char_id] for char_id in np.unique(np.asarray(char_ids)[positions < 0])]
+            raise KeyError(f"Chars are not in the layout: {missing}")
+        return positions
+
+    def layers(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        return self.char_positions(char_ids) // self.num_keys
+
+    def indexes(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        """Index within the layer"""
+        return self.char_positions(char_ids) % self.num_keys
+
+    def hands(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        return self.keyboard.hand_array[self.indexes(char_ids)]
+
+    def fingers(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        return self.keyboard.finger_array[self.indexes(char_ids)]
+
+    def rows(self, char_ids: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        return self.keyboard.row_array[self.indexes(char_ids)]
+
+    def location_penalties(self, char_ids: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        return self.keyboard.penalty_array[self.indexes(char_ids)]
+
+    def swapped(self, first_idx: int, second_idx: int) -> CompactLayout:
+        swapped = copy.copy(self)
+        swapped.keys = self.keys.copy()
+        swapped.positions = self.positions.copy()
+        first_key, second_key = self.keys[first_idx], self.keys[second_idx]
+        swapped.keys[first_idx], swapped.keys[second_idx] = second_key, first_key
+        if first_key >= 0:
+            swapped.positions[first_key] = second_idx
+        if second_key >= 0:
+            swapped.positions[second_key] = first_idx
+        return swapped
+
+    def flatten(self) -> List[str]:
+        """Flat keys of tracked chars, empty keys and untracked values are None"""
+        return [ALPHABET[char_id] if char_id >= 0 else None for char_id in self.keys]
+
+    @staticmethod
+    def from_flat(flat_keys: list, num_keys: int, keyboard: Keyboard = None) -> CompactLayout:
+        keys = [EMPTY_KEY if key is None else CHAR_IDS.get(key, UNTRACKED_KEY) for key in flat_keys]
+        return CompactLayout(np.array(keys, dtype=np.int8), num_keys, keyboard)
+
 
 class Layout:
     def __init__(self, layers: List[KeyMap], keyboard: Keyboard = None):
         self._layers = layers
-        self._char_map = {}
-        for layer_idx, layer in enumerate(self._layers):
-            for value in layer.values:
-                if value in self._char_map and value is not None:
-                    raise ValueError(f"Multiple instances of same key are not currently supported: {value}")
-                self._char_map[value] = layer_idx
-
+        seen = set()
+        # Flat positions of values, which aren't in ALPHABET, so they aren't in the compact layout
+        self._untracked = {}
+        for position, value in enumerate(self.flatten()):
+            if value in seen and value is not None:
+                raise ValueError(f"Multiple instances of same key are not currently supported: {value}")
+            seen.add(value)
+            if value is not None and value not in CHAR_IDS:
+                self._untracked[value] = position
         self._keyboard = keyboard
+        self._compact = CompactLayout.from_flat(self.flatten(), len(layers[0]) if layers else 0, keyboard)
 
     @property
     def layers(self) -> List[KeyMap]:
         return self._layers
 
+    @property
+    def keyboard(self) -> Keyboard:
+        return self._keyboard
+
+    @property
+    def compact(self) -> CompactLayout:
+        return self._compact
+
     def add_keyboard(self, keyboard: Keyboard):
         if self._keyboard is not None:
             raise ValueError(f"Keyboard was already added")
         self._keyboard = keyboard
+        self._compact.keyboard = keyboard
 
     def format(self, cfg: dict) -> str:
         result = ""
@@ -187,33 +283,32 @@ class Layout:
             result += layer.format(cfg) + "\n"
         return result
 
-    @lru_cache
     def get_layer(self, char: str) -> KeyMap:
-        return self._layers[self._char_map[char]]
+        return self._layers[self.get_layer_idx(char)]
+
+    def get_position(self, char: str) -> int:
+        """Flat position of the char, raises KeyError if it is not in the layout"""
+        if char in CHAR_IDS:
+            return int(self._compact.char_positions(CHAR_IDS[char]))
+        return self._untracked[char]
 
-    @lru_cache
     def get_layer_idx(self, char: str) -> int:
-        return self._layers.index(self.get_layer(char))
+        return self.get_position(char) // self._compact.num_keys
 
-    @lru_cache
     def get_index(self, char: str) -> int:
-        return self.get_layer(char).values.index(char)
+        return self.get_position(char) % self._compact.num_keys
 
-    @lru_cache
     def get_hand(self, char: str) -> Hand:
-        return self._keyboard._hands[self.get_index(char)]
+        return Hand(self._keyboard.hand_array[self.get_index(char)])
 
-    @lru_cache
     def get_finger(self, char: str) -> Finger:
-        return self._keyboard._fingers[self.get_index(char)]
+        return Finger(self._keyboard.finger_array[self.get_index(char)])
 
-    @lru_cache
-    def get_row(self, char: str) -> Finger:
-        return self._keyboard._rows[self.get_index(char)]
+    def get_row(self, char: str) -> Row:
+        return Row(self._keyboard.row_array[self.get_index(char)])
 
-    @lru_cache
-    def get_location_penalty(self, char: str) -> int:
-        return self._keyboard._penalties[self.get_index(char)]
+    def get_location_penalty(self, char: str) -> float:
+        return float(self._keyboard.penalty_array[self.get_index(char)])
 
     def flatten(self, keys_required: int = None) -> List[str]:
         all_keys = []
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import random
+from typing import List, Tuple
+
+
+class SearchSpace:
+    """Frozen keys and blocked indexes as hard constraints, so only keys at free positions are permuted"""
+
+    def __init__(self, num_positions: int, cfg: dict):
+        self.num_positions = num_positions
+        self.pinned = {idx: char for char, idx in cfg["frozen_keys"].items()}
+        self.blocked = sorted(cfg["blocked_indexes"])
+        conflicts = set(self.pinned).intersection(self.blocked)
+        if conflicts:
+            raise ValueError(f"Indexes are both frozen and blocked: {sorted(conflicts)}")
+        fixed = set(self.pinned).union(self.blocked)
+        self.free = [idx for idx in range(num_positions) if idx not in fixed]
+
+    def is_valid(self, flat_keys: List[str]) -> bool:
+        pinned = all(flat_keys[idx] == char for idx, char in self.pinned.items())
+        return pinned and all(flat_keys[idx] is None for idx in self.blocked)
+
+    def repair(self, flat_keys: List[str]) -> List[str]:
+        """Copy with frozen chars swapped to their positions and keys swapped out of blocked indexes"""
+        flat_keys = list(flat_keys)
+        for idx, char in self.pinned.items():
+            if flat_keys[idx] != char:
+                if char not in flat_keys:
+                    raise ValueError(f"Frozen char {char!r} is not in the layout")
+                char_idx = flat_keys.index(char)
+                flat_keys[idx], flat_keys[char_idx] = flat_keys[char_idx], flat_keys[idx]
+        empty = [idx for idx in self.free if flat_keys[idx] is None]
+        for idx in self.blocked:
+            if flat_keys[idx] is not None:
+                if not empty:
+                    raise ValueError("Not enough empty positions to keep blocked indexes empty")
+                empty_idx = empty.pop()
+                flat_keys[idx], flat_keys[empty_idx] = flat_keys[empty_idx], flat_keys[idx]
+        return flat_keys
+
+    def shuffle(self, flat_keys: List[str], rng: random.Random = random) -> List[str]:
+        """Copy of valid flat keys with keys at free positions shuffled"""
+        values = [flat_keys[idx] for idx in self.free]
+        rng.shuffle(values)
+        flat_keys = list(flat_keys)
+        for idx, value in zip(self.free, values):
+            flat_keys[idx] = value
+        return flat_keys
+
+
+class SwapGenerator:
+    """Proposes random swaps of two free positions, which change the layout"""
+
+    def __init__(self, space: SearchSpace, rng: random.Random = random):
+        self._rng = rng
+        self.candidates = space.free
+        if len(self.candidates) < 2:
+            raise ValueError(f"Only {len(self.candidates)} positions can be moved, so no swaps are possible")
+
+    @staticmethod
+    def is_allowed(flat_keys: List[str], first_idx: int, second_idx: int) -> bool:
+        return first_idx != second_idx and (flat_keys[first_idx] is not None or flat_keys[second_idx] is not None)
+
+    def propose(self, flat_keys: List[str]) -> Tuple[int, int]:
+        """Random allowed swap for current flat keys, disallowed swaps are drawn again"""
+        while True:
+            first_idx = self.candidates[self._rng.randrange(len(self.candidates))]
+            second_idx = self.candidates[self._rng.randrange(len(self.candidates))]
+            if self.is_allowed(flat_keys, first_idx, second_idx):
+                return first_idx, second_idx
@@ -3,295 +3,323 @@ from __future__ import annotations
 import copy
 import logging
 from collections import defaultdict
-from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
-from tqdm import tqdm
 
-from layout_optimisation.layouts.base import Finger, Layout, Row
-from layout_optimisation.utils import process_text
+from layout_optimisation.chars import ALPHABET, ARROWS, CHAR_IDS, DIGITS, LETTERS, SPACING
+from layout_optimisation.corpus import MAX_NGRAM, Corpus, MergedNGrams, NGramCounts
+from layout_optimisation.layouts.base import EMPTY_KEY, CompactLayout, Keyboard, Layout
+from layout_optimisation.tables import PositionTables
 
 logger = logging.getLogger(__name__)
 
 
-DIGITS = set("1234567890")
-LETTERS = set("qwertyuiopasdfghjklzxcvbnm")
-SPECIAL = set("`!\"$%^&*()-=_+[]{};'#:@~\|,./<>?")
-SPACING = {"\t", "\n", " ", "\b"}
-ARROWS = {"↓", "↑", "←", "→"}
-EXTRA = {"\x1b"}
-CHARS_TO_TRACK = DIGITS.union(LETTERS).union(SPECIAL).union(SPACING).union(ARROWS).union(EXTRA)
-
 GROUPS = {"writing": LETTERS.union(SPACING), "digits": DIGITS, "arrows": ARROWS, "math_operators": set("+-*/")}
 
+# Penalties which depend on the text, in the order they are reported
+TEXT_PENALTIES = [
+    "location",
+    "layers",
+    "same_finger",
+    "same_hand",
+    "alternating_hand",
+    "long_jump_finger",
+    "long_jump_consecutive",
+    "long_jump_sandwich",
+    "long_jump_hand",
+    "roll_in",
+    "roll_out",
+    "roll_reversal",
+    "twist",
+    "finger_disbalance",
+]
+# Penalties which only depend on the layout, these are excluded with no_forced
+FORCED_PENALTIES = ["split_group", "frozen_keys", "blocked_indexes"]
+# Number of n-gram lookups per chunk of evaluate_batch, larger batches are split into chunks to limit memory
+BATCH_CHUNK_ELEMENTS = 2**22
+
+
+def get_penalty_terms(no_forced=False) -> List[str]:
+    """Keys of penalties returned by evaluate, in the same order as columns of evaluate_batch"""
+    return ["total"] + TEXT_PENALTIES + ([] if no_forced else FORCED_PENALTIES)
+
+
+def calculate_layout_penalties(layout: Layout, cfg: dict) -> Dict[str, float]:
+    return calculate_flat_penalties(layout.flatten(), len(layout.layers[0]), cfg)
+
+
+def get_groups(cfg: dict) -> Dict[str, set]:
+    groups = copy.copy(GROUPS)
+    groups.update({name: set(values) for name, values in cfg["extra_groups"].items()})
+    return groups
 
-def calc_long_jump(rows: np.array, sep: int = 1) -> np.array:
-    top_start = rows[:-sep] == Row.TOP.value
-    bot_start = rows[:-sep] == Row.BOT.value
-    top_end = rows[sep:] == Row.TOP.value
-    bot_end = rows[sep:] == Row.BOT.value
-    long_jump = top_start & bot_end | bot_start & top_end
-    return long_jump
-
-
-def calculate_penalties(text: str, layout: Layout, cfg: dict) -> Dict[str, float]:
-    if len(text) == 0:
-        raise ValueError(f"Passed empty text into calculate_penalties")
-    location_penalty = 0
-    chars = []
-    hands = []
-    fingers = []
-    rows = []
-    layers = []
-
-    missed_chars = set()
-    for char in tqdm(text, desc="Processing text", disable=cfg["disable_eval_tqdm"]):
-        if char in missed_chars:
-            continue
-        if char not in CHARS_TO_TRACK and char not in missed_chars:
-            logger.warning(f"Found char {char!r}, which is not tracked, skipping")
-            missed_chars.add(char)
-            continue
-        if char not in cfg["ignore_loc_penality_for_chars"]:
-            location_penalty += layout.get_location_penalty(char)
-        chars.append(char)
-        hands.append(layout.get_hand(char).value)
-        fingers.append(layout.get_finger(char).value)
-        rows.append(layout.get_row(char).value)
-        layers.append(layout.get_layer_idx(char))
-
-    logger.info("Making arrays")
-    chars = np.array(chars)
-    logger.info("Chars done")
-    hands = np.array(hands)
-    logger.info("Hands done")
-    fingers = np.array(fingers)
-    logger.info("Fingers done")
-    rows = np.array(rows)
-    logger.info("Rows done")
-    layers = np.array(layers)
-    logger.info("Layers done")
-
-    text_len = len(chars)
 
+def get_extra_key_mults(cfg: dict) -> np.ndarray:
+    """Location weight of each char per char of the text, for extra keys, which aren't in texts"""
+    extra_mults = np.zeros(len(ALPHABET))
+    extra_mults[CHAR_IDS["\x1b"]] = cfg["esc_mult"]
+    extra_mults[CHAR_IDS["\b"]] = cfg["backspace_mult"]
+    extra_mults[[CHAR_IDS[char] for char in ARROWS]] = cfg["arrow_mult"] / 4
+    return extra_mults
+
+
+def calculate_flat_penalties(flat_keys: List[str], num_keys: int, cfg: dict, constrained=False) -> Dict[str, float]:
+    """Same as calculate_layout_penalties for flat keys, constrained keys aren't checked for frozen and blocked"""
     penalties = cfg["penalties"]
-    logger.info("Calculating penalties")
-    location_penalty += layout.get_location_penalty("\x1b") * text_len * cfg["esc_mult"]
-    location_penalty += layout.get_location_penalty("\b") * text_len * cfg["backspace_mult"]
-    arrow_costs = [layout.get_location_penalty(char) for char in ARROWS]
-    location_penalty += np.sum(arrow_costs) / 4 * text_len * cfg["arrow_mult"]
-    location_penalty = penalties["location"] * location_penalty / text_len
-    total = location_penalty
-    logger.info(f"Location: {location_penalty:.3f}")
-
-    layer_penalty = 0
-    for layerd_idx, layer_cost in enumerate(penalties["layers"]):
-        layer_penalty += np.sum(layers == layerd_idx) * layer_cost / text_len
-    total += layer_penalty
-    logger.info(f"Layers: {layer_penalty:.3f}")
-
-    # Same finger different characters
-    same_finger = (fingers[:-1] == fingers[1:]) & (hands[:-1] & hands[1:])
-    diff_char = chars[:-1] != chars[1:]
-    same_finger_different_key = same_finger & diff_char
-    same_finger_penalty = penalties["same_finger"] * np.sum(same_finger_different_key) / text_len
-    total += same_finger_penalty
-    logger.info(f"Same finger: {same_finger_penalty:.3f}")
-
-    # Same hand four times in a row
-    same_hand = hands[:-1] == hands[1:]
-    same_hand_4 = same_hand[2:] & same_hand[1:-1] & same_hand[:-2]
-    same_hand_penalty = penalties["same_hand"] * np.sum(same_hand_4) / text_len
-    total += same_hand_penalty
-    logger.info(f"Same hand: {same_hand_penalty:.3f}")
-
-    # Alternating hand four times in a row
-    diff_hand = hands[:-1] != hands[1:]
-    diff_hand_4 = diff_hand[2:] & diff_hand[1:-1] & diff_hand[:-2]
-    alternating_hand_penalty = penalties["alternating_hand"] * np.sum(diff_hand_4) / text_len
-    total += alternating_hand_penalty
-    logger.info(f"Alternating hand: {alternating_hand_penalty:.3f}")
-
-    # Long jumps
-    long_jump = calc_long_jump(rows)
-
-    # Same finger long jump
-    long_jump_finger_penalty = penalties["long_jump_finger"] * np.sum(same_finger & long_jump) / text_len
-    total += long_jump_finger_penalty
-    logger.info(f"Long jump finger: {long_jump_finger_penalty:.3f}")
-
-    # Consecutive fingers long jump
-    i_finger = fingers == Finger.I.value
-    m_finger = fingers == Finger.M.value
-    r_finger = fingers == Finger.R.value
-    p_finger = fingers == Finger.P.value
-    consecutive_fingers = (
-        i_finger[:-1] & m_finger[1:]
-        | m_finger[:-1] & r_finger[1:]
-        | r_finger[:-1] & p_finger[1:]
-        | p_finger[:-1] & r_finger[1:]
-        | r_finger[:-1] & m_finger[1:]
-        | m_finger[:-1] & i_finger[1:]
-    ) & same_hand
-    long_jump_consecutive_penalty = (
-        penalties["long_jump_consecutive"] * (np.sum(consecutive_fingers & long_jump)) / text_len
-    )
-    total += long_jump_consecutive_penalty
-    logger.info(f"Long jump consecutive: {long_jump_consecutive_penalty:.3f}")
-
-    # Long jump same hand
-    long_jump_hand_penalty = penalties["long_jump_hand"] * (np.sum(same_hand & long_jump)) / text_len
-    total += long_jump_hand_penalty
-    logger.info(f"Long jump hand: {long_jump_hand_penalty:.3f}")
-
-    # Long jump sandwich
-    same_finger_2 = (fingers[:-2] == fingers[2:]) & (hands[:-2] == hands[2:])
-    long_jump = calc_long_jump(rows, sep=2)
-    long_jumps_sandwich_penalty = penalties["long_jump_sandwich"] * (np.sum(same_finger_2 & long_jump)) / text_len
-    total += long_jumps_sandwich_penalty
-    logger.info(f"Long jump sandwich: {long_jumps_sandwich_penalty:.3f}")
-
-    # Rolls
-    same_row = rows[:-1] == rows[1:]
-    same_row_3 = same_row[:-1] & same_row[1:]
-    same_hand_3 = same_hand[:-1] & same_hand[1:]
-    inbound = p_finger[:-2] & r_finger[1:-1] & m_finger[2:] | r_finger[:-2] & m_finger[1:-1] & i_finger[2:]
-    outbound = i_finger[:-2] & m_finger[1:-1] & r_finger[2:] | m_finger[:-2] & r_finger[1:-1] & p_finger[2:]
-    inbound = inbound & same_hand_3
-    outbound = outbound & same_hand_3
-    roll_in = inbound & same_row_3
-    roll_out = outbound & same_row_3
-    roll_in_penalty = np.sum(roll_in) * penalties["roll_in"] / text_len
-    roll_out_penalty = np.sum(roll_out) * penalties["roll_out"] / text_len
-    total += roll_in_penalty + roll_out_penalty
-    logger.info(f"Rolls, in: {roll_in_penalty:.3f}; out: {roll_out_penalty:.3f}")
-
-    # Roll reversal
-    roll_reversal = (
-        (
-            r_finger[:-2] & p_finger[1:-1] & m_finger[2:]
-            | m_finger[:-2] & r_finger[1:-1] & i_finger[2:]
-            | m_finger[:-2] & i_finger[1:-1] & r_finger[2:]
-            | r_finger[:-2] & m_finger[1:-1] & p_finger[2:]
-        )
-        & same_hand_3
-        & same_row_3
-    )
-    roll_reversal_penalty = penalties["roll_reversal"] * np.sum(roll_reversal) / text_len
-    total += roll_reversal_penalty
-    logger.info(f"Roll reversal: {roll_reversal_penalty:.3f}")
-
-    # Twist, only considering main rows here
-    descending = (rows[:-2] == Row.TOP.value) & (rows[1:-1] == Row.HOM.value) & (rows[2:] == Row.BOT.value)
-    ascending = (rows[:-2] == Row.BOT.value) & (rows[1:-1] == Row.HOM.value) & (rows[2:] == Row.TOP.value)
-    twist = (inbound | outbound) & (ascending | descending)
-    twist_penalty = penalties["twist"] * np.sum(twist) / text_len
-    total += twist_penalty
-    logger.info(f"Twist: {twist_penalty:.3f}")
-
-    # Finger disbalance, count only index, middle and ring fingers
-
-    finger_usage = {"I": i_finger, "M": m_finger, "R": r_finger}
-    finger_ratios = cfg["finger_ratios"]
-    finger_totals_normed = {finger: np.sum(usage) / finger_ratios[finger] for finger, usage in finger_usage.items()}
-    finger_values = list(finger_totals_normed.values())
-    finger_disbalance_penalty = (max(finger_values) - min(finger_values)) / text_len
-    finger_disbalance_penalty *= penalties["finger_disbalance"]
-    total += finger_disbalance_penalty
-    logger.info(f"Finger disbalance: {finger_disbalance_penalty:.3f}")
+    key_indexes = {char: idx for idx, char in enumerate(flat_keys) if char is not None}
 
     # Split groups, similar keys split between layers
-    groups = copy.copy(GROUPS)
-    groups.update({name: set(values) for name, values in cfg["extra_groups"].items()})
+    groups = get_groups(cfg)
     split_group_penalty = 0
     for group_name, group in groups.items():
-        group_layers = [layout.get_layer(char) for char in group]
+        group_layers = [key_indexes[char] // num_keys for char in group]
         if len(set(group_layers)) > 1:
             logger.debug(f"Group {group_name} is split")
             split_group_penalty += 1
     split_group_penalty *= penalties["split_group"]
-    total += split_group_penalty
     logger.info(f"Split group: {split_group_penalty:.3f}")
+    if constrained:
+        return {"split_group": split_group_penalty, "frozen_keys": 0, "blocked_indexes": 0}
 
     # Frozen keys, kind of a hack, but an easy way to assign a key to a desired place
     frozen_keys_penalty = 0
     for char, index in cfg["frozen_keys"].items():
-        if layout.flatten().index(char) != index:
+        if key_indexes[char] != index:
             logger.debug(f"Char {char!r} is in the wrong place")
             frozen_keys_penalty += 1
     frozen_keys_penalty *= penalties["frozen_keys"]
-    total += frozen_keys_penalty
     logger.info(f"Frozen keys: {frozen_keys_penalty:.3f}")
 
     # Blocked indexes, also a hack to prevent chars being assigned to certain positions
     blocked_indexes_penalty = 0
     for idx in cfg["blocked_indexes"]:
-        if layout.flatten()[idx] is not None:
+        if flat_keys[idx] is not None:
             logger.debug(f"Found key at index {idx}, which is supposed to be empty")
             blocked_indexes_penalty += 1
     blocked_indexes_penalty *= penalties["blocked_indexes"]
-    total += blocked_indexes_penalty
     logger.info(f"Blocked indexes: {blocked_indexes_penalty:.3f}")
 
     return {
-        "total": total,
-        "location": location_penalty,
-        "layers": layer_penalty,
-        "same_finger": same_finger_penalty,
-        "same_hand": same_hand_penalty,
-        "alternating_hand": alternating_hand_penalty,
-        "long_jump_finger": long_jump_finger_penalty,
-        "long_jump_consecutive": long_jump_consecutive_penalty,
-        "long_jump_sandwich": long_jumps_sandwich_penalty,
-        "long_jump_hand": long_jump_hand_penalty,
-        "roll_in": roll_in_penalty,
-        "roll_out": roll_out_penalty,
-        "roll_reversal": roll_reversal_penalty,
-        "twist": twist_penalty,
-        "finger_disbalance": finger_disbalance_penalty,
         "split_group": split_group_penalty,
         "frozen_keys": frozen_keys_penalty,
         "blocked_indexes": blocked_indexes_penalty,
     }
 
 
-def process_and_calculate(dir_path: Path, layout: Layout, cfg: dict) -> Dict[str, float]:
-    full_text = ""
-    for file_path in dir_path.rglob("*"):
-        if file_path.is_dir():
-            continue
-        with file_path.open() as f:
-            lines = f.readlines()[:: cfg["text_downsampling"]]
-            full_text += "".join(lines)
-            full_text += "\n"
-    full_text = process_text(full_text)
-    if len(full_text) == 0:
-        return defaultdict(float)
-    return calculate_penalties(full_text, layout, cfg)
+def get_char_positions(layout: CompactLayout) -> np.ndarray:
+    """Index in the flattened layout of each tracked char, indexed by char id"""
+    return layout.char_positions(np.arange(len(ALPHABET)))
 
 
-def evaluate(
-    layout: Layout, text_dir: Path, cfg: dict, dir_weights: Dict[str, float] = None, no_forced=False
+def count_unigram_hits(
+    ngrams: Union[NGramCounts, MergedNGrams], char_positions: np.ndarray, tables: PositionTables, cfg: dict
 ) -> Dict[str, float]:
-    dir_weights = dir_weights or {}
-
+    """Hits of terms of single chars, char positions can have leading axes for several layouts"""
+    text_len = ngrams.text_len
+    hits = {}
+
+    chars = ngrams.grams(1)[:, 0]
+    counts = ngrams.counts(1)
+    positions = char_positions[..., chars]
+    hits["location"] = (tables.locations[positions] * ~tables.ignore_location[chars]) @ counts
+    # Extra keys are counted once per char of the text
+    extra_cost = tables.locations[char_positions] @ get_extra_key_mults(cfg)
+    hits["location"] += np.multiply.outer(extra_cost, text_len)
+    hits["layers"] = tables.layer_costs[positions] @ counts
+    for name, usage in zip(tables.finger_names, tables.finger_usage):
+        hits[f"finger_{name}"] = usage[positions] @ counts
+    return hits
+
+
+def count_ngram_hits(
+    ngrams: Union[NGramCounts, MergedNGrams], char_positions: np.ndarray, tables: PositionTables
+) -> Dict[str, int]:
+    """Hits of terms over bigrams, trigrams and fourgrams, these are integers so they can be updated exactly"""
+    hits = {}
+    for table in tables.ngram_tables:
+        term_hits = table.count_hits(char_positions, ngrams.grams(table.n), ngrams.counts(table.n))
+        hits.update(zip(table.terms, term_hits))
+    return hits
+
+
+def count_batch_ngram_hits(
+    ngrams: MergedNGrams, perms: np.ndarray, char_positions: np.ndarray, tables: PositionTables
+) -> Dict[str, np.ndarray]:
+    """Same as count_ngram_hits for rows of keys of compact layouts, hits have shape (layouts, directories)"""
+    hits = {}
+    for table in tables.ngram_tables:
+        if table.codes is None:
+            # Terms are only set for few tuples of positions, so counts of chars at them are cheaper than all n-grams
+            term_hits = table.count_layout_hits(perms, ngrams.dense_counts(table.n, table.columns))
+        else:
+            term_hits = table.count_batch_hits(char_positions, ngrams.grams(table.n), ngrams.counts(table.n))
+        hits.update(zip(table.terms, term_hits))
+    return hits
+
+
+def count_hits(
+    ngrams: Union[NGramCounts, MergedNGrams], char_positions: np.ndarray, tables: PositionTables, cfg: dict
+) -> Dict[str, float]:
+    """Unweighted totals of each penalty term over the text, penalty is then just weight * hits / text_len"""
+    hits = count_unigram_hits(ngrams, char_positions, tables, cfg)
+    hits.update(count_ngram_hits(ngrams, char_positions, tables))
+    return hits
+
+
+def hits_to_penalties(
+    hits: Dict[str, float],
+    text_len: Union[int, np.ndarray],
+    layout_penalties: Dict[str, float],
+    tables: PositionTables,
+    cfg: dict,
+) -> Dict[str, float]:
+    penalties = cfg["penalties"]
+    result = {"total": 0}
+    for key in TEXT_PENALTIES:
+        if key == "finger_disbalance":
+            finger_values = [
+                hits[f"finger_{name}"] / ratio for name, ratio in zip(tables.finger_names, tables.finger_ratios)
+            ]
+            disbalance = np.max(finger_values, axis=0) - np.min(finger_values, axis=0)
+            result[key] = penalties[key] * disbalance / text_len
+        elif key == "layers":
+            result[key] = hits[key] / text_len
+        else:
+            result[key] = penalties[key] * hits[key] / text_len
+        result["total"] += result[key]
+    for key, value in layout_penalties.items():
+        result["total"] += value
+        result[key] = value
+    return result
+
+
+def calculate_ngram_penalties(ngrams: NGramCounts, layout: Layout, cfg: dict) -> Dict[str, float]:
+    """Penalties of a layout over a text, each distinct n-gram is counted once and weighted by its count"""
+    text_len = ngrams.text_len
+    if text_len == 0:
+        raise ValueError(f"Passed empty n-grams into calculate_ngram_penalties")
+    tables = PositionTables.for_keyboard(layout.keyboard, cfg, len(layout.layers))
+    hits = count_hits(ngrams, get_char_positions(layout.compact), tables, cfg)
+    return hits_to_penalties(hits, text_len, calculate_layout_penalties(layout, cfg), tables, cfg)
+
+
+def weigh_penalties(dir_penalties: Dict[str, Dict[str, float]], dir_weights: Dict[str, float]) -> Dict[str, float]:
     total_penalties = defaultdict(float)
-    for dir_path in text_dir.glob("*"):
-        if not dir_path.is_dir():
-            continue
-        if dir_path.name not in dir_weights:
-            dir_weights[dir_path.name] = 1
-        dir_weight = dir_weights[dir_path.name]
-        penalties = process_and_calculate(dir_path, layout, cfg)
+    for dir_name, penalties in dir_penalties.items():
         for key, value in penalties.items():
-            total_penalties[key] += value * dir_weight
+            total_penalties[key] += value * dir_weights[dir_name]
 
     total_weight = sum(dir_weights.values())
     for key, value in total_penalties.items():
         total_penalties[key] = value / total_weight
+    return total_penalties
+
+
+def evaluate(
+    layout: Layout, corpus: Corpus, cfg: dict, dir_weights: Dict[str, float] = None, no_forced=False
+) -> Dict[str, float]:
+    dir_weights = dir_weights or {}
+
+    dir_penalties = {}
+    for dir_name, ngrams in corpus.ngrams.items():
+        if dir_name not in dir_weights:
+            dir_weights[dir_name] = 1
+        if ngrams.text_len == 0:
+            continue
+        dir_penalties[dir_name] = calculate_ngram_penalties(ngrams, layout, cfg)
+
+    total_penalties = weigh_penalties(dir_penalties, dir_weights)
     if no_forced:
-        for key in ["split_group", "frozen_keys", "blocked_indexes"]:
+        for key in FORCED_PENALTIES:
             total_penalties["total"] -= total_penalties[key]
             del total_penalties[key]
     return total_penalties
+
+
+def get_merged_dir_weights(corpus: Corpus, dir_weights: Dict[str, float] = None) -> Tuple[np.ndarray, float]:
+    """Weights of directories of corpus.merged and total weight, which also counts empty directories like evaluate"""
+    dir_weights = dir_weights or {}
+    for dir_name in corpus:
+        if dir_name not in dir_weights:
+            dir_weights[dir_name] = 1
+    merged_weights = np.array([dir_weights[dir_name] for dir_name in corpus.merged.dir_names])
+    return merged_weights, sum(dir_weights.values())
+
+
+def weigh_merged_penalties(
+    dir_penalties: Dict[str, np.ndarray], dir_weights: np.ndarray, total_weight: float
+) -> Dict[str, np.ndarray]:
+    """Same as weigh_penalties for penalties with last axis over directories of merged n-grams"""
+    # Layout penalties are the same for all directories, so they broadcast against the weights
+    return {key: np.sum(value * dir_weights, axis=-1) / total_weight for key, value in dir_penalties.items()}
+
+
+def get_batch_char_positions(perms: np.ndarray) -> np.ndarray:
+    """Same as get_char_positions for each row of keys of compact layouts"""
+    layout_idx, positions = np.nonzero(perms >= 0)
+    char_positions = np.full((len(perms), len(ALPHABET)), -1, dtype=np.int64)
+    char_positions[layout_idx, perms[layout_idx, positions]] = positions
+    if np.any(char_positions < 0):
+        layout_idx, char_ids = np.nonzero(char_positions < 0)
+        raise KeyError(f"Chars are not in layout {layout_idx[0]}: {[ALPHABET[char_id] for char_id in char_ids]}")
+    return char_positions
+
+
+def calculate_batch_layout_penalties(
+    perms: np.ndarray, char_positions: np.ndarray, num_keys: int, cfg: dict
+) -> Dict[str, np.ndarray]:
+    """Same as calculate_flat_penalties for each row of keys of compact layouts"""
+    penalties = cfg["penalties"]
+
+    groups = get_groups(cfg)
+    split_group_penalty = 0
+    for group in groups.values():
+        group_layers = char_positions[:, [CHAR_IDS[char] for char in group]] // num_keys
+        split_group_penalty += np.any(group_layers != group_layers[:, :1], axis=1)
+
+    frozen_ids = [CHAR_IDS[char] for char in cfg["frozen_keys"]]
+    frozen_keys_penalty = np.sum(char_positions[:, frozen_ids] != list(cfg["frozen_keys"].values()), axis=1)
+    blocked_indexes_penalty = np.sum(perms[:, cfg["blocked_indexes"]] != EMPTY_KEY, axis=1)
+    return {
+        "split_group": split_group_penalty * penalties["split_group"],
+        "frozen_keys": frozen_keys_penalty * penalties["frozen_keys"],
+        "blocked_indexes": blocked_indexes_penalty * penalties["blocked_indexes"],
+    }
+
+
+def evaluate_batch(
+    perms: np.ndarray,
+    keyboard: Keyboard,
+    corpus: Corpus,
+    cfg: dict,
+    dir_weights: Dict[str, float] = None,
+    no_forced=False,
+) -> np.ndarray:
+    """Same as evaluate for rows of keys of compact layouts, with a column per term of get_penalty_terms"""
+    num_keys = len(keyboard)
+    tables = PositionTables.for_keyboard(keyboard, cfg, perms.shape[1] // num_keys)
+    ngrams = corpus.merged
+    merged_weights, total_weight = get_merged_dir_weights(corpus, dir_weights)
+    terms = get_penalty_terms(no_forced)
+
+    char_positions = get_batch_char_positions(perms)
+    layout_penalties = calculate_batch_layout_penalties(perms, char_positions, num_keys, cfg)
+    # Layout penalties get an axis for directories, so that they broadcast in the same way as text penalties
+    layout_penalties = {key: value[:, np.newaxis] for key, value in layout_penalties.items()}
+
+    max_ngrams = max(len(ngrams.grams(n)) for n in range(1, MAX_NGRAM + 1))
+    chunk_size = max(BATCH_CHUNK_ELEMENTS // max_ngrams, 1)
+    result = np.empty((len(perms), len(terms)))
+    for start in range(0, len(perms), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        hits = count_unigram_hits(ngrams, char_positions[chunk], tables, cfg)
+        hits.update(count_batch_ngram_hits(ngrams, perms[chunk], char_positions[chunk], tables))
+        chunk_layout_penalties = {key: value[chunk] for key, value in layout_penalties.items()}
+        dir_penalties = hits_to_penalties(hits, ngrams.text_len, chunk_layout_penalties, tables, cfg)
+        penalties = weigh_merged_penalties(dir_penalties, merged_weights, total_weight)
+        if no_forced:
+            for key in FORCED_PENALTIES:
+                penalties["total"] -= penalties[key]
+        result[chunk] = np.stack([penalties[key] for key in terms], axis=1)
+    return result
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from layout_optimisation.corpus import Corpus, NGramCounts
+from layout_optimisation.layouts.base import Keyboard
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+
+logger = logging.getLogger(__name__)
+
+
+def shard_corpora(corpus: Corpus, num_shards: int) -> List[Corpus]:
+    """Corpora, which split files of each directory between them, so that each has some of every directory"""
+    if not corpus.file_ngrams:
+        raise ValueError("Corpus doesn't have counts of files, read it with Corpus.from_dir")
+    shards = [{} for _ in range(num_shards)]
+    for dir_name, file_ngrams in corpus.file_ngrams.items():
+        files = list(file_ngrams.values())
+        for idx, shard in enumerate(shards):
+            # Directories with fewer files than shards are whole in every shard, so they don't vary between shards
+            if len(files) < num_shards:
+                shard[dir_name] = corpus.ngrams[dir_name]
+            else:
+                shard[dir_name] = NGramCounts.combine(files[idx::num_shards])
+    return [Corpus(shard) for shard in shards]
+
+
+def race(
+    perms: np.ndarray,
+    keyboard: Keyboard,
+    corpus: Corpus,
+    cfg: dict,
+    dir_weights: Dict[str, float] = None,
+    no_forced=False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Indexes of candidates, which survive racing on shards, and mean scores of all candidates over scored shards"""
+    racing = cfg["racing"]
+    total_idx = get_penalty_terms(no_forced).index("total")
+    shards = shard_corpora(corpus, racing["num_shards"])
+    scores = np.full((len(perms), len(shards)), np.nan)
+    alive = np.arange(len(perms))
+    for shard_idx, shard in enumerate(shards):
+        if len(alive) <= 1:
+            break
+        scores[alive, shard_idx] = evaluate_batch(perms[alive], keyboard, shard, cfg, dir_weights, no_forced)[
+            :, total_idx
+        ]
+        num_scored = shard_idx + 1
+        if num_scored < racing["min_shards"]:
+            continue
+        alive_scores = scores[alive, :num_scored]
+        leader = np.argmin(alive_scores.mean(axis=1))
+        # Differences are paired by shard, so that variation between shards, which all layouts share, cancels out
+        diffs = alive_scores - alive_scores[leader]
+        std_errors = diffs.std(axis=1, ddof=1) / np.sqrt(num_scored)
+        # Dropped once their mean difference to the leader is z_score standard errors above zero
+        alive = alive[diffs.mean(axis=1) - racing["z_score"] * std_errors <= 0]
+    logger.info(f"Racing kept {len(alive)} of {len(perms)} layouts")
+    num_scored = np.sum(~np.isnan(scores), axis=1)
+    return alive, np.where(num_scored > 0, np.nansum(scores, axis=1) / np.maximum(num_scored, 1), np.nan)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import math
+from typing import Tuple
+
+
+class GeometricSchedule:
+    """Temperature of every chain goes geometrically from init to final temperature over the budget"""
+
+    def __init__(self, annealing: dict):
+        self.init_temperature = annealing["init_temperature"]
+        self.final_temperature = annealing["final_temperature"]
+
+    def step(
+        self, temperature: float, stalls: int, improved: bool, uphill: int, accepted: int, progress: float
+    ) -> Tuple[float, int]:
+        return self.init_temperature * (self.final_temperature / self.init_temperature) ** progress, 0
+
+    def is_frozen(self, uphill: int, accepted: int) -> bool:
+        return False
+
+
+class AdaptiveSchedule:
+    """Temperature of each chain follows a decaying target acceptance rate of swaps, which increase energy"""
+
+    def __init__(self, annealing: dict):
+        params = annealing["adaptive_schedule"]
+        self.init_acceptance = params["init_acceptance"]
+        self.final_acceptance = params["final_acceptance"]
+        self.max_step = params["max_step"]
+        self.reheat_after = params["reheat_after"]
+        self.reheat_factor = params["reheat_factor"]
+        self.stop_acceptance = params["stop_acceptance"]
+
+    def target(self, progress: float) -> float:
+        return self.init_acceptance * (self.final_acceptance / self.init_acceptance) ** progress
+
+    def step(
+        self, temperature: float, stalls: int, improved: bool, uphill: int, accepted: int, progress: float
+    ) -> Tuple[float, int]:
+        """Temperature of a chain for the next cycle and number of cycles it hasn't improved for"""
+        if uphill > 0:
+            # Smoothed, so that the log stays finite when none or all swaps were accepted
+            rate = (accepted + 0.5) / (uphill + 1)
+            # Acceptance is roughly exp(-increase / T), so this factor would hit the target next cycle
+            factor = math.log(rate) / math.log(self.target(progress))
+            temperature *= min(max(factor, 1 / self.max_step), self.max_step)
+        stalls = 0 if improved else stalls + 1
+        if self.reheat_after > 0 and stalls >= self.reheat_after and not self.is_frozen(uphill, accepted):
+            return temperature * self.reheat_factor, 0
+        return temperature, stalls
+
+    def is_frozen(self, uphill: int, accepted: int) -> bool:
+        """Whether a chain with given numbers of swaps in its last cycle, which increase energy, should stop"""
+        return uphill > 0 and accepted / uphill < self.stop_acceptance
+
+
+def make_schedule(annealing: dict) -> GeometricSchedule | AdaptiveSchedule:
+    if annealing["adaptive_schedule"]["enabled"]:
+        return AdaptiveSchedule(annealing)
+    return GeometricSchedule(annealing)
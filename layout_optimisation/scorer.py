@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import copy
+from typing import Dict, List
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET, CHAR_IDS
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import EMPTY_KEY, CompactLayout, Keyboard
+from layout_optimisation.penalty import (
+    TEXT_PENALTIES,
+    count_ngram_hits,
+    count_unigram_hits,
+    get_char_positions,
+    get_extra_key_mults,
+    get_groups,
+    get_merged_dir_weights,
+)
+from layout_optimisation.tables import PositionTables
+
+
+class SwapScorer:
+    """Scores swaps same as evaluate, by only rescoring n-grams with either swapped char"""
+
+    def __init__(
+        self,
+        flat_keys: List[str],
+        keyboard: Keyboard,
+        corpus: Corpus,
+        cfg: dict,
+        dir_weights: Dict[str, float] = None,
+        constrained=False,
+    ):
+        """If constrained, all scored layouts keep frozen keys and blocked indexes, so these are not checked"""
+        self._cfg = cfg
+        self._constrained = constrained
+        self._num_keys = len(keyboard)
+        self._tables = PositionTables.for_keyboard(keyboard, cfg, len(flat_keys) // self._num_keys)
+        self._ngrams = corpus.merged
+
+        self._flat_keys = list(flat_keys)
+        self._layout = CompactLayout.from_flat(self._flat_keys, self._num_keys, keyboard)
+        char_positions = get_char_positions(self._layout)
+        self._init_terms(corpus, dir_weights)
+        self._init_unigrams()
+        self._init_groups(char_positions)
+        hits = count_unigram_hits(self._ngrams, char_positions, self._tables, cfg)
+        hits.update(count_ngram_hits(self._ngrams, char_positions, self._tables))
+        self._hits = np.stack([hits[term] for term in self._terms]).astype(np.float64)
+        self._penalties = self._calc_penalties(self._layout, self._hits, self._group_counts)
+        self._proposal = None
+
+    @property
+    def flat_keys(self) -> List[str]:
+        return copy.copy(self._flat_keys)
+
+    @property
+    def penalties(self) -> Dict[str, float]:
+        return self._penalties
+
+    def _init_terms(self, corpus: Corpus, dir_weights: Dict[str, float] = None):
+        """Hits have a row per term and a column per directory, unigram terms first"""
+        tables = self._tables
+        self._unigram_terms = ["location", "layers"] + [f"finger_{name}" for name in tables.finger_names]
+        self._terms = list(self._unigram_terms)
+        self._table_rows = []
+        for table in tables.ngram_tables:
+            self._table_rows.append(slice(len(self._terms), len(self._terms) + len(table.terms)))
+            self._terms.extend(table.terms)
+
+        # Same as evaluate, empty directories don't contribute, but still count towards total weight
+        merged_weights, total_weight = get_merged_dir_weights(corpus, dir_weights)
+        self._dir_scale = merged_weights / self._ngrams.text_len / total_weight
+        penalties = self._cfg["penalties"]
+        self._linear_terms = [term for term in TEXT_PENALTIES if term != "finger_disbalance"]
+        self._linear_rows = [self._terms.index(term) for term in self._linear_terms]
+        # Layer costs are already weighted by penalties of layers
+        self._linear_costs = np.array([1 if term == "layers" else penalties[term] for term in self._linear_terms])
+        self._finger_rows = [self._terms.index(f"finger_{name}") for name in tables.finger_names]
+
+    def _init_unigrams(self):
+        """Costs of positions and weights of chars with a column per unigram term"""
+        tables = self._tables
+        self._position_costs = np.stack([tables.locations, tables.layer_costs, *tables.finger_usage], axis=1)
+        char_counts = self._ngrams.dense_counts(1, (0,))[: len(ALPHABET)]
+        # Same as count_unigram_hits, extra keys are counted once per char of the text
+        extra_mults = get_extra_key_mults(self._cfg)
+        location_weights = char_counts * ~tables.ignore_location[:, None] + np.outer(extra_mults, self._ngrams.text_len)
+        num_counted = len(self._unigram_terms) - 1
+        self._char_weights = np.stack([location_weights] + [char_counts] * num_counted, axis=1)
+
+    def _init_groups(self, char_positions: np.ndarray):
+        """Number of chars of each group on each layer, a group is split if it is on more than one layer"""
+        groups = get_groups(self._cfg)
+        self._group_members = np.zeros((len(ALPHABET), len(groups)), dtype=np.int64)
+        for group_idx, group in enumerate(groups.values()):
+            self._group_members[[CHAR_IDS[char] for char in group], group_idx] = 1
+        num_layers = len(self._flat_keys) // self._num_keys
+        self._group_counts = np.zeros((num_layers, len(groups)), dtype=np.int64)
+        np.add.at(self._group_counts, char_positions // self._num_keys, self._group_members)
+        self._frozen_ids = [CHAR_IDS[char] for char in self._cfg["frozen_keys"]]
+        self._frozen_positions = list(self._cfg["frozen_keys"].values())
+
+    def _calc_penalties(self, layout: CompactLayout, hits: np.ndarray, group_counts: np.ndarray) -> Dict[str, float]:
+        penalties = self._cfg["penalties"]
+        scaled_hits = hits @ self._dir_scale
+        result = dict(zip(self._linear_terms, self._linear_costs * scaled_hits[self._linear_rows]))
+        finger_values = hits[self._finger_rows] / self._tables.finger_ratios[:, None]
+        disbalance = (np.max(finger_values, axis=0) - np.min(finger_values, axis=0)) @ self._dir_scale
+        result["finger_disbalance"] = penalties["finger_disbalance"] * disbalance
+
+        num_split = np.sum(np.count_nonzero(group_counts, axis=0) > 1)
+        layout_penalties = {"split_group": num_split * penalties["split_group"], "frozen_keys": 0, "blocked_indexes": 0}
+        if not self._constrained:
+            num_moved = np.sum(layout.positions[self._frozen_ids] != self._frozen_positions)
+            num_blocked = np.sum(layout.keys[self._cfg["blocked_indexes"]] != EMPTY_KEY)
+            layout_penalties["frozen_keys"] = num_moved * penalties["frozen_keys"]
+            layout_penalties["blocked_indexes"] = num_blocked * penalties["blocked_indexes"]
+
+        text_penalties = {key: result[key] for key in TEXT_PENALTIES}
+        total = sum(text_penalties.values()) + sum(layout_penalties.values())
+        return {"total": total, **text_penalties, **layout_penalties}
+
+    def _affected_rows(self, n: int, char_ids: List[int]) -> np.ndarray:
+        """Indexes of n-grams which contain any of the chars, each n-gram is included once"""
+        char_rows = self._ngrams.char_rows[n - 1]
+        rows = char_rows[char_ids[0]]
+        if len(char_ids) > 1:
+            second_rows = char_rows[char_ids[1]]
+            second_rows = second_rows[~np.any(self._ngrams.grams(n)[second_rows] == char_ids[0], axis=1)]
+            rows = np.concatenate([rows, second_rows])
+        return rows
+
+    def propose_swap(self, first_idx: int, second_idx: int) -> Dict[str, float]:
+        """Penalties of the layout with two positions swapped, call commit to actually apply the swap"""
+        layout = self._layout.swapped(first_idx, second_idx)
+        prev_positions, char_positions = self._layout.positions, layout.positions
+        swapped_chars = [char_id for char_id in np.unique(layout.keys[[first_idx, second_idx]]) if char_id >= 0]
+
+        hits, group_counts = self._hits, self._group_counts
+        if swapped_chars:
+            hits = hits.copy()
+            cost_changes = self._position_costs[char_positions[swapped_chars]]
+            cost_changes = cost_changes - self._position_costs[prev_positions[swapped_chars]]
+            hits[: len(self._unigram_terms)] += np.einsum("ct,ctd->td", cost_changes, self._char_weights[swapped_chars])
+
+        first_layer, second_layer = first_idx // self._num_keys, second_idx // self._num_keys
+        if swapped_chars and first_layer != second_layer:
+            # Char of the first position moves to the second layer, char of the second position the other way
+            moved = self._layout.keys[[first_idx, second_idx]]
+            members = self._group_members[moved] * (moved >= 0)[:, None]
+            group_counts = group_counts.copy()
+            group_counts[first_layer] -= members[0] - members[1]
+            group_counts[second_layer] += members[0] - members[1]
+
+        affected = {}
+        for table, rows in zip(self._tables.ngram_tables, self._table_rows) if swapped_chars else []:
+            # Swapping positions with the same code doesn't change any n-gram of coded tables
+            if table.codes is not None and table.codes[first_idx] == table.codes[second_idx]:
+                continue
+            if table.n not in affected:
+                ngram_rows = self._affected_rows(table.n, swapped_chars)
+                grams = np.take(self._ngrams.grams(table.n), ngram_rows, axis=0)
+                affected[table.n] = (grams, np.take(self._ngrams.counts(table.n), ngram_rows, axis=0))
+            grams, counts = affected[table.n]
+            hits[rows] += (table.lookup(char_positions, grams) - table.lookup(prev_positions, grams)).T @ counts
+
+        penalties = self._calc_penalties(layout, hits, group_counts)
+        self._proposal = ((first_idx, second_idx), layout, hits, group_counts, penalties)
+        return penalties
+
+    def commit(self):
+        if self._proposal is None:
+            raise ValueError("No swap was proposed")
+        (first_idx, second_idx), self._layout, self._hits, self._group_counts, self._penalties = self._proposal
+        flat_keys = self._flat_keys
+        flat_keys[first_idx], flat_keys[second_idx] = flat_keys[second_idx], flat_keys[first_idx]
+        self._proposal = None
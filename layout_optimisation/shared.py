@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Offsets of arrays in the block are aligned, so that views of them are aligned as well
+ALIGNMENT = 64
+
+
+class SharedArrays:
+    """Arrays in one block of shared memory, pickling only sends the name of the block and offsets of arrays"""
+
+    def __init__(
+        self, shm: SharedMemory, specs: List[Tuple[str, str, Tuple[int, ...], int]], owner: bool, writeable=False
+    ):
+        self._shm = shm
+        self._specs = specs
+        self._owner = owner
+        self._writeable = writeable
+        self.arrays = {}
+        for key, dtype, shape, offset in specs:
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = writeable
+            self.arrays[key] = array
+
+    @property
+    def size(self) -> int:
+        return self._shm.size
+
+    def close(self):
+        """Detach from the block, the owner also frees it, so it should only be called once others are done"""
+        self.arrays = {}
+        if self._owner:
+            self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views of the arrays are still alive, memory is then released once they are garbage collected
+            pass
+
+    def __reduce__(self):
+        return SharedArrays.attach, (self._shm.name, self._specs, self._writeable)
+
+    @staticmethod
+    def attach(name: str, specs: List[Tuple[str, str, Tuple[int, ...], int]], writeable=False) -> SharedArrays:
+        return SharedArrays(SharedMemory(name=name), specs, owner=False, writeable=writeable)
+
+    @staticmethod
+    def publish(arrays: Dict[str, np.ndarray], writeable=False) -> SharedArrays:
+        specs = []
+        size = 0
+        for key, array in arrays.items():
+            offset = -(-size // ALIGNMENT) * ALIGNMENT
+            specs.append((key, array.dtype.str, array.shape, offset))
+            size = offset + array.nbytes
+        shm = SharedMemory(create=True, size=max(size, 1))
+        for (key, dtype, shape, offset), array in zip(specs, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = array
+        return SharedArrays(shm, specs, owner=True, writeable=writeable)
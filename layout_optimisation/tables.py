@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import json
+import operator
+from functools import reduce
+from typing import List, Tuple
+
+import numpy as np
+
+from layout_optimisation.chars import ALPHABET
+from layout_optimisation.layouts.base import Finger, Hand, Keyboard, Row
+
+CONSECUTIVE_FINGERS = [
+    (Finger.I, Finger.M),
+    (Finger.M, Finger.R),
+    (Finger.R, Finger.P),
+    (Finger.P, Finger.R),
+    (Finger.R, Finger.M),
+    (Finger.M, Finger.I),
+]
+INBOUND_FINGERS = [(Finger.P, Finger.R, Finger.M), (Finger.R, Finger.M, Finger.I)]
+OUTBOUND_FINGERS = [(Finger.I, Finger.M, Finger.R), (Finger.M, Finger.R, Finger.P)]
+REVERSAL_FINGERS = [
+    (Finger.R, Finger.P, Finger.M),
+    (Finger.M, Finger.R, Finger.I),
+    (Finger.M, Finger.I, Finger.R),
+    (Finger.R, Finger.M, Finger.P),
+]
+
+# Terms, which are counted over consecutive pairs, pairs with one char in between, triples and fourgrams
+BIGRAM_TERMS = ["same_finger", "long_jump_finger", "long_jump_consecutive", "long_jump_hand"]
+SKIPGRAM_TERMS = ["long_jump_sandwich"]
+TRIGRAM_TERMS = ["roll_in", "roll_out", "roll_reversal", "twist"]
+FOURGRAM_TERMS = ["same_hand", "alternating_hand"]
+
+
+def is_long_jump(start_rows: np.array, end_rows: np.array) -> np.array:
+    top_start = start_rows == Row.TOP.value
+    bot_start = start_rows == Row.BOT.value
+    top_end = end_rows == Row.TOP.value
+    bot_end = end_rows == Row.BOT.value
+    long_jump = top_start & bot_end | bot_start & top_end
+    return long_jump
+
+
+def match_fingers(fingers: List[np.ndarray], patterns: List[Tuple[Finger, ...]]) -> np.ndarray:
+    matched = False
+    for pattern in patterns:
+        matched = matched | reduce(operator.and_, [fingers[idx] == finger.value for idx, finger in enumerate(pattern)])
+    return matched
+
+
+def spread(values: np.ndarray, n: int) -> List[np.ndarray]:
+    """Views of values along each of n axes, so that operations on them broadcast to all n-tuples"""
+    shape = [1] * n
+    views = []
+    for axis in range(n):
+        axis_shape = list(shape)
+        axis_shape[axis] = len(values)
+        views.append(values.reshape(axis_shape))
+    return views
+
+
+class NGramTable:
+    """Indicators of terms, indexed by flat index of positions, or their codes, of chars in selected columns"""
+
+    def __init__(
+        self, n: int, columns: Tuple[int, ...], terms: List[str], values: np.ndarray, codes: np.ndarray = None
+    ):
+        self.n = n
+        self.columns = columns
+        self.terms = terms
+        self.values = values
+        self.codes = codes
+        self.base = round(len(values) ** (1 / len(columns)))
+        self.index_dtype = np.min_scalar_type(len(values) - 1)
+        # Tuples of positions (or codes) where any term is set, these are usually few
+        support = np.flatnonzero(values.any(axis=1))
+        self.support_positions = np.stack(np.unravel_index(support, (self.base,) * len(columns)), axis=1)
+        self.support_values = values[support]
+
+    def flat_index(self, char_positions: np.ndarray, grams: np.ndarray, axis: int = -1) -> np.ndarray:
+        """Index into values for each n-gram, char positions can have leading axes for several layouts"""
+        char_values = char_positions if self.codes is None else self.codes[char_positions]
+        # Gathering each column separately keeps arrays contiguous, indexes use the smallest type which fits them
+        char_values = char_values.astype(self.index_dtype)
+        index = np.take(char_values, grams[:, self.columns[0]], axis=axis)
+        for column in self.columns[1:]:
+            index = index * self.base + np.take(char_values, grams[:, column], axis=axis)
+        return index
+
+    def lookup(self, char_positions: np.ndarray, grams: np.ndarray) -> np.ndarray:
+        return np.take(self.values, self.flat_index(char_positions, grams), axis=0)
+
+    def count_hits(self, char_positions: np.ndarray, grams: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        return np.moveaxis(self.lookup(char_positions, grams), -1, 0) @ counts
+
+    def count_batch_hits(self, char_positions: np.ndarray, grams: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        """Same as count_hits for several layouts, hits have shape (terms, layouts, directories)"""
+        # Layouts are on the last axis, so that gathers copy contiguous rows, sums are then float matmuls
+        index = self.flat_index(np.ascontiguousarray(char_positions.T), grams, axis=0)
+        counts = counts.T.astype(np.float64)
+        hits = [counts @ np.take(term_values, index) for term_values in self.values.T.astype(np.float64)]
+        return np.stack(hits).transpose(0, 2, 1)
+
+    def count_layout_hits(self, perms: np.ndarray, dense_counts: np.ndarray) -> np.ndarray:
+        """Same as count_batch_hits for rows of keys, only looks up tuples of positions in support"""
+        # Only for tables without codes, dense counts have an extra id for keys without a char
+        num_ids = len(ALPHABET) + 1
+        keys = np.where(perms >= 0, perms, len(ALPHABET)).astype(np.int32)
+        index = np.take(keys, self.support_positions[:, 0], axis=-1)
+        for column in range(1, len(self.columns)):
+            index = index * num_ids + np.take(keys, self.support_positions[:, column], axis=-1)
+        return np.moveaxis(self.support_values.T @ np.take(dense_counts, index, axis=0), -2, 0)
+
+
+class PositionTables:
+    """Penalty indicators for every flat position, pair and triple of positions of a keyboard"""
+
+    def __init__(self, keyboard: Keyboard, cfg: dict, num_layers: int):
+        num_keys = len(keyboard)
+        self.num_positions = num_keys * num_layers
+        hands = np.tile(keyboard.hand_array, num_layers)
+        fingers = np.tile(keyboard.finger_array, num_layers)
+        rows = np.tile(keyboard.row_array, num_layers)
+        layers = np.repeat(np.arange(num_layers), num_keys)
+        positions = np.arange(self.num_positions)
+
+        layer_costs = cfg["penalties"]["layers"]
+        self.locations = np.tile(keyboard.penalty_array, num_layers)
+        self.layer_costs = np.array([layer_costs[layer] if layer < len(layer_costs) else 0 for layer in layers])
+        self.layers = layers
+        self.finger_names = list(cfg["finger_ratios"])
+        self.finger_ratios = np.array([cfg["finger_ratios"][finger] for finger in self.finger_names])
+        self.finger_usage = np.stack([fingers == Finger[finger].value for finger in self.finger_names])
+        # Indexed by char id rather than position
+        self.ignore_location = np.isin(np.array(ALPHABET), cfg["ignore_loc_penality_for_chars"])
+
+        # Bigrams
+        hand_pair, finger_pair, row_pair, position_pair = [
+            spread(values, 2) for values in [hands, fingers, rows, positions]
+        ]
+        # Same finger is `hands & hands` of both keys as in the original text scan, only Hand.L has the lowest bit set
+        same_finger = (finger_pair[0] == finger_pair[1]) & (hand_pair[0] & hand_pair[1] & 1).astype(bool)
+        same_hand = hand_pair[0] == hand_pair[1]
+        long_jump = is_long_jump(*row_pair)
+        consecutive_fingers = match_fingers(finger_pair, CONSECUTIVE_FINGERS) & same_hand
+        self.bigrams = NGramTable(
+            2,
+            (0, 1),
+            BIGRAM_TERMS,
+            self.flatten_terms(
+                [
+                    same_finger & (position_pair[0] != position_pair[1]),
+                    same_finger & long_jump,
+                    consecutive_fingers & long_jump,
+                    same_hand & long_jump,
+                ]
+            ),
+        )
+        skipgrams = self.flatten_terms([(finger_pair[0] == finger_pair[1]) & same_hand & long_jump])
+        self.skipgrams = NGramTable(3, (0, 2), SKIPGRAM_TERMS, skipgrams)
+
+        # Trigrams
+        hand_triple, finger_triple, row_triple = [spread(values, 3) for values in [hands, fingers, rows]]
+        same_hand_3 = (hand_triple[0] == hand_triple[1]) & (hand_triple[1] == hand_triple[2])
+        same_row_3 = (row_triple[0] == row_triple[1]) & (row_triple[1] == row_triple[2])
+        inbound = match_fingers(finger_triple, INBOUND_FINGERS) & same_hand_3
+        outbound = match_fingers(finger_triple, OUTBOUND_FINGERS) & same_hand_3
+        roll_reversal = match_fingers(finger_triple, REVERSAL_FINGERS) & same_hand_3 & same_row_3
+        top, hom, bot = Row.TOP.value, Row.HOM.value, Row.BOT.value
+        descending = (row_triple[0] == top) & (row_triple[1] == hom) & (row_triple[2] == bot)
+        ascending = (row_triple[0] == bot) & (row_triple[1] == hom) & (row_triple[2] == top)
+        twist = (inbound | outbound) & (ascending | descending)
+        trigrams = self.flatten_terms([inbound & same_row_3, outbound & same_row_3, roll_reversal, twist])
+        self.trigrams = NGramTable(3, (0, 1, 2), TRIGRAM_TERMS, trigrams)
+
+        # Fourgrams only depend on hands, so they are indexed by hand codes instead of positions
+        self.hand_codes = (hands != Hand.L.value).astype(np.int64)
+        hand_fourgram = spread(np.arange(2), 4)
+        same_hand_4 = reduce(operator.and_, [hand_fourgram[idx] == hand_fourgram[idx + 1] for idx in range(3)])
+        diff_hand_4 = reduce(operator.and_, [hand_fourgram[idx] != hand_fourgram[idx + 1] for idx in range(3)])
+        fourgrams = self.flatten_terms([same_hand_4, diff_hand_4])
+        self.fourgrams = NGramTable(4, (0, 1, 2, 3), FOURGRAM_TERMS, fourgrams, codes=self.hand_codes)
+        self.ngram_tables = [self.bigrams, self.skipgrams, self.trigrams, self.fourgrams]
+
+    @staticmethod
+    def flatten_terms(terms: List[np.ndarray]) -> np.ndarray:
+        """Indicators of all terms for each flat index are next to each other, so they are gathered at once"""
+        return np.stack(terms, axis=-1).reshape(-1, len(terms)).astype(np.int8)
+
+    @staticmethod
+    def for_keyboard(keyboard: Keyboard, cfg: dict, num_layers: int) -> PositionTables:
+        """Tables are cached on the keyboard, since they only need to be computed once per keyboard/config"""
+        used_cfg = [cfg["penalties"]["layers"], cfg["finger_ratios"], cfg["ignore_loc_penality_for_chars"]]
+        key = (num_layers, json.dumps(used_cfg, sort_keys=True))
+        if key not in keyboard.tables:
+            keyboard.tables[key] = PositionTables(keyboard, cfg, num_layers)
+        return keyboard.tables[key]
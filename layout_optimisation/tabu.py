@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import logging
+import math
+import random
+from functools import partial
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from layout_optimisation.annealing import generate_initial_layouts, worker_pool, worker_state
+from layout_optimisation.chars import ALPHABET
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.gains import SwapGains
+from layout_optimisation.layouts.base import CompactLayout, Keyboard, Layout
+from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
+from layout_optimisation.moves import SearchSpace
+
+logger = logging.getLogger(__name__)
+
+
+def tabu_search(
+    flat_keys: List[str],
+    num_iters: int,
+    keyboard: Keyboard,
+    corpus: Corpus,
+    cfg: dict,
+    dir_weights: Dict[str, float] = None,
+    rng: random.Random = random,
+) -> List[Tuple[List[str], float]]:
+    """Robust tabu search over swaps of free positions, returns each new best layout with its score"""
+    tabu_cfg = cfg["tabu"]
+    space = SearchSpace(len(flat_keys), cfg)
+    flat_keys = space.repair(flat_keys)
+    current_keys = list(flat_keys)
+    gains = SwapGains(CompactLayout.from_flat(flat_keys, len(keyboard)).keys, keyboard, corpus, cfg, dir_weights)
+
+    free = np.array(space.free)
+    first, second = np.triu_indices(len(free), k=1)
+    first, second = free[first], free[second]
+    # Iteration until which key id is not allowed to return to a position
+    tabu_until = np.zeros((len(flat_keys), len(ALPHABET) + 1), dtype=int)
+    min_tenure, max_tenure = (round(fraction * len(free)) for fraction in tabu_cfg["tenure"])
+
+    best_layouts = [(flat_keys, gains.score)]
+    # Iterations since the last new best layout and random swaps left to apply
+    stalls, kicks = 0, 0
+    for iteration in range(num_iters):
+        ids = gains.ids
+        swap_gains = gains.matrix[first, second]
+        # Swapping two empty keys doesn't change anything
+        valid = (ids[first] != len(ALPHABET)) | (ids[second] != len(ALPHABET))
+        if 0 < tabu_cfg["restart_after"] <= stalls:
+            # Search can cycle over swaps of rare chars with tiny gains, random swaps move it out of such a region
+            stalls, kicks = 0, tabu_cfg["restart_swaps"]
+        # Random swaps keep groups together, since joining a split group again can take several swaps
+        kick = np.flatnonzero(valid & ~gains.splits_groups[first, second]) if kicks > 0 else []
+        kicking = len(kick) > 0
+        if kicking:
+            # Random swap is applied even if it is tabu or worse
+            kicks -= 1
+            chosen = kick[rng.randrange(len(kick))]
+        else:
+            is_tabu = (tabu_until[first, ids[second]] > iteration) & (tabu_until[second, ids[first]] > iteration)
+            # Tabu swaps are still allowed, if they give a new best score
+            aspiring = gains.score + swap_gains < best_layouts[-1][1]
+            allowed = np.flatnonzero(valid & (~is_tabu | aspiring))
+            if len(allowed) == 0:
+                break
+            chosen = allowed[np.argmin(swap_gains[allowed])]
+
+        first_idx, second_idx = int(first[chosen]), int(second[chosen])
+        # Random swaps aren't tabu, so the search can undo them
+        if not kicking:
+            tabu_until[first_idx, ids[first_idx]] = iteration + rng.randint(min_tenure, max_tenure)
+            tabu_until[second_idx, ids[second_idx]] = iteration + rng.randint(min_tenure, max_tenure)
+        current_keys[first_idx], current_keys[second_idx] = current_keys[second_idx], current_keys[first_idx]
+        gains.apply(first_idx, second_idx)
+        if gains.score < best_layouts[-1][1]:
+            best_layouts.append((list(current_keys), gains.score))
+            stalls = 0
+        else:
+            stalls += 1
+    return best_layouts
+
+
+def tabu_in_worker(start: Tuple[List[str], int], num_iters: int) -> Tuple[List[str], float]:
+    """Tabu search from flat keys with its own seed and state of the worker, returns best layout"""
+    flat_keys, seed = start
+    state = worker_state()
+    best_layouts = tabu_search(
+        flat_keys,
+        num_iters,
+        state["keyboard"],
+        state["corpus"],
+        state["cfg"],
+        state["dir_weights"],
+        random.Random(seed),
+    )
+    return best_layouts[-1]
+
+
+def run_tabu_search(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None, seed: int = None) -> Layout:
+    """Independent tabu searches from the best initial layouts, in the same pool of workers as annealing"""
+    tabu_cfg = cfg["tabu"]
+    rng = random.Random(seed)
+    layouts = generate_initial_layouts(cfg, corpus, dir_weights, rng)
+    # Each start has a seed of its own, so results don't depend on which worker runs it
+    starts = [(layouts[idx % len(layouts)], rng.getrandbits(32)) for idx in range(tabu_cfg["num_starts"])]
+    template = generate_key_map_template(cfg)
+    keyboard = generate_keyboard(template, cfg)
+    best_state = (layouts[0], math.inf)
+
+    try:
+        with worker_pool(keyboard, corpus, cfg, dir_weights) as p:
+            func = partial(tabu_in_worker, num_iters=tabu_cfg["num_iters"])
+            results = tqdm(p.imap(func, starts), desc="Tabu search", total=len(starts))
+            for best in results:
+                best_state = min(best_state, best, key=itemgetter(1))
+                results.set_description(f"Tabu search, best score={best_state[1]:.3f}")
+    except KeyboardInterrupt:
+        logger.warning("Stopping optimisation due to KeyboardInterrupt")
+
+    return Layout.from_flat(best_state[0], template, keyboard)
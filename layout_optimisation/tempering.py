@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import logging
+import math
+import random
+from collections import Counter
+from functools import partial
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from tqdm import tqdm, trange
+
+from layout_optimisation.annealing import (
+    anneal,
+    cache_hit_rate,
+    generate_initial_layouts,
+    log_cache_stats,
+    worker_pool,
+    worker_state,
+)
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import Layout
+from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
+
+logger = logging.getLogger(__name__)
+
+
+def temperature_ladder(init_temperature: float, final_temperature: float, num_replicas: int) -> np.ndarray:
+    """Temperatures from hottest to coldest, ratio of neighbouring temperatures is constant"""
+    if num_replicas == 1:
+        return np.array([final_temperature])
+    return init_temperature * (final_temperature / init_temperature) ** (np.arange(num_replicas) / (num_replicas - 1))
+
+
+def temper_in_worker(
+    replica: Tuple[List[str], float], num_iters: int
+) -> Tuple[Tuple[List[str], float], Tuple[List[str], float], Dict[str, int]]:
+    """Continue a replica at its temperature, returns its last state, best visited layout and cache stats"""
+    flat_keys, temperature = replica
+    state = worker_state()
+    score_cache = state["score_cache"]
+    prev_stats = score_cache.stats
+    best_layouts, last_state = anneal(
+        flat_keys,
+        temperature,
+        num_iters,
+        state["keyboard"],
+        state["corpus"],
+        state["cfg"],
+        state["dir_weights"],
+        score_cache,
+        keep_top=1,
+    )
+    cache_stats = {key: value - prev_stats[key] for key, value in score_cache.stats.items()}
+    return last_state, best_layouts[0], cache_stats
+
+
+def exchange_replicas(
+    states: List[Tuple[List[str], float]],
+    temperatures: np.ndarray,
+    offset: int,
+    attempts: np.ndarray,
+    accepts: np.ndarray,
+    rng: random.Random = random,
+):
+    """Metropolis exchanges of states of neighbouring replicas, pairs start at offset, so they alternate"""
+    for idx in range(offset, len(states) - 1, 2):
+        attempts[idx] += 1
+        log_ratio = (states[idx][1] - states[idx + 1][1]) * (1 / temperatures[idx] - 1 / temperatures[idx + 1])
+        if log_ratio >= 0 or math.exp(log_ratio) > rng.uniform(0, 1):
+            accepts[idx] += 1
+            states[idx], states[idx + 1] = states[idx + 1], states[idx]
+
+
+def run_tempering(cfg: dict, corpus: Corpus, dir_weights: Dict[str, float] = None) -> Layout:
+    """Parallel tempering, replicas anneal at temperatures of a geometric ladder and exchange states each cycle"""
+    annealing = cfg["annealing"]
+    num_cycles = annealing["num_iters"] // annealing["iters_per_cycle"]
+    temperatures = temperature_ladder(
+        annealing["init_temperature"], annealing["final_temperature"], annealing["num_replicas"]
+    )
+    layouts = generate_initial_layouts(cfg, corpus, dir_weights)
+    # Best initial layouts start at the cold end of the ladder
+    states = [(layouts[idx % len(layouts)], math.inf) for idx in reversed(range(len(temperatures)))]
+    best_state = (layouts[0], math.inf)
+
+    template = generate_key_map_template(cfg)
+    keyboard = generate_keyboard(template, cfg)
+    attempts = np.zeros(len(temperatures) - 1, dtype=int)
+    accepts = np.zeros(len(temperatures) - 1, dtype=int)
+    cache_stats = Counter()
+
+    outer_loop_iterator = trange(num_cycles, desc="Tempering")
+    try:
+        with worker_pool(keyboard, corpus, cfg, dir_weights) as p:
+            for cycle in outer_loop_iterator:
+                func = partial(temper_in_worker, num_iters=annealing["iters_per_cycle"])
+                tasks = [(flat_keys, temperature) for (flat_keys, _), temperature in zip(states, temperatures)]
+                tqdm_kwargs = dict(desc="Evaluating replicas in a pool", leave=False, total=len(tasks))
+                new_states = []
+                for state, best, proc_stats in tqdm(p.imap(func, tasks), **tqdm_kwargs):
+                    new_states.append(state)
+                    best_state = min(best_state, best, key=itemgetter(1))
+                    cache_stats.update(proc_stats)
+                states = new_states
+                exchange_replicas(states, temperatures, cycle % 2, attempts, accepts)
+                exchange_rate = accepts.sum() / max(attempts.sum(), 1)
+                outer_loop_iterator.set_description(
+                    f"Tempering, best score={best_state[1]:.3f}, exchanges={exchange_rate:.0%}, "
+                    f"cache hits={cache_hit_rate(cache_stats):.0%}"
+                )
+    except KeyboardInterrupt:
+        logger.warning("Stopping optimisation due to KeyboardInterrupt")
+    log_cache_stats(cache_stats)
+    log_exchange_stats(temperatures, attempts, accepts)
+
+    return Layout.from_flat(best_state[0], template, keyboard)
+
+
+def log_exchange_stats(temperatures: np.ndarray, attempts: np.ndarray, accepts: np.ndarray):
+    """Acceptance rate of exchanges between each pair of neighbouring temperatures, these should be roughly even"""
+    for idx, (num_attempts, num_accepts) in enumerate(zip(attempts, accepts)):
+        rate = num_accepts / max(num_attempts, 1)
+        logger.info(
+            f"Exchanges {temperatures[idx]:.4f} <-> {temperatures[idx + 1]:.4f}: "
+            f"{num_accepts}/{num_attempts} accepted ({rate:.0%})"
+        )
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 import argparse
+import os
+import stat
+import tempfile
 from pathlib import Path
+from typing import Union
 
 from layout_optimisation.config import cfg
 
@@ -11,12 +15,44 @@ def process_text(text: str) -> str:
     return text.lower().replace("    ", "\t")
 
 
+def get_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_atomic(path: Path, content: Union[str, bytes]):
+    """Write to a temporary file next to the path and rename it, so that the path never has partial content"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f".{path.name}.", delete=False) as f:
+        try:
+            f.write(content)
+        except BaseException:
+            # Also on KeyboardInterrupt, so that no temporary files are left next to the path
+            f.close()
+            os.unlink(f.name)
+            raise
+    try:
+        # Temporary files are only accessible by their owner, so the path keeps its mode or gets the default one
+        os.chmod(f.name, stat.S_IMODE(path.stat().st_mode) if path.exists() else 0o666 & ~get_umask())
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
 def complete_and_parse_args(parser: argparse.ArgumentParser) -> argparse.Namespace:
     parser.add_argument("--text-dir", type=Path, default=Path(__file__).parents[1] / "texts")
+    parser.add_argument("--cache-dir", type=Path, default=Path(__file__).parents[1] / ".corpus_cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always count n-grams from scratch")
     parser.add_argument("--dir-weights", nargs="+")
     parser.add_argument("--no-forced", action="store_true", help="Don't count forced penalties")
     args = parser.parse_args()
 
+    if args.no_cache:
+        args.cache_dir = None
+
     if args.dir_weights:
         if len(args.dir_weights) % 2 == 1:
             raise ValueError("Invalid dir weights")
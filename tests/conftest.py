@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+
+from layout_optimisation.config import cfg
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import Keyboard
+from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
+
+TEXT_DIR = Path(__file__).parents[1] / "texts"
+
+
+@pytest.fixture(scope="session")
+def corpus() -> Corpus:
+    return Corpus.from_dir(TEXT_DIR, cfg)
+
+
+@pytest.fixture(scope="session")
+def keyboard() -> Keyboard:
+    return generate_keyboard(generate_key_map_template(cfg), cfg)
@@ -0,0 +1,83 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from layout_optimisation.annealing import (
+    POLISH_MIN_GAIN,
+    anneal,
+    evaluate_layouts,
+    fidelity_at,
+    generate_initial_layouts,
+    polish,
+    rescore_in_pool,
+    worker_pool,
+)
+from layout_optimisation.config import cfg
+from layout_optimisation.layouts.base import CompactLayout
+from layout_optimisation.moves import SearchSpace
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+
+
+def test_polish_ends_in_local_optimum(corpus, keyboard):
+    """No swap of free positions improves the polished layout, and its score is exact"""
+    dir_weights = dict(cfg["dir_weights"])
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[-1]
+    polished, energy = polish(list(flat_keys), keyboard, corpus, cfg, dir_weights)
+    repaired = SearchSpace(len(flat_keys), cfg).repair(flat_keys)
+    initial_energy = evaluate_layouts([repaired], keyboard, corpus, cfg, dir_weights)[0]
+    assert energy < initial_energy
+    assert energy == evaluate_layouts([polished], keyboard, corpus, cfg, dir_weights)[0]
+
+    keys = CompactLayout.from_flat(polished, len(keyboard)).keys
+    free = np.array(SearchSpace(len(polished), cfg).free)
+    first, second = np.triu_indices(len(free), k=1)
+    first, second = free[first], free[second]
+    perms = np.repeat(keys[np.newaxis], len(first), axis=0)
+    rows = np.arange(len(perms))
+    perms[rows, first], perms[rows, second] = keys[second], keys[first]
+    totals = evaluate_batch(perms, keyboard, corpus, cfg, dir_weights)[:, get_penalty_terms().index("total")]
+    assert np.min(totals) > energy - POLISH_MIN_GAIN
+
+
+def test_anneal_keeps_top_visited_layouts(corpus, keyboard):
+    """Heap of anneal keeps the same layouts as sorting every distinct visited layout"""
+    dir_weights = dict(cfg["dir_weights"])
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[0]
+    temperature = cfg["annealing"]["init_temperature"]
+    num_iters = 200
+    # Keeping more layouts than there are iterations keeps every visited layout
+    args = (flat_keys, temperature, num_iters, keyboard, corpus, cfg, dir_weights)
+    visited, last_state = anneal(*args, rng=random.Random(1), keep_top=num_iters + 1)
+    assert len(visited) > 10
+    assert len({tuple(keys) for keys, _ in visited}) == len(visited)
+    assert last_state[0] in [keys for keys, _ in visited]
+
+    all_scores = sorted(energy for _, energy in visited)
+    scores_by_keys = {tuple(keys): energy for keys, energy in visited}
+    for keep_top in [1, 5, 10]:
+        best_layouts, top_last_state = anneal(*args, rng=random.Random(1), keep_top=keep_top)
+        assert top_last_state == last_state
+        assert [energy for _, energy in best_layouts] == all_scores[:keep_top]
+        assert all(scores_by_keys[tuple(keys)] == energy for keys, energy in best_layouts)
+
+
+def test_rescoring_at_fidelity_switch(corpus, keyboard):
+    """Chains are rescored with counts of the new fidelity, which for full fidelity are same as evaluate"""
+    test_cfg = copy.deepcopy(cfg)
+    annealing = test_cfg["annealing"]
+    annealing["fidelity_schedule"] = [[0, 0.25], [0.5, 1]]
+    annealing["num_processes"] = 2
+    assert [fidelity_at(annealing, progress) for progress in [0, 0.49, 0.5, 1]] == [0.25, 0.25, 1, 1]
+
+    dir_weights = dict(cfg["dir_weights"])
+    layouts = generate_initial_layouts(cfg, rng=random.Random(0))[:3]
+    with worker_pool(keyboard, corpus, test_cfg, dir_weights) as p:
+        subsampled = rescore_in_pool(p, layouts, 0.25)
+        full = rescore_in_pool(p, layouts, 1.0)
+    expected = evaluate_layouts(layouts, keyboard, corpus, cfg, dir_weights)
+    assert full == pytest.approx(expected.tolist(), rel=0, abs=1e-9)
+    expected = evaluate_layouts(layouts, keyboard, corpus.subsample(0.25), cfg, dir_weights)
+    assert subsampled == pytest.approx(expected.tolist(), rel=0, abs=1e-9)
+    assert subsampled != pytest.approx(full, rel=0, abs=1e-9)
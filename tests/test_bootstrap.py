@@ -0,0 +1,40 @@
+import numpy as np
+
+from layout_optimisation.bootstrap import FileBootstrap, bootstrap_penalties, percentile_interval
+from layout_optimisation.config import cfg
+from layout_optimisation.corpus import MAX_NGRAM
+from layout_optimisation.layouts.base import CompactLayout
+from layout_optimisation.layouts.layouts import LAYOUTS
+from layout_optimisation.penalty import get_penalty_terms
+
+
+class OnesGenerator:
+    """Draws each file exactly once, so that the resample is the original corpus"""
+
+    def multinomial(self, n: int, pvals: np.ndarray) -> np.ndarray:
+        return np.ones(len(pvals), dtype=np.int64)
+
+
+def test_all_ones_weights_reproduce_counts(corpus):
+    resampled = FileBootstrap(corpus).resample(OnesGenerator())
+    assert set(resampled.ngrams) == set(corpus.ngrams)
+    spanning = 0
+    for dir_name, ngrams in corpus.ngrams.items():
+        for n in range(1, MAX_NGRAM + 1):
+            np.testing.assert_array_equal(resampled.ngrams[dir_name].grams(n), ngrams.grams(n))
+            np.testing.assert_array_equal(resampled.ngrams[dir_name].counts(n), ngrams.counts(n))
+            file_counts = sum(file.counts(n).sum() for file in corpus.file_ngrams[dir_name].values())
+            spanning += ngrams.counts(n).sum() - file_counts
+    # N-grams, which span two files, are only in the residual, so it is also reproduced
+    assert spanning > 0
+
+
+def test_interval_of_identical_layouts_is_centred_on_zero(corpus, keyboard):
+    keys = CompactLayout.from_flat(LAYOUTS["QWERTY"].flatten(), len(keyboard)).keys
+    perms = np.stack([keys, keys])
+    samples = bootstrap_penalties(perms, keyboard, corpus, cfg, dict(cfg["dir_weights"]), num_resamples=20)
+    total = samples[:, :, get_penalty_terms().index("total")]
+    # Resamples differ, so the interval of each layout has some width
+    assert np.ptp(total[:, 0]) > 0
+    lower, upper = percentile_interval(total[:, 1] - total[:, 0], 0.95)
+    assert lower == -upper == 0
@@ -0,0 +1,77 @@
+import pytest
+
+from layout_optimisation import budget
+from layout_optimisation.budget import Budget
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(budget, "time", clock)
+    return clock
+
+
+def test_budget_requires_a_limit():
+    with pytest.raises(ValueError):
+        Budget()
+
+
+def test_cycle_limit(clock):
+    run = Budget(num_cycles=4)
+    assert run.progress(1) == 0.25
+    cycles = []
+    for cycle in run.cycles():
+        clock.now += 10
+        cycles.append(cycle)
+    assert cycles == [0, 1, 2, 3]
+    assert run.elapsed == 40
+
+
+def test_time_limit_stops_before_cycle_which_would_not_finish(clock):
+    run = Budget(time_limit=35)
+    cycles = []
+    for cycle in run.cycles():
+        # Cycles take 10 seconds, except the second one
+        clock.now += 12 if cycle == 1 else 10
+        cycles.append(cycle)
+    # Fourth cycle could take as long as the longest one, so it would end at 32 + 12 seconds
+    assert cycles == [0, 1, 2]
+    assert run.elapsed == 32
+    assert run.progress(3) == pytest.approx(32 / 35)
+    assert run.progress(4) == 1.0
+
+
+def test_first_limit_to_run_out_wins(clock):
+    cycles = []
+    for cycle in Budget(num_cycles=2, time_limit=100).cycles():
+        clock.now += 10
+        cycles.append(cycle)
+    assert cycles == [0, 1]
+
+    run = Budget(num_cycles=100, time_limit=25)
+    assert run.progress(50) == 0.5
+    cycles = []
+    for cycle in run.cycles():
+        clock.now += 10
+        cycles.append(cycle)
+    assert cycles == [0, 1]
+
+
+def test_resumed_budget_counts_spent_cycles_and_time(clock):
+    run = Budget(num_cycles=5, time_limit=100, num_done=3, elapsed=90)
+    assert run.elapsed == 90
+    assert run.progress(4) == pytest.approx(0.9)
+    cycles = []
+    for cycle in run.cycles():
+        clock.now += 5
+        cycles.append(cycle)
+    # Third cycle from the start of the run would end at 90 + 3 * 5 seconds
+    assert cycles == [3, 4]
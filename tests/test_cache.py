@@ -0,0 +1,73 @@
+import multiprocessing
+
+from layout_optimisation.cache import ScoreCache, SharedScoreTable
+from layout_optimisation.layouts.layouts import LAYOUTS
+
+FINGERPRINT = bytes(range(32))
+
+
+def test_least_recently_used_score_is_evicted():
+    cache = ScoreCache(FINGERPRINT, 2)
+    cache.put(1, 1.0)
+    cache.put(2, 2.0)
+    assert cache.get(1) == 1.0
+    cache.put(3, 3.0)
+    assert len(cache) == 2
+    assert cache.get(2) is None
+    assert cache.get(1) == 1.0 and cache.get(3) == 3.0
+    assert cache.stats == {"hits": 3, "shared_hits": 0, "misses": 1}
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ScoreCache(FINGERPRINT, 0)
+    cache.put(1, 1.0)
+    assert cache.get(1) is None and len(cache) == 0
+
+
+def test_fingerprints_separate_scores():
+    flat_keys = LAYOUTS["QWERTY"].flatten()
+    shared = SharedScoreTable.create(1024)
+    try:
+        caches = [ScoreCache(fingerprint, 16, shared) for fingerprint in [FINGERPRINT, FINGERPRINT, bytes(32)]]
+        hashes = [cache.hasher(len(flat_keys)).hash_flat(flat_keys) for cache in caches]
+        assert hashes[0] == hashes[1] != hashes[2]
+        caches[0].put(hashes[0], 1.0)
+        # Same setup finds the score in the shared table, another setup hashes the layout elsewhere
+        assert caches[1].get(hashes[1]) == 1.0 and caches[1].shared_hits == 1
+        assert caches[2].get(hashes[2]) is None
+    finally:
+        shared.close()
+
+
+def test_shared_table_overwrites_slots():
+    shared = SharedScoreTable.create(4)
+    try:
+        shared.put(1, 1.0)
+        shared.put(5, 5.0)
+        assert shared.get(1) is None and shared.get(5) == 5.0
+        assert shared.get(0) is None
+    finally:
+        shared.close()
+
+
+def write_and_read(shared: SharedScoreTable, results):
+    cache = ScoreCache(FINGERPRINT, 16, shared)
+    results.put(cache.get(1))
+    cache.put(2, -2.5)
+    shared.close()
+
+
+def test_shared_table_across_processes():
+    ctx = multiprocessing.get_context("spawn")
+    shared = SharedScoreTable.create(64)
+    try:
+        shared.put(1, 1.5)
+        results = ctx.Queue()
+        process = ctx.Process(target=write_and_read, args=(shared, results))
+        process.start()
+        assert results.get(timeout=60) == 1.5
+        process.join(timeout=60)
+        assert process.exitcode == 0
+        assert shared.get(2) == -2.5
+    finally:
+        shared.close()
@@ -0,0 +1,62 @@
+import copy
+import random
+
+import pytest
+
+from layout_optimisation.checkpoint import Checkpoint, checkpoint_fingerprint
+from layout_optimisation.config import cfg
+from layout_optimisation.layouts.layouts import LAYOUTS
+
+
+@pytest.fixture(scope="module")
+def fingerprint(corpus) -> bytes:
+    return checkpoint_fingerprint(cfg, corpus, dict(cfg["dir_weights"]))
+
+
+def make_checkpoint() -> Checkpoint:
+    qwerty = LAYOUTS["QWERTY"].flatten()
+    # Values, which aren't chars of the alphabet, are stored apart from compact keys
+    with_untracked = list(qwerty)
+    with_untracked[with_untracked.index(None)] = "ß"
+    return Checkpoint(
+        cycle=3,
+        layouts=[qwerty, with_untracked],
+        energies=[1.25, 1.5],
+        temperatures=[0.01, 0.002],
+        stalls=[0, 2],
+        frozen=[False, True],
+        fidelity=0.5,
+        rng_state=random.Random(7).getstate(),
+        elapsed=12.5,
+        best_score=1.125,
+    )
+
+
+def test_round_trip(tmp_path, fingerprint):
+    path = tmp_path / "checkpoint.npz"
+    checkpoint = make_checkpoint()
+    checkpoint.save(path, fingerprint)
+    loaded = Checkpoint.load(path, fingerprint)
+    assert vars(loaded) == vars(checkpoint)
+    # Generator continues exactly where the saved one stopped
+    rng = random.Random()
+    rng.setstate(loaded.rng_state)
+    assert rng.random() == random.Random(7).random()
+    assert [path.name] == [file_path.name for file_path in tmp_path.iterdir()]
+
+
+def test_rejects_other_fingerprint(tmp_path, corpus, fingerprint):
+    path = tmp_path / "checkpoint.npz"
+    make_checkpoint().save(path, fingerprint)
+    other_cfg = copy.deepcopy(cfg)
+    other_cfg["annealing"]["init_temperature"] *= 2
+    other_fingerprint = checkpoint_fingerprint(other_cfg, corpus, dict(cfg["dir_weights"]))
+    assert other_fingerprint != fingerprint
+    with pytest.raises(ValueError, match="different config"):
+        Checkpoint.load(path, other_fingerprint)
+
+
+def test_fingerprint_ignores_config_of_the_machine(corpus, fingerprint):
+    other_cfg = copy.deepcopy(cfg)
+    other_cfg["annealing"]["num_processes"] += 1
+    assert checkpoint_fingerprint(other_cfg, corpus, dict(cfg["dir_weights"])) == fingerprint
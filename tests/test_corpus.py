@@ -0,0 +1,81 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from layout_optimisation import corpus as corpus_module
+from layout_optimisation.config import cfg
+from layout_optimisation.corpus import Corpus, NGramCounts
+
+
+@pytest.fixture
+def text_dir(tmp_path):
+    text_dir = tmp_path / "texts"
+    (text_dir / "prose").mkdir(parents=True)
+    (text_dir / "prose" / "first.txt").write_text("the quick brown fox\njumps over\nthe lazy dog\n")
+    (text_dir / "prose" / "second.txt").write_text("hello world\n")
+    return text_dir
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """Directories, whose n-grams were counted from texts instead of loaded from the cache"""
+    counted = []
+    from_files = NGramCounts.from_files
+
+    def counting_from_files(file_texts):
+        counted.append(file_texts)
+        return from_files(file_texts)
+
+    monkeypatch.setattr(corpus_module.NGramCounts, "from_files", staticmethod(counting_from_files))
+    return counted
+
+
+def assert_same_counts(first: Corpus, second: Corpus):
+    for n in range(1, corpus_module.MAX_NGRAM + 1):
+        np.testing.assert_array_equal(first.merged.grams(n), second.merged.grams(n))
+        np.testing.assert_array_equal(first.merged.counts(n), second.merged.counts(n))
+    assert list(first.file_ngrams["prose"]) == list(second.file_ngrams["prose"])
+
+
+def test_cache_is_reused_until_inputs_change(text_dir, tmp_path, counted):
+    test_cfg = copy.deepcopy(cfg)
+    test_cfg["text_downsampling"] = 1
+    cache_dir = tmp_path / "cache"
+    uncached = Corpus.from_dir(text_dir, test_cfg)
+    assert len(counted) == 1
+
+    assert_same_counts(Corpus.from_dir(text_dir, test_cfg, cache_dir), uncached)
+    assert len(counted) == 2
+    assert_same_counts(Corpus.from_dir(text_dir, test_cfg, cache_dir), uncached)
+    assert len(counted) == 2
+
+    # Changed size of a file
+    (text_dir / "prose" / "second.txt").write_text("hello world again\n")
+    changed = Corpus.from_dir(text_dir, test_cfg, cache_dir)
+    assert len(counted) == 3
+    assert_same_counts(changed, Corpus.from_dir(text_dir, test_cfg))
+
+    # Same size, modification time is moved, in case the file system has coarse timestamps
+    path = text_dir / "prose" / "second.txt"
+    path.write_text("jello world again\n")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    Corpus.from_dir(text_dir, test_cfg, cache_dir)
+    assert len(counted) == 5
+
+
+def test_cache_keeps_entries_of_each_text_downsampling(text_dir, tmp_path, counted):
+    cache_dir = tmp_path / "cache"
+    configs = [copy.deepcopy(cfg) for _ in range(2)]
+    configs[0]["text_downsampling"], configs[1]["text_downsampling"] = 1, 2
+    corpora = [Corpus.from_dir(text_dir, test_cfg, cache_dir) for test_cfg in configs]
+    assert len(counted) == 2
+    assert corpora[0].merged.text_len > corpora[1].merged.text_len
+    assert len(list(cache_dir.glob("*.npz"))) == 2
+
+    # Neither entry overwrote the other
+    for test_cfg, expected in zip(configs, corpora):
+        assert_same_counts(Corpus.from_dir(text_dir, test_cfg, cache_dir), expected)
+    assert len(counted) == 2
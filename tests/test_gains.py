@@ -0,0 +1,60 @@
+import random
+
+import numpy as np
+import pytest
+
+from layout_optimisation.annealing import evaluate_layouts, generate_initial_layouts
+from layout_optimisation.config import cfg
+from layout_optimisation.layouts.base import CompactLayout
+from layout_optimisation.moves import SearchSpace
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+from layout_optimisation.gains import SwapGains
+from layout_optimisation.tabu import tabu_search
+
+ATOL = 1e-9
+
+
+def check_gains(gains: SwapGains, keys: np.ndarray, free: np.ndarray, keyboard, corpus):
+    """Gains of swapping each pair of free positions match change of total penalty of the swapped layout"""
+    first, second = np.triu_indices(len(free), k=1)
+    first, second = free[first], free[second]
+    # Swaps of equal keys, like two empty keys, don't change the layout
+    changed = keys[first] != keys[second]
+    first, second = first[changed], second[changed]
+    perms = np.repeat(keys[np.newaxis], len(first) + 1, axis=0)
+    rows = np.arange(1, len(perms))
+    perms[rows, first], perms[rows, second] = keys[second], keys[first]
+    totals = evaluate_batch(perms, keyboard, corpus, cfg, dict(cfg["dir_weights"]))[
+        :, get_penalty_terms().index("total")
+    ]
+    np.testing.assert_allclose(gains.matrix[first, second], totals[1:] - totals[0], rtol=0, atol=ATOL)
+    assert gains.score == pytest.approx(totals[0], rel=0, abs=ATOL)
+
+
+@pytest.mark.parametrize("layout_idx", [0, -1])
+def test_gains_match_evaluate_batch(layout_idx, corpus, keyboard):
+    """Gains are exact for a new layout and stay exact, as applied swaps update them incrementally"""
+    rng = random.Random(0)
+    flat_keys = generate_initial_layouts(cfg, rng=rng)[layout_idx]
+    space = SearchSpace(len(flat_keys), cfg)
+    keys = CompactLayout.from_flat(space.repair(flat_keys), len(keyboard)).keys
+    free = np.array(space.free)
+    gains = SwapGains(keys.copy(), keyboard, corpus, cfg, dict(cfg["dir_weights"]))
+    check_gains(gains, keys, free, keyboard, corpus)
+    for _ in range(10):
+        first_idx, second_idx = rng.sample(space.free, 2)
+        keys[[first_idx, second_idx]] = keys[[second_idx, first_idx]]
+        gains.apply(first_idx, second_idx)
+    check_gains(gains, keys, free, keyboard, corpus)
+
+
+def test_tabu_search_is_seeded(corpus, keyboard):
+    """Same seed gives the same best layouts, and scores kept by SwapGains match evaluate"""
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[0]
+    runs = [
+        tabu_search(flat_keys, 30, keyboard, corpus, cfg, dict(cfg["dir_weights"]), random.Random(1)) for _ in range(2)
+    ]
+    assert runs[0] == runs[1]
+    best_keys, best_score = runs[0][-1]
+    evaluated = evaluate_layouts([best_keys], keyboard, corpus, cfg, dict(cfg["dir_weights"]))[0]
+    assert best_score == pytest.approx(evaluated, rel=0, abs=ATOL)
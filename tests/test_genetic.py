@@ -0,0 +1,43 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from layout_optimisation.config import cfg
+from layout_optimisation.genetic import CROSSOVERS, crossover
+from layout_optimisation.layouts.layouts import LAYOUTS
+from layout_optimisation.moves import SearchSpace
+
+
+@pytest.mark.parametrize("operator", list(CROSSOVERS))
+@pytest.mark.parametrize("size", [1, 2, 5, 40])
+def test_operator_returns_permutation(operator, size):
+    rng = random.Random(0)
+    for _ in range(50):
+        first, second = np.array(rng.sample(range(size), size)), np.array(rng.sample(range(size), size))
+        child = CROSSOVERS[operator](first, second, rng)
+        assert sorted(child.tolist()) == list(range(size))
+
+
+def test_cycle_crossover_keeps_positions_of_parents():
+    rng = random.Random(0)
+    for _ in range(50):
+        first, second = np.array(rng.sample(range(40), 40)), np.array(rng.sample(range(40), 40))
+        child = CROSSOVERS["cx"](first, second, rng)
+        assert np.all((child == first) | (child == second))
+
+
+@pytest.mark.parametrize("operator", list(CROSSOVERS))
+def test_crossover_keeps_keys_and_constraints(operator):
+    rng = random.Random(0)
+    flat_keys = LAYOUTS["MK11"].flatten()
+    space = SearchSpace(len(flat_keys), cfg)
+    assert space.pinned and space.blocked
+    flat_keys = space.repair(flat_keys)
+    for _ in range(50):
+        first, second = space.shuffle(flat_keys, rng), space.shuffle(flat_keys, rng)
+        child = crossover(first, second, space, operator, rng)
+        assert Counter(child) == Counter(first)
+        assert space.is_valid(child)
+        assert all(child[idx] == first[idx] for idx in range(len(child)) if idx not in space.free)
@@ -0,0 +1,39 @@
+import random
+
+from layout_optimisation.hashing import ZobristHash
+from layout_optimisation.layouts.base import CompactLayout
+from layout_optimisation.layouts.layouts import LAYOUTS
+
+SEED = bytes(range(32))
+
+
+def test_swap_matches_full_hash():
+    rng = random.Random(0)
+    flat_keys = LAYOUTS["MK11"].flatten()
+    # Untracked values hash by their value, not only as untracked keys
+    flat_keys[flat_keys.index(None)] = "ß"
+    flat_keys[flat_keys.index(None)] = "€"
+    hasher = ZobristHash(len(flat_keys), SEED)
+    keys = CompactLayout.from_flat(flat_keys, 1).keys
+    layout_hash, flat_hash = hasher.hash(keys), hasher.hash_flat(flat_keys)
+    for _ in range(200):
+        first_idx, second_idx = rng.sample(range(len(flat_keys)), 2)
+        layout_hash = hasher.swap(layout_hash, keys, first_idx, second_idx)
+        flat_hash = hasher.swap_flat(flat_hash, flat_keys, first_idx, second_idx)
+        keys[[first_idx, second_idx]] = keys[[second_idx, first_idx]]
+        flat_keys[first_idx], flat_keys[second_idx] = flat_keys[second_idx], flat_keys[first_idx]
+        assert layout_hash == hasher.hash(keys)
+        assert flat_hash == hasher.hash_flat(flat_keys)
+
+
+def test_untracked_values_change_flat_hash():
+    flat_keys = LAYOUTS["QWERTY"].flatten()
+    first_idx = flat_keys.index(None)
+    second_idx = flat_keys.index(None, first_idx + 1)
+    flat_keys[first_idx], flat_keys[second_idx] = "ß", "€"
+    swapped = list(flat_keys)
+    swapped[first_idx], swapped[second_idx] = "€", "ß"
+    hasher = ZobristHash(len(flat_keys), SEED)
+    assert hasher.hash_flat(flat_keys) != hasher.hash_flat(swapped)
+    # Same seed gives same values in another process
+    assert ZobristHash(len(flat_keys), SEED).hash_flat(flat_keys) == hasher.hash_flat(flat_keys)
@@ -0,0 +1,36 @@
+import random
+
+from layout_optimisation.annealing import generate_initial_layouts
+from layout_optimisation.config import cfg
+from layout_optimisation.islands import merge_migrants, migration_targets, pack, unpack
+
+
+def test_pack_keeps_layout_and_score():
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[0]
+    # Untracked keys, such as layer switches, are sent by value
+    flat_keys[flat_keys.index(None)] = "untracked"
+    assert unpack(pack(flat_keys, 1.5)) == (flat_keys, 1.5)
+
+
+def test_migration_targets_are_other_islands():
+    assert migration_targets(0, 1, "ring", random.Random(0)) == []
+    assert [migration_targets(idx, 3, "ring", random.Random(0)) for idx in range(3)] == [[1], [2], [0]]
+    rng = random.Random(0)
+    for island in range(4):
+        targets = {target for _ in range(50) for target in migration_targets(island, 4, "random", rng)}
+        assert targets == set(range(4)) - {island}
+
+
+def test_migrants_replace_worst_layouts():
+    population = [(["a"], 1.0), (["b"], 2.0), (["c"], 3.0)]
+    received = [(["x"], 0.5), (["y"], 2.5), (["z"], 0.1)]
+    # Only the best migrant is received, the best local layout is kept
+    assert merge_migrants(population, received, 1) == [(["z"], 0.1), (["a"], 1.0), (["b"], 2.0)]
+    assert merge_migrants(population, received, 2) == [(["z"], 0.1), (["x"], 0.5), (["a"], 1.0)]
+    # Worse migrants don't replace anything
+    assert merge_migrants(population, [(["w"], 4.0)], 2) == population
+
+
+def test_single_layout_is_replaced_by_better_migrant():
+    assert merge_migrants([(["a"], 1.0)], [(["x"], 0.5)], 1) == [(["x"], 0.5)]
+    assert merge_migrants([(["a"], 1.0)], [(["x"], 1.5)], 1) == [(["a"], 1.0)]
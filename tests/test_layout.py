@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+from layout_optimisation.annealing import generate_initial_layouts
+from layout_optimisation.config import cfg
+from layout_optimisation.layouts.base import Layout
+from layout_optimisation.layouts.mapper import generate_key_map_template
+
+
+def test_lookups_match_search_of_layers(keyboard):
+    """Tracked and untracked chars are found at the same place as by searching the layers"""
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[0]
+    flat_keys[flat_keys.index(None)] = "ß"
+    layout = Layout.from_flat(flat_keys, generate_key_map_template(cfg), keyboard)
+    chars = [value for value in flat_keys if value is not None]
+    assert "ß" in chars and "a" in chars
+    for char in chars:
+        layer_idx = next(idx for idx, layer in enumerate(layout.layers) if char in layer.values)
+        index = layout.layers[layer_idx].values.index(char)
+        assert layout.get_layer_idx(char) == layer_idx
+        assert layout.get_layer(char) is layout.layers[layer_idx]
+        assert layout.get_index(char) == index
+        assert layout.get_hand(char) == keyboard._hands[index]
+        assert layout.get_finger(char) == keyboard._fingers[index]
+        assert layout.get_row(char) == keyboard._rows[index]
+        assert layout.get_location_penalty(char) == keyboard._penalties[index]
+
+
+def test_missing_chars_raise_key_error():
+    flat_keys = generate_initial_layouts(cfg, rng=random.Random(0))[0]
+    layout = Layout.from_flat([None if value == "a" else value for value in flat_keys], generate_key_map_template(cfg))
+    for char in ["a", "ß"]:
+        with pytest.raises(KeyError):
+            layout.get_position(char)
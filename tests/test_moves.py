@@ -0,0 +1,75 @@
+import random
+from collections import Counter
+
+import pytest
+
+from layout_optimisation.annealing import generate_initial_layouts
+from layout_optimisation.config import cfg
+from layout_optimisation.moves import SearchSpace, SwapGenerator
+
+SEEDS = range(20)
+
+
+def random_constraints(flat_keys, rng: random.Random) -> dict:
+    """Random frozen chars and blocked indexes, which a layout can satisfy"""
+    chars = [key for key in flat_keys if key is not None]
+    positions = rng.sample(range(len(flat_keys)), 12)
+    frozen = dict(zip(rng.sample(chars, 6), positions[:6]))
+    return {"frozen_keys": frozen, "blocked_indexes": positions[6:]}
+
+
+@pytest.fixture(scope="module")
+def initial_layouts():
+    return generate_initial_layouts(cfg, rng=random.Random(0))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_repair_pins_frozen_keys_and_empties_blocked_indexes(seed, initial_layouts):
+    rng = random.Random(seed)
+    flat_keys = list(rng.choice(initial_layouts))
+    rng.shuffle(flat_keys)
+    for constraints in [cfg, random_constraints(flat_keys, rng)]:
+        space = SearchSpace(len(flat_keys), constraints)
+        repaired = space.repair(flat_keys)
+        assert space.is_valid(repaired)
+        assert Counter(repaired) == Counter(flat_keys)
+        assert all(repaired[idx] == char for char, idx in constraints["frozen_keys"].items())
+        assert all(repaired[idx] is None for idx in constraints["blocked_indexes"])
+        # Repair of a valid layout changes nothing
+        assert space.repair(repaired) == repaired
+        shuffled = space.shuffle(repaired, rng)
+        assert space.is_valid(shuffled) and Counter(shuffled) == Counter(flat_keys)
+
+
+def test_conflicting_constraints():
+    with pytest.raises(ValueError):
+        SearchSpace(10, {"frozen_keys": {"a": 3}, "blocked_indexes": [3]})
+    space = SearchSpace(3, {"frozen_keys": {"a": 0}, "blocked_indexes": []})
+    with pytest.raises(ValueError):
+        space.repair(["b", None, "c"])
+    space = SearchSpace(3, {"frozen_keys": {}, "blocked_indexes": [0]})
+    with pytest.raises(ValueError):
+        space.repair(["a", "b", "c"])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_generated_swaps_are_legal(seed, initial_layouts):
+    rng = random.Random(seed)
+    flat_keys = list(rng.choice(initial_layouts))
+    constraints = random_constraints(flat_keys, rng)
+    space = SearchSpace(len(flat_keys), constraints)
+    flat_keys = space.repair(flat_keys)
+    swaps = SwapGenerator(space, rng)
+    free = set(space.free)
+    for _ in range(500):
+        first_idx, second_idx = swaps.propose(flat_keys)
+        assert first_idx != second_idx
+        assert first_idx in free and second_idx in free
+        assert flat_keys[first_idx] is not None or flat_keys[second_idx] is not None
+        flat_keys[first_idx], flat_keys[second_idx] = flat_keys[second_idx], flat_keys[first_idx]
+        assert space.is_valid(flat_keys)
+
+
+def test_swaps_need_two_free_positions():
+    with pytest.raises(ValueError):
+        SwapGenerator(SearchSpace(2, {"frozen_keys": {"a": 0}, "blocked_indexes": []}))
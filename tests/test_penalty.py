@@ -0,0 +1,67 @@
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from layout_optimisation.config import cfg
+from layout_optimisation.layouts.base import CompactLayout, Layout
+from layout_optimisation.layouts.layouts import LAYOUTS
+from layout_optimisation.layouts.mapper import generate_key_map_template
+from layout_optimisation.penalty import evaluate, evaluate_batch, get_penalty_terms
+from layout_optimisation.scorer import SwapScorer
+
+# Penalties of bundled layouts by the original implementation, which scanned full text of each directory,
+# with files of each directory read in sorted order, like Corpus does, since n-grams span files
+BASELINE_PATH = Path(__file__).parent / "data" / "baseline_penalties.json"
+RTOL = 1e-9
+
+
+@pytest.fixture(scope="module")
+def baseline() -> dict:
+    with BASELINE_PATH.open() as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("name", list(LAYOUTS))
+def test_evaluate_matches_baseline(name, corpus, keyboard, baseline):
+    layout = LAYOUTS[name]
+    layout.add_keyboard(keyboard)
+    penalties = evaluate(layout, corpus, cfg, dict(cfg["dir_weights"]))
+    assert set(penalties) == set(baseline[name])
+    for key, value in baseline[name].items():
+        assert penalties[key] == pytest.approx(value, rel=RTOL, abs=1e-12), key
+
+
+def test_evaluate_batch_matches_baseline(corpus, keyboard, baseline):
+    names = list(LAYOUTS)
+    num_keys = max(len(LAYOUTS[name].flatten()) for name in names)
+    perms = np.stack([CompactLayout.from_flat(LAYOUTS[name].flatten(num_keys), len(keyboard)).keys for name in names])
+    penalties = evaluate_batch(perms, keyboard, corpus, cfg, dict(cfg["dir_weights"]))
+    expected = np.array([[baseline[name][term] for term in get_penalty_terms()] for name in names])
+    np.testing.assert_allclose(penalties, expected, rtol=RTOL, atol=1e-12)
+
+
+@pytest.mark.parametrize("name", ["QWERTY", "MK11"])
+def test_swap_scorer_matches_evaluate(name, corpus, keyboard):
+    """Penalties of the scorer stay same as evaluate over a walk of random swaps, of which about half are committed"""
+    rng = random.Random(0)
+    template = generate_key_map_template(cfg)
+    dir_weights = dict(cfg["dir_weights"])
+    scorer = SwapScorer(LAYOUTS[name].flatten(), keyboard, corpus, cfg, dir_weights)
+    num_committed = 0
+    while num_committed < 30:
+        flat_keys = scorer.flat_keys
+        first_idx, second_idx = rng.sample(range(len(flat_keys)), 2)
+        if flat_keys[first_idx] is None and flat_keys[second_idx] is None:
+            continue
+        scorer.propose_swap(first_idx, second_idx)
+        if rng.random() < 0.5:
+            continue
+        scorer.commit()
+        num_committed += 1
+        penalties = evaluate(Layout.from_flat(scorer.flat_keys, template, keyboard), corpus, cfg, dir_weights)
+        assert set(scorer.penalties) == set(penalties)
+        for key, value in penalties.items():
+            assert scorer.penalties[key] == pytest.approx(value, rel=RTOL, abs=1e-12), key
@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pytest
+
+from layout_optimisation import racing
+from layout_optimisation.annealing import evaluate_layouts, generate_initial_layouts
+from layout_optimisation.config import cfg
+from layout_optimisation.corpus import MAX_NGRAM, NGramCounts
+from layout_optimisation.layouts.base import CompactLayout
+from layout_optimisation.racing import race, shard_corpora
+
+
+@pytest.fixture(scope="module")
+def candidates(corpus, keyboard) -> tuple:
+    """Keys of initial layouts, sorted by their scores on the full corpus, best first"""
+    layouts = generate_initial_layouts(cfg, rng=random.Random(0))
+    energies = evaluate_layouts(layouts, keyboard, corpus, cfg, dict(cfg["dir_weights"]))
+    order = np.argsort(energies)
+    perms = np.stack([CompactLayout.from_flat(layouts[idx], len(keyboard)).keys for idx in order])
+    return perms, energies[order]
+
+
+def assert_same_counts(first: NGramCounts, second: NGramCounts, max_n: int = MAX_NGRAM):
+    for n in range(1, max_n + 1):
+        np.testing.assert_array_equal(first.grams(n), second.grams(n))
+        np.testing.assert_array_equal(first.counts(n), second.counts(n))
+
+
+@pytest.mark.parametrize("num_shards", [3, 8])
+def test_shards_partition_files(corpus, num_shards):
+    shards = shard_corpora(corpus, num_shards)
+    assert len(shards) == num_shards
+    for dir_name, file_ngrams in corpus.file_ngrams.items():
+        shard_ngrams = [shard.ngrams[dir_name] for shard in shards]
+        if len(file_ngrams) < num_shards:
+            for ngrams in shard_ngrams:
+                assert ngrams is corpus.ngrams[dir_name]
+            continue
+        # Each file is in exactly one shard, so counts of shards add up to counts of all files
+        assert_same_counts(NGramCounts.combine(shard_ngrams), NGramCounts.combine(list(file_ngrams.values())))
+        # Only n-grams, which span two files, are missing from shards, so single chars add up to the directory
+        assert_same_counts(NGramCounts.combine(shard_ngrams), corpus.ngrams[dir_name], max_n=1)
+
+
+def test_best_candidate_survives(corpus, keyboard, candidates):
+    perms, _ = candidates
+    alive, shard_means = race(perms[:8], keyboard, corpus, cfg, dict(cfg["dir_weights"]))
+    assert 0 in alive
+    assert np.argmin(shard_means) == 0
+
+
+def test_worse_candidate_is_dropped_early(corpus, keyboard, candidates, monkeypatch):
+    perms, energies = candidates
+    assert energies[-1] > 2 * energies[0]
+    num_calls = 0
+    evaluate_batch = racing.evaluate_batch
+
+    def counting_evaluate_batch(*args, **kwargs):
+        nonlocal num_calls
+        num_calls += 1
+        return evaluate_batch(*args, **kwargs)
+
+    monkeypatch.setattr(racing, "evaluate_batch", counting_evaluate_batch)
+    alive, shard_means = race(perms[[0, -1]], keyboard, corpus, cfg, dict(cfg["dir_weights"]))
+    assert alive.tolist() == [0]
+    # Race stops once a single candidate is left, which is as soon as candidates can be dropped
+    assert num_calls == cfg["racing"]["min_shards"] < cfg["racing"]["num_shards"]
+    assert shard_means[1] > shard_means[0]
@@ -0,0 +1,73 @@
+import math
+
+import pytest
+
+from layout_optimisation.schedule import AdaptiveSchedule, GeometricSchedule, make_schedule
+
+ANNEALING = {
+    "init_temperature": 1.0,
+    "final_temperature": 0.01,
+    "adaptive_schedule": {
+        "enabled": True,
+        "init_acceptance": 0.3,
+        "final_acceptance": 0.01,
+        "max_step": 2,
+        "reheat_after": 3,
+        "reheat_factor": 4,
+        "stop_acceptance": 0.002,
+    },
+}
+
+
+def test_geometric_schedule():
+    schedule = make_schedule({**ANNEALING, "adaptive_schedule": {"enabled": False}})
+    assert isinstance(schedule, GeometricSchedule)
+    assert schedule.step(0.5, 0, False, 10, 0, 0.0) == (1.0, 0)
+    assert schedule.step(0.5, 0, False, 10, 0, 0.5)[0] == pytest.approx(0.1)
+    assert schedule.step(0.5, 0, False, 10, 0, 1.0)[0] == pytest.approx(0.01)
+    assert not schedule.is_frozen(10, 0)
+
+
+def test_adaptive_schedule_follows_acceptance():
+    schedule = make_schedule(ANNEALING)
+    assert isinstance(schedule, AdaptiveSchedule)
+    assert schedule.target(0.0) == pytest.approx(0.3) and schedule.target(1.0) == pytest.approx(0.01)
+    # Uphill swaps and accepted uphill swaps of each cycle, with the temperature they should lead to
+    cycles = [
+        # Everything is accepted, so temperature drops as much as it can
+        (99, 99, 0.5),
+        # Nothing is accepted, so temperature rises as much as it can
+        (99, 0, 1.0),
+        # Smoothed rate (1 + 0.5) / (4 + 1) is on target
+        (4, 1, 1.0),
+        # Without uphill swaps there is nothing to adjust by
+        (0, 0, 1.0),
+        # Smoothed rate 0.1 is below target, temperature rises by ln(0.1) / ln(0.3)
+        (9, 0.5, math.log(0.1) / math.log(0.3)),
+    ]
+    temperature = 1.0
+    for uphill, accepted, expected in cycles:
+        temperature, stalls = schedule.step(temperature, 0, True, uphill, accepted, 0.0)
+        assert temperature == pytest.approx(expected)
+        assert stalls == 0
+
+
+def test_adaptive_schedule_reheats_stalled_chains():
+    schedule = AdaptiveSchedule(ANNEALING)
+    temperature, stalls = 1.0, 0
+    history = []
+    for _ in range(4):
+        temperature, stalls = schedule.step(temperature, stalls, False, 4, 1, 0.0)
+        history.append((pytest.approx(temperature), stalls))
+    assert history == [(1.0, 1), (1.0, 2), (4.0, 0), (4.0, 1)]
+    # Improvement resets stalls
+    assert schedule.step(1.0, 2, True, 4, 1, 0.0) == (pytest.approx(1.0), 0)
+
+
+def test_adaptive_schedule_freezes_collapsed_chains():
+    schedule = AdaptiveSchedule(ANNEALING)
+    assert schedule.is_frozen(1000, 1)
+    assert not schedule.is_frozen(1000, 2) and not schedule.is_frozen(0, 0)
+    # Frozen chains aren't reheated
+    temperature, stalls = schedule.step(1.0, 2, False, 1000, 1, 0.0)
+    assert temperature == pytest.approx(2.0) and stalls == 3
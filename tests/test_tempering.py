@@ -0,0 +1,38 @@
+import math
+import random
+
+import numpy as np
+
+from layout_optimisation.tempering import exchange_replicas, temperature_ladder
+
+
+def test_temperature_ladder_is_geometric():
+    temperatures = temperature_ladder(1.0, 0.01, 5)
+    assert temperatures[0] == 1.0 and math.isclose(temperatures[-1], 0.01)
+    np.testing.assert_allclose(temperatures[1:] / temperatures[:-1], np.full(4, 0.01**0.25))
+    assert temperature_ladder(1.0, 0.01, 1).tolist() == [0.01]
+
+
+def test_better_state_always_moves_down_the_ladder():
+    temperatures = temperature_ladder(1.0, 0.01, 4)
+    states = [(["hot"], 1.0), (["warm"], 2.0), (["cool"], 3.0), (["cold"], 4.0)]
+    attempts, accepts = np.zeros(3, dtype=int), np.zeros(3, dtype=int)
+    exchange_replicas(states, temperatures, 0, attempts, accepts, random.Random(0))
+    assert [keys[0] for keys, _ in states] == ["warm", "hot", "cold", "cool"]
+    assert attempts.tolist() == [1, 0, 1] and accepts.tolist() == [1, 0, 1]
+
+    # Odd offset pairs replicas 1 and 2
+    exchange_replicas(states, temperatures, 1, attempts, accepts, random.Random(0))
+    assert [keys[0] for keys, _ in states] == ["warm", "cold", "hot", "cool"]
+    assert attempts.tolist() == [1, 1, 1] and accepts.tolist() == [1, 1, 1]
+
+
+def test_worse_state_moves_down_with_metropolis_probability():
+    temperatures = np.array([1.0, 0.5])
+    rng = random.Random(0)
+    attempts, accepts = np.zeros(1, dtype=int), np.zeros(1, dtype=int)
+    for _ in range(10_000):
+        exchange_replicas([(["hot"], 2.0), (["cold"], 1.0)], temperatures, 0, attempts, accepts, rng)
+    # (E_hot - E_cold) * (1 / T_hot - 1 / T_cold) = 1 * (1 - 2)
+    assert attempts[0] == 10_000
+    assert abs(accepts[0] / attempts[0] - math.exp(-1)) < 0.02
@@ -0,0 +1,37 @@
+import os
+import stat
+
+import pytest
+
+from layout_optimisation.utils import write_atomic
+
+
+def test_write_atomic_replaces_content(tmp_path):
+    path = tmp_path / "best.txt"
+    write_atomic(path, "first")
+    write_atomic(path, "second")
+    assert path.read_text() == "second"
+    assert [path.name] == [file_path.name for file_path in tmp_path.iterdir()]
+
+
+def test_write_atomic_removes_temporary_file_on_failure(tmp_path):
+    # A directory can't be replaced by a file
+    path = tmp_path / "best.txt"
+    (path / "other").mkdir(parents=True)
+    with pytest.raises(OSError):
+        write_atomic(path, "content")
+    assert [path.name] == [file_path.name for file_path in tmp_path.iterdir()]
+
+
+def test_write_atomic_sets_mode(tmp_path):
+    path = tmp_path / "best.txt"
+    umask = os.umask(0o027)
+    try:
+        write_atomic(path, "first")
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+    # Replaced file keeps its mode
+    path.chmod(0o604)
+    write_atomic(path, "second")
+    assert stat.S_IMODE(path.stat().st_mode) == 0o604
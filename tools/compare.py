@@ -1,29 +1,89 @@
 import argparse
 import logging
+from multiprocessing import Pool
+from typing import List
 
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
+from layout_optimisation.bootstrap import bootstrap_penalties, percentile_interval
 from layout_optimisation.config import cfg
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.layouts.base import CompactLayout
 from layout_optimisation.layouts.layouts import LAYOUTS
 from layout_optimisation.layouts.mapper import generate_key_map_template, generate_keyboard
-from layout_optimisation.penalty import evaluate
+from layout_optimisation.penalty import evaluate_batch, get_penalty_terms
+from layout_optimisation.racing import race
 from layout_optimisation.utils import complete_and_parse_args
 
 logging.basicConfig(level=logging.ERROR)
 
 parser = argparse.ArgumentParser()
 parser.add_argument("names", type=str, nargs="*", default=list(LAYOUTS.keys()))
+parser.add_argument("--num-processes", type=int, default=1)
+parser.add_argument("--race", action="store_true", help="Only fully evaluate layouts, which win racing on shards")
+parser.add_argument("--bootstrap", type=int, default=0, help="Resamples of files for confidence intervals, 0 to skip")
+parser.add_argument("--confidence", type=float, default=0.95)
 args = complete_and_parse_args(parser)
 
+corpus = Corpus.from_dir(args.text_dir, cfg, args.cache_dir)
 template = generate_key_map_template(cfg)
 keyboard = generate_keyboard(template, cfg)
+worker_state = {}
 
-layout_results = {}
-for name in tqdm(args.names, desc="Evaluating layouts"):
-    layout = LAYOUTS[name]
-    layout.add_keyboard(keyboard)
-    layout_results[name] = evaluate(layout, args.text_dir, cfg, args.dir_weights, args.no_forced)
 
-df = pd.DataFrame.from_dict(layout_results)
+def init_worker(shared_corpus: Corpus):
+    worker_state["corpus"] = shared_corpus
+
+
+def layout_perms(names: List[str]) -> np.ndarray:
+    # Layouts are padded to the same number of keys, so that they are evaluated in one batch
+    num_keys = max(len(LAYOUTS[name].flatten()) for name in names)
+    return np.stack([CompactLayout.from_flat(LAYOUTS[name].flatten(num_keys), len(template)).keys for name in names])
+
+
+def evaluate_layouts(names: List[str]) -> np.ndarray:
+    perms = layout_perms(names)
+    return evaluate_batch(perms, keyboard, worker_state.get("corpus", corpus), cfg, args.dir_weights, args.no_forced)
+
+
+if args.race:
+    survivors, _ = race(layout_perms(args.names), keyboard, corpus, cfg, args.dir_weights, args.no_forced)
+    dropped = [name for idx, name in enumerate(args.names) if idx not in survivors]
+    print(f"Dropped by racing: {', '.join(dropped)}")
+    args.names = [args.names[idx] for idx in survivors]
+
+if args.num_processes > 1:
+    # Workers attach to n-gram arrays in shared memory instead of each receiving a copy
+    shared_corpus = corpus.share()
+    chunk_size = -(-len(args.names) // args.num_processes)
+    chunks = [args.names[start : start + chunk_size] for start in range(0, len(args.names), chunk_size)]
+    try:
+        with Pool(args.num_processes, initializer=init_worker, initargs=(shared_corpus,)) as pool:
+            results = np.concatenate(pool.map(evaluate_layouts, chunks))
+    finally:
+        shared_corpus.close()
+else:
+    results = evaluate_layouts(args.names)
+
+df = pd.DataFrame(results.T, index=get_penalty_terms(args.no_forced), columns=args.names)
 print(df)
+
+if args.bootstrap > 0:
+    samples = bootstrap_penalties(
+        layout_perms(args.names), keyboard, corpus, cfg, args.dir_weights, args.no_forced, args.bootstrap
+    )
+    lower, upper = percentile_interval(samples, args.confidence)
+    intervals = [
+        [f"[{low:.3f}, {high:.3f}]" for low, high in zip(layout_lower, layout_upper)]
+        for layout_lower, layout_upper in zip(lower, upper)
+    ]
+    print(f"\n{args.confidence:.0%} confidence intervals from {args.bootstrap} resamples of files:")
+    print(pd.DataFrame(np.array(intervals).T, index=df.index, columns=args.names))
+
+    # Differences to the best layout are paired by resample, so noise, which all layouts share, cancels out
+    total_idx = get_penalty_terms(args.no_forced).index("total")
+    best_idx = int(np.argmin(results[:, total_idx]))
+    diff_lower, _ = percentile_interval(samples[:, :, total_idx] - samples[:, [best_idx], total_idx], args.confidence)
+    tied = [name for name, low in zip(args.names, diff_lower) if low <= 0 and name != args.names[best_idx]]
+    print(f"\nNot significantly worse than {args.names[best_idx]}: {', '.join(tied) or 'none'}")
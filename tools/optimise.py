@@ -4,15 +4,69 @@ from pathlib import Path
 
 from layout_optimisation.annealing import run_annealing
 from layout_optimisation.config import cfg
+from layout_optimisation.corpus import Corpus
+from layout_optimisation.genetic import run_genetic
+from layout_optimisation.islands import run_islands
+from layout_optimisation.tabu import run_tabu_search
+from layout_optimisation.tempering import run_tempering
 from layout_optimisation.utils import complete_and_parse_args
 
 logging.basicConfig(level=logging.ERROR)
+# Reports of optimisers, such as gain of polishing and exchange rates between tempering replicas
+for logger_name in ("layout_optimisation.annealing", "layout_optimisation.tempering"):
+    logging.getLogger(logger_name).setLevel(logging.INFO)
+
+OPTIMISERS = {
+    "anneal": run_annealing,
+    "tempering": run_tempering,
+    "tabu": run_tabu_search,
+    "genetic": run_genetic,
+    "islands": run_islands,
+}
 
 parser = argparse.ArgumentParser()
+parser.add_argument("--optimiser", choices=list(OPTIMISERS), default="anneal")
+parser.add_argument("--time-limit", type=float, help="Seconds of annealing, temperature schedule is spread over them")
+parser.add_argument("--eval-budget", type=int, help="Proposed swaps of all chains, instead of num_iters")
+parser.add_argument("--best-path", type=Path, help="File, which always has best layout so far and its score")
+parser.add_argument("--checkpoint", type=Path, help="File to periodically save state of annealing to")
+parser.add_argument("--resume", action="store_true", help="Continue annealing from --checkpoint")
+parser.add_argument(
+    "--seed", type=int, help="Seed of annealing or tabu search, seeded runs limited by cycles are reproducible"
+)
 args = complete_and_parse_args(parser)
+anneal_args = {
+    "--time-limit": args.time_limit,
+    "--eval-budget": args.eval_budget,
+    "--best-path": args.best_path,
+    "--checkpoint": args.checkpoint,
+    "--resume": args.resume,
+}
+if args.optimiser != "anneal" and any(value is not None and value is not False for value in anneal_args.values()):
+    parser.error(f"{', '.join(anneal_args)} are only supported by anneal optimiser")
+if args.seed is not None and args.optimiser not in ("anneal", "tabu"):
+    parser.error("--seed is only supported by anneal and tabu optimisers")
+if args.resume and args.checkpoint is None:
+    parser.error("--resume requires --checkpoint")
 
 
-best_layout = run_annealing(cfg, text_dir=args.text_dir, dir_weights=args.dir_weights)
+corpus = Corpus.from_dir(args.text_dir, cfg, args.cache_dir)
+if args.optimiser == "anneal":
+    best_layout = run_annealing(
+        cfg,
+        corpus=corpus,
+        dir_weights=args.dir_weights,
+        time_limit=args.time_limit,
+        eval_budget=args.eval_budget,
+        best_path=args.best_path,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        seed=args.seed,
+    )
+elif args.optimiser == "tabu":
+    best_layout = run_tabu_search(cfg, corpus, args.dir_weights, args.seed)
+else:
+    best_layout = OPTIMISERS[args.optimiser](cfg, corpus, args.dir_weights)
 print("For layouts.py:\n")
 print(best_layout.for_layout(cfg))
 print()
@@ -1,5 +1,6 @@
 import argparse
 
+from layout_optimisation.chars import CHARS_TO_TRACK
 from layout_optimisation.config import cfg
 from layout_optimisation.layouts.base import Keyboard
 from layout_optimisation.layouts.layouts import LAYOUTS
@@ -9,7 +10,6 @@ from layout_optimisation.layouts.mapper import (
     generate_key_map_template,
     generate_penalty_map,
 )
-from layout_optimisation.penalty import CHARS_TO_TRACK
 
 parser = argparse.ArgumentParser()
 parser.add_argument("name", type=str, choices=LAYOUTS.keys())